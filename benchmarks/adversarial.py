@@ -0,0 +1,74 @@
+""" Times the parser on adversarial inputs of growing size, to check that parsing time stays linear in the number of
+tokens: each pattern below makes a naive backtracking parser re-read most of the text after every failed citation.
+
+Run from the repository root with:
+
+    python -m benchmarks.adversarial [--sizes N ...]
+
+For every pattern and size, the number of state machine steps per token (counted with a ParseBudget) and the time per
+token should stay roughly flat as the size grows.
+"""
+import argparse
+import time
+
+import caseciteparser
+from caseciteparser.budget import ParseBudget
+
+
+def stringcite_chain(num_tokens):
+    """ One long chain of stringcites that never gets a date parenthetical, so every cite in it fails. """
+    chunks = []
+    for i in range(num_tokens // 3):
+        chunks.append('{} F.3d {},'.format(i + 1, i + 2))
+    return ' '.join(chunks) + ' and so on'
+
+
+def pincite_chain(num_tokens):
+    """ Like stringcite_chain, but every cite has a pincite, and the chain ends in a parenthetical that isn't closed.
+    """
+    chunks = []
+    for i in range(num_tokens // 4):
+        chunks.append('{} U.S. {}, {},'.format(i + 1, i + 2, i + 3))
+    return ' '.join(chunks) + ' (' + ' x' * 100
+
+
+def open_paren_flood(num_tokens):
+    """ Full cites whose date parentheticals are opened but never closed. """
+    return ' '.join('1 U.S. 2 (Cal.' for _ in range(num_tokens // 4))
+
+
+def reporter_flood(num_tokens):
+    """ Nothing but volumes and reporters, so every word is a possible start of a citation. """
+    return ' '.join('1 F. Supp. 2d' for _ in range(num_tokens // 4))
+
+
+PATTERNS = (stringcite_chain, pincite_chain, open_paren_flood, reporter_flood)
+
+
+def time_parse(words, engine):
+    budget = ParseBudget()
+    start = time.perf_counter()
+    caseciteparser.parse_tokens(words, engine=engine, budget=budget)
+    return time.perf_counter() - start, budget.steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 20000, 40000, 80000, 160000],
+                        help="numbers of tokens to try each pattern at")
+    args = parser.parse_args()
+
+    caseciteparser.parse_string('1 U.S. 1 (1900)')  # Load the tables
+
+    print('{:<18} {:>8} {:>10} {:>14} {:>14}'.format('pattern', 'engine', 'tokens', 'steps/token', 'usec/token'))
+    for pattern in PATTERNS:
+        for size in args.sizes:
+            words = pattern(size).split()
+            for engine in ('fsm', 'table'):
+                seconds, steps = time_parse(words, engine)
+                print('{:<18} {:>8} {:>10,} {:>14.2f} {:>14.3f}'.format(pattern.__name__, engine, len(words),
+                                                                       steps / len(words), seconds * 1e6 / len(words)))
+
+
+if __name__ == '__main__':
+    main()
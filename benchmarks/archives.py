@@ -0,0 +1,116 @@
+""" Measures how fast cases can be read (and parsed) straight out of each bulk export archive format that
+case_xml_io.iter_archive_cases supports, compared to a directory of loose case XML files.
+
+Run from the repository root with:
+
+    python -m benchmarks.archives [--cases N] [--words W] [--seed S]
+
+The same synthetic cases (see benchmarks/corpus.py) are written in every format, so the numbers are comparable.
+Throughput is given in cases per second and in megabytes of uncompressed case XML (or JSON) per second. 'members s'
+is the time parse_archive's parent process spends reading the raw cases (case_xml_io.iter_archive_members) to hand to
+its workers.
+"""
+import argparse
+import glob
+import json
+import lzma
+import os
+import tarfile
+import tempfile
+import time
+import zipfile
+
+import caseciteparser
+import case_xml_io
+from benchmarks.corpus import CitationGenerator
+
+
+def write_archives(directory, cases):
+    """ Writes cases (a list of (name, case XML) tuples) to directory in every format, and returns a list of (format,
+    path, uncompressed bytes) tuples.
+    """
+    xml_dir = os.path.join(directory, 'xml')
+    os.mkdir(xml_dir)
+    for name, case_xml in cases:
+        with open(os.path.join(xml_dir, name), 'w', encoding='utf-8') as f:
+            f.write(case_xml)
+    xml_bytes = sum(len(case_xml.encode('utf-8')) for name, case_xml in cases)
+    formats = [('directory', xml_dir, xml_bytes)]
+
+    zip_path = os.path.join(directory, 'cases.zip')
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, case_xml in cases:
+            archive.writestr(name, case_xml)
+    formats.append(('zip', zip_path, xml_bytes))
+
+    for extension, mode in (('.tar.gz', 'w:gz'), ('.tar.xz', 'w:xz')):
+        tar_path = os.path.join(directory, 'cases' + extension)
+        with tarfile.open(tar_path, mode) as archive:
+            for name in sorted(os.listdir(xml_dir)):
+                archive.add(os.path.join(xml_dir, name), arcname=name)
+        formats.append(('tar' + extension[4:], tar_path, xml_bytes))
+
+    # JSON lines in the 'text' body format, with the text the XML would have given
+    jsonl_path = os.path.join(directory, 'cases.jsonl.xz')
+    jsonl_bytes = 0
+    with lzma.open(jsonl_path, 'wb') as f:
+        for i, (name, case_xml) in enumerate(cases):
+            text = case_xml_io.get_case_text(os.path.join(xml_dir, name))
+            case = {'id': i, 'casebody': {'status': 'ok', 'data': {'head_matter': '', 'opinions': [
+                {'type': 'majority', 'author': None, 'text': text}]}}}
+            line = (json.dumps(case) + '\n').encode('utf-8')
+            jsonl_bytes += len(line)
+            f.write(line)
+    formats.append(('jsonl.xz', jsonl_path, jsonl_bytes))
+
+    return formats
+
+
+def iter_cases(path):
+    if os.path.isdir(path):
+        for xml_path in sorted(glob.glob(os.path.join(path, '*.xml'))):
+            yield xml_path, case_xml_io.get_case_text(xml_path)
+    else:
+        yield from case_xml_io.iter_archive_cases(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cases', type=int, default=500, help="number of cases in each archive")
+    parser.add_argument('--words', type=int, default=3000, help="words per case")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = CitationGenerator(args.seed)
+    cases = [('case{:06d}.xml'.format(i), generator.case_xml(args.words)) for i in range(args.cases)]
+    caseciteparser.parse_string('1 U.S. 1 (1900)')  # Load the tables
+
+    print('{:<10} {:>10} {:>10} {:>10} {:>12} {:>10} {:>12}'.format('format', 'size MB', 'members s', 'read s',
+                                                                    'read MB/s', 'parse s', 'cases/s'))
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path, num_bytes in write_archives(directory, cases):
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)) if os.path.isdir(path) \
+                else os.path.getsize(path)
+
+            start = time.perf_counter()
+            if not os.path.isdir(path):
+                for member in case_xml_io.iter_archive_members(path):
+                    pass
+            members_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            texts = [text for case_name, text in iter_cases(path)]
+            read_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for text in texts:
+                caseciteparser.parse_tokens(text.split())
+            parse_seconds = time.perf_counter() - start
+
+            print('{:<10} {:>10.1f} {:>10.3f} {:>10.3f} {:>12.1f} {:>10.3f} {:>12.0f}'.format(
+                name, size / 2 ** 20, members_seconds, read_seconds, num_bytes / 2 ** 20 / read_seconds, parse_seconds,
+                len(texts) / (read_seconds + parse_seconds)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+""" Measures building a citation index (caseciteparser/citation_index.py) over a synthetic corpus, both in one pass and
+as partial indexes merged afterwards, and the latency of lookups against it.
+
+Run from the repository root with:
+
+    python -m benchmarks.citation_index [--documents N] [--words W] [--buffer P] [--lookups L] [--seed S]
+
+Documents are parsed once up front, so the times below cover indexing only.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import caseciteparser
+from benchmarks.corpus import CitationGenerator
+from caseciteparser.citation_index import CitationIndex, build_citation_index, merge_indexes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--words', type=int, default=1000, help="words per document")
+    parser.add_argument('--buffer', type=int, default=100000, help="postings buffered before spilling a run")
+    parser.add_argument('--parts', type=int, default=4, help="partial indexes to build and merge")
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = CitationGenerator(args.seed)
+    results = [('case{:07d}'.format(i), caseciteparser.parse_string(generator.opinion(args.words)))
+               for i in range(args.documents)]
+    num_citations = sum(len(citations) for _, citations in results)
+    print('{} documents, {} citations'.format(args.documents, num_citations))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'citations.idx')
+        start = time.perf_counter()
+        build_citation_index(results, path, args.buffer)
+        seconds = time.perf_counter() - start
+        print('build: {:.2f} s ({:.0f} documents/s), {:.1f} MB'.format(
+            seconds, args.documents / seconds, os.path.getsize(path) / 2 ** 20))
+
+        part_paths = []
+        start = time.perf_counter()
+        for part in range(args.parts):
+            part_paths.append(os.path.join(directory, 'part{}.idx'.format(part)))
+            build_citation_index(results[part::args.parts], part_paths[-1], args.buffer)
+        build_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        merge_indexes(part_paths, os.path.join(directory, 'merged.idx'))
+        print('{} partial indexes: build {:.2f} s, merge {:.2f} s'.format(
+            args.parts, build_seconds, time.perf_counter() - start))
+
+        with CitationIndex(path) as index:
+            rng = random.Random(args.seed)
+            cases = list(index.iter_keys())
+            # Half of the lookups are for cases that are cited, and half for cases that aren't
+            queries = [rng.choice(cases) if i % 2 else (str(rng.randint(1, 999)), 'U.S.', str(rng.randint(1, 999)))
+                       for i in range(args.lookups)]
+
+            latencies = []
+            found = 0
+            for query in queries:
+                start = time.perf_counter()
+                found += len(index.lookup(*query))
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            print('{} keys, {} postings; lookup usec: mean {:.1f}, p50 {:.1f}, p99 {:.1f}, max {:.1f} '
+                  '({} postings found)'.format(len(index), index.num_postings, 1e6 * statistics.mean(latencies),
+                                               1e6 * latencies[len(latencies) // 2],
+                                               1e6 * latencies[int(len(latencies) * 0.99)], 1e6 * latencies[-1],
+                                               found))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+""" Generates reproducible synthetic legal text for benchmarking: prose interspersed with full cites (with pincites,
+stringcites, and date parentheticals naming courts, jurisdictions, and dates), short cites, and near misses. Reporters
+are drawn from reporters_db, and courts, jurisdictions, and months from caseciteparser.constant_data.
+"""
+import random
+from itertools import accumulate
+from xml.sax.saxutils import escape
+
+from caseciteparser import constant_data
+
+PROSE_WORDS = ("the court held that a plaintiff must show standing and the statute of limitations bars claims "
+               "filed after period expired we agree with district court's reading of section as applied here but "
+               "note defendant's argument regarding contract was waived because it raised first on appeal see "
+               "also id. at n. 3 cf. e.g., supra infra accord").split()
+
+# Words that look a little like the start of a citation but aren't one, so the parser has to reject them
+NEAR_MISS_TEMPLATES = ("{volume} {reporter} {word}", "section {volume}, {volume}", "({year})", "{volume} U.S.C. {page}",
+                       "{volume} {reporter} {page} ({word}")
+
+NAMESPACES = ('xmlns="http://www.loc.gov/METS/"',
+              'xmlns:casebody="http://nrs.harvard.edu/urn-3:HLS.Libr.US_Case_Law.Schema.Case_Body:v1"')
+
+
+def get_reporter_names():
+    """ Returns every reporter edition and variation in reporters_db, as it would appear in text. """
+    from reporters_db import REPORTERS
+
+    names = []
+    for reporter_data in REPORTERS.values():
+        names.extend(reporter_data[0]['editions'])
+        names.extend(reporter_data[0]['variations'])
+    return sorted(set(names))
+
+
+class CitationGenerator:
+    """ Generates random citations and opinion text from a seeded random number generator.
+
+    By default every date parenthetical is made up afresh. Real text repeats the same few (e.g., '(7th Cir. 1994)')
+    over and over; to mimic that, pass distinct_parentheticals, and date parentheticals are instead drawn from a pool of
+    that many, with Zipf weights (the k-th most common is 1/k as likely as the most common).
+    """
+
+    def __init__(self, seed=0, distinct_parentheticals=None):
+        self.rng = random.Random(seed)
+        self.reporters = get_reporter_names()
+        # Real text cites a handful of reporters far more often than the rest
+        self.common_reporters = ['U.S.', 'F.3d', 'F.2d', 'F. Supp.', 'F. Supp. 2d', 'S. Ct.', 'N.E.2d', 'A.2d',
+                                 'P.3d', 'So. 2d', 'Cal. Rptr. 3d', 'Ill. App. 3d']
+
+        self.parenthetical_pool = None
+        if distinct_parentheticals:
+            self.parenthetical_pool = [self.new_date_parenthetical() for _ in range(distinct_parentheticals)]
+            self.parenthetical_weights = list(accumulate(1 / rank for rank in range(1, distinct_parentheticals + 1)))
+
+    def reporter(self):
+        if self.rng.random() < 0.7:
+            return self.rng.choice(self.common_reporters)
+        return self.rng.choice(self.reporters)
+
+    def number(self, low=1, high=1999):
+        return str(self.rng.randint(low, high))
+
+    def date_parenthetical(self):
+        if self.parenthetical_pool is not None:
+            return self.rng.choices(self.parenthetical_pool, cum_weights=self.parenthetical_weights)[0]
+        return self.new_date_parenthetical()
+
+    def new_date_parenthetical(self):
+        rng = self.rng
+        parts = []
+        kind = rng.random()
+        if kind < 0.3:
+            parts.append(rng.choice(constant_data.COURT_ABBREVIATIONS))
+            parts.append(rng.choice(constant_data.GEOGRAPHIC_ABBREVIATIONS))
+        elif kind < 0.5:
+            parts.append(rng.choice(constant_data.GEOGRAPHIC_ABBREVIATIONS))
+            parts.append(rng.choice(constant_data.COURT_ABBREVIATIONS))
+        elif kind < 0.6:
+            parts.append(rng.choice(constant_data.COURT_ABBREVIATIONS))
+        if rng.random() < 0.1:
+            parts.append(rng.choice(constant_data.MONTH_ABBREVIATIONS))
+            parts.append(self.number(1, 28) + ',')
+        parts.append(self.number(1850, 2020))
+        return '(' + ' '.join(parts) + ')'
+
+    def full_cite(self):
+        rng = self.rng
+        first_page = int(self.number(1, 1500))
+        words = [self.number(1, 999), self.reporter()]
+
+        has_pincite = rng.random() < 0.6
+        num_stringcites = rng.choice((0, 0, 0, 1, 1, 2))
+        if has_pincite:
+            words.append(str(first_page) + ',')
+            words.append(str(first_page + rng.randint(0, 30)) + (',' if num_stringcites else ''))
+        else:
+            words.append(str(first_page) + (',' if num_stringcites else ''))
+
+        for i in range(num_stringcites):
+            last = i == num_stringcites - 1
+            words += [self.number(1, 999), self.reporter(), self.number(1, 1500) + ('' if last else ',')]
+
+        words.append(self.date_parenthetical())
+        return ' '.join(words) + rng.choice(('.', ',', ';', ''))
+
+    def short_cite(self):
+        return '{} {} at {}{}'.format(self.number(1, 999), self.reporter(), self.number(1, 1500),
+                                      self.rng.choice(('.', ',', ';', '')))
+
+    def near_miss(self):
+        return self.rng.choice(NEAR_MISS_TEMPLATES).format(volume=self.number(1, 999), reporter=self.reporter(),
+                                                          page=self.number(), year=self.number(1850, 2020),
+                                                          word=self.rng.choice(PROSE_WORDS))
+
+    def citation(self):
+        return self.full_cite() if self.rng.random() < 0.75 else self.short_cite()
+
+    def opinion_words(self, num_words, citations_per_1000_words=10.0):
+        """ Returns a list of roughly num_words chunks of text (single prose words, or whole citations), with the given
+        density of citations and as many near misses.
+        """
+        rng = self.rng
+        probability = citations_per_1000_words / 1000.0
+        chunks = []
+        for _ in range(num_words):
+            roll = rng.random()
+            if roll < probability:
+                chunks.append(self.citation())
+            elif roll < 2 * probability:
+                chunks.append(self.near_miss())
+            else:
+                chunks.append(rng.choice(PROSE_WORDS))
+        return chunks
+
+    def opinion(self, num_words, citations_per_1000_words=10.0):
+        """ Returns the text of an opinion of roughly num_words words. """
+        return ' '.join(self.opinion_words(num_words, citations_per_1000_words))
+
+    def paragraphs(self, num_words, citations_per_1000_words=10.0, words_per_paragraph=120):
+        chunks = self.opinion_words(num_words, citations_per_1000_words)
+        return [' '.join(chunks[i:i + words_per_paragraph]) for i in range(0, len(chunks), words_per_paragraph)]
+
+    def case_xml(self, num_words, citations_per_1000_words=10.0, num_footnotes=3):
+        """ Returns a METS case XML document, in the shape case_xml_io.get_case_text expects, whose case body holds an
+        opinion of roughly num_words words (with soft hyphens) and a few labelled footnotes.
+        """
+        paragraphs = ['<casebody:p>{}</casebody:p>'.format(escape(paragraph.replace('ea', 'e\xada')))
+                      for paragraph in self.paragraphs(num_words, citations_per_1000_words)]
+        footnotes = ['<casebody:footnote label="{0}"><casebody:p>{0} {1}</casebody:p></casebody:footnote>'.format(
+            i + 1, escape(self.opinion(40, citations_per_1000_words))) for i in range(num_footnotes)]
+
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n<mets {}><fileSec><fileGrp><file><FContent><xmlData>'
+                '<casebody:casebody><casebody:opinion>{}{}</casebody:opinion></casebody:casebody>'
+                '</xmlData></FContent></file></fileGrp></fileSec></mets>\n').format(' '.join(NAMESPACES),
+                                                                                   '\n'.join(paragraphs),
+                                                                                   '\n'.join(footnotes))
+
+    def paren_strings(self, count):
+        """ Returns count date parenthetical contents, as parenthetical_fsm receives them. """
+        return [self.date_parenthetical()[1:-1] for _ in range(count)]
@@ -0,0 +1,57 @@
+""" Measures how long it takes a fresh interpreter to import caseciteparser and parse its first citation.
+
+Run from the repository root with:
+
+    python -m benchmarks.import_time [--runs N]
+
+Three scenarios are timed, each in a new interpreter:
+    eager build: what every import used to cost, i.e. importing the package and building the tables from reporters_db;
+    cold artifact: the first run after reporters_db changes, which builds the tables and saves the artifact;
+    warm artifact: every later run, which loads the precompiled artifact on first lookup.
+The import alone (no lookup, so no tables) is also reported.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+IMPORT_ONLY = "import caseciteparser"
+FIRST_PARSE = "import caseciteparser; caseciteparser.parse_string('343 U.S. 579 (1952)')"
+EAGER_BUILD = "import caseciteparser; from caseciteparser import constant_data; constant_data.build_tables()"
+
+
+def time_run(code, cache_dir, clear_cache=False):
+    if clear_cache:
+        for name in os.listdir(cache_dir):
+            os.unlink(os.path.join(cache_dir, name))
+
+    env = dict(os.environ, CASECITEPARSER_CACHE_DIR=cache_dir)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], env=env, check=True)
+    return time.perf_counter() - start
+
+
+def report(name, times):
+    print("{:<16} median {:7.1f} ms   min {:7.1f} ms".format(name, 1000 * statistics.median(times),
+                                                           1000 * min(times)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        baseline = [time_run("pass", cache_dir) for _ in range(args.runs)]
+        report("interpreter", baseline)
+        report("import only", [time_run(IMPORT_ONLY, cache_dir) for _ in range(args.runs)])
+        report("eager build", [time_run(EAGER_BUILD, cache_dir) for _ in range(args.runs)])
+        report("cold artifact", [time_run(FIRST_PARSE, cache_dir, clear_cache=True) for _ in range(args.runs)])
+        report("warm artifact", [time_run(FIRST_PARSE, cache_dir) for _ in range(args.runs)])
+
+
+if __name__ == '__main__':
+    main()
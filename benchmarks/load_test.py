@@ -0,0 +1,136 @@
+""" Load-tests the parse service (caseciteparser/server.py): many concurrent clients each send a stream of documents,
+and the latency of every request and the overall throughput are reported.
+
+Run from the repository root with:
+
+    python -m benchmarks.load_test [--clients C] [--requests R] [--words W] [--workers N]
+
+By default a server is started for the duration of the test; pass --host/--port or --unix-socket to test a server
+that is already running instead. Each client keeps one connection open and sends its next request as soon as the
+previous one is answered. Requests refused with 503 (backpressure) are counted separately and left out of the
+latencies.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from benchmarks.corpus import CitationGenerator
+from caseciteparser.server import DEFAULT_PORT, ParseServer
+
+
+async def post(reader, writer, path, data):
+    """ Sends one POST request on an open connection and returns (status, decoded JSON response). """
+    body = json.dumps(data).encode('utf-8')
+    writer.write('POST {} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                 '\r\n'.format(path, len(body)).encode('latin-1') + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def open_connection(host, port, unix_socket):
+    if unix_socket is not None:
+        return await asyncio.open_unix_connection(unix_socket)
+    return await asyncio.open_connection(host, port)
+
+
+async def run_client(documents, num_requests, host, port, unix_socket, latencies, counts):
+    reader, writer = await open_connection(host, port, unix_socket)
+    try:
+        for i in range(num_requests):
+            start = time.perf_counter()
+            status, response = await post(reader, writer, '/parse', {'text': documents[i % len(documents)]})
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+                counts['citations'] += len(response['citations'])
+            else:
+                counts[status] = counts.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run_load_test(args, documents, host, port, unix_socket):
+    latencies = []
+    counts = {'citations': 0}
+
+    # One warm-up request, so connection setup and the first batch don't count
+    reader, writer = await open_connection(host, port, unix_socket)
+    await post(reader, writer, '/parse', {'text': documents[0]})
+    writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(documents[c::args.clients] or documents, args.requests, host, port,
+                                      unix_socket, latencies, counts)
+                           for c in range(args.clients)])
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    print('{} clients x {} requests of {} words: {:.2f} s'.format(args.clients, args.requests, args.words, seconds))
+    print('  throughput: {:.0f} requests/s, {:.0f} words/s'.format(
+        len(latencies) / seconds, len(latencies) * args.words / seconds))
+    if latencies:
+        print('  latency ms: mean {:.2f}, p50 {:.2f}, p90 {:.2f}, p99 {:.2f}, max {:.2f}'.format(
+            1000 * statistics.mean(latencies), *[1000 * percentile(latencies, p) for p in (50, 90, 99, 100)]))
+    print('  citations found: {}, refused (503): {}, other errors: {}'.format(
+        counts['citations'], counts.get(503, 0), sum(n for s, n in counts.items() if s not in ('citations', 503))))
+
+
+def percentile(sorted_values, p):
+    """ Returns the p-th percentile (nearest rank) of a sorted list. """
+    rank = max(int(round(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+async def main_async(args):
+    generator = CitationGenerator(args.seed)
+    documents = [generator.opinion(args.words) for _ in range(min(args.clients * args.requests, 1000))]
+
+    if args.port is not None or args.unix_socket is not None:
+        await run_load_test(args, documents, args.host, args.port or DEFAULT_PORT, args.unix_socket)
+        return
+
+    # Start a server of our own, on a Unix socket in a temporary directory
+    with tempfile.TemporaryDirectory() as directory:
+        unix_socket = os.path.join(directory, 'parse.sock')
+        server = ParseServer(workers=args.workers, batch_size=args.batch_size, batch_delay=args.batch_delay,
+                             max_queue=args.max_queue)
+        await server.start(unix_socket=unix_socket)
+        try:
+            await run_load_test(args, documents, None, None, unix_socket)
+            print('  batches: {} ({:.1f} documents each)'.format(server.batches,
+                                                                 server.documents / max(server.batches, 1)))
+        finally:
+            await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=64, help="number of concurrent clients")
+    parser.add_argument('--requests', type=int, default=100, help="requests sent by each client")
+    parser.add_argument('--words', type=int, default=500, help="words per document")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1', help="host of a running server to test")
+    parser.add_argument('--port', type=int, help="port of a running server to test")
+    parser.add_argument('--unix-socket', help="Unix socket of a running server to test")
+    parser.add_argument('--workers', type=int, help="worker processes of the server started for the test")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--batch-delay', type=float, default=0.002)
+    parser.add_argument('--max-queue', type=int, default=1024)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
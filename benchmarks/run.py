@@ -0,0 +1,250 @@
+""" Runs the caseciteparser benchmark suite on a synthetic corpus (see benchmarks/corpus.py).
+
+Run from the repository root with:
+
+    python -m benchmarks.run [--words N] [--density D] [--seed S] [--only NAME ...]
+
+Each benchmark reports throughput and the peak memory traced while it ran (memory allocated by Python; lxml's own
+buffers aren't included). The corpus is generated from --seed, so runs with the same arguments parse exactly the same
+text and can be compared before and after a change.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import case_xml_io
+import caseciteparser
+from benchmarks import import_time
+from benchmarks.corpus import CitationGenerator
+from caseciteparser import cite_parser, constant_data
+from caseciteparser.counts import CitationCounts
+
+
+class Result:
+    def __init__(self, name, seconds, peak_bytes, counts):
+        self.name = name
+        self.seconds = seconds
+        self.peak_bytes = peak_bytes
+        self.counts = counts
+
+    def __str__(self):
+        rates = '  '.join('{:>12,.0f} {}/s'.format(count / self.seconds, unit) for unit, count in self.counts.items())
+        return '{:<28} {:8.3f} s  {:8.1f} MB peak  {}'.format(self.name, self.seconds, self.peak_bytes / 2 ** 20, rates)
+
+
+def measure(name, fn, repeat=3):
+    """ Runs fn() repeat times and returns a Result with the fastest time and the peak traced memory of one more run.
+    fn returns a dict of {unit: count} describing the work it did (e.g., {'tokens': 100000}).
+    """
+    fn()  # Warm up (and load the tables)
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        counts = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    fn()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return Result(name, best, peak_bytes, counts)
+
+
+def bench_parse_string(text, engine):
+    def run():
+        citations = caseciteparser.parse_string(text, engine=engine)
+        return {'tokens': num_tokens, 'cites': len(citations)}
+
+    num_tokens = len(text.split())
+    return run
+
+
+def bench_parse_spans(text, engine):
+    def run():
+        citations = caseciteparser.parse_spans(text, engine=engine)
+        return {'tokens': num_tokens, 'cites': len(citations)}
+
+    num_tokens = len(text.split())
+    return run
+
+
+def bench_parse_many(rows, batched=False, workers=None):
+    def run():
+        if batched:
+            results = caseciteparser.parse_many(rows, workers=workers)
+        else:
+            results = [caseciteparser.parse_string(row) for row in rows]
+        return {'rows': len(rows), 'cites': sum(map(len, results))}
+
+    return run
+
+
+def run_parse_many(args, generator):
+    """ Compares parse_string on each of many short citation strings with parse_many over all of them, for distinct
+    strings and for rows that repeat (as database columns do).
+    """
+    citations = [generator.citation() for _ in range(args.rows)]
+    repeated = [generator.rng.choice(citations[:args.rows // 10]) for _ in range(args.rows)]
+    for name, rows in (('distinct', citations), ('repeated', repeated)):
+        print(measure('parse_string rows ' + name, bench_parse_many(rows)))
+        print(measure('  parse_many', bench_parse_many(rows, batched=True)))
+        print(measure('  parse_many workers=4', bench_parse_many(rows, batched=True, workers=4), repeat=1))
+
+
+def bench_parse_tokens_workers(words, workers=None):
+    def run():
+        citations = caseciteparser.parse_tokens(words, engine='table', workers=workers)
+        return {'tokens': len(words), 'cites': len(citations)}
+
+    return run
+
+
+def bench_count_citations(text, from_dicts=False):
+    def run():
+        counts = CitationCounts()
+        if from_dicts:
+            counts.add_citations(caseciteparser.parse_string(text, engine='table'))
+        else:
+            counts.add_string(text)
+        return {'tokens': num_tokens, 'cites': counts.citations}
+
+    num_tokens = len(text.split())
+    return run
+
+
+def bench_find_reporter_at_index(words):
+    def run():
+        for i in range(len(words)):
+            find_reporter_at_index(words, i)
+        return {'lookups': len(words)}
+
+    find_reporter_at_index = constant_data.find_reporter_at_index
+    return run
+
+
+def bench_parenthetical_fsm(paren_strings, cached=False):
+    def run():
+        for paren_string in paren_strings:
+            parenthetical_fsm(paren_string)
+        return {'parens': len(paren_strings)}
+
+    parenthetical_fsm = cite_parser.cached_parenthetical_fsm if cached else cite_parser.parenthetical_fsm
+    return run
+
+
+def run_parenthetical_cache(args):
+    """ Compares parsing date parentheticals with and without the cache, both on their own and as part of
+    parse_string, for made-up parentheticals and for ones repeated as often as in real text.
+    """
+    for name, distinct in (('uniform', None), ('zipf', args.distinct_parentheticals)):
+        generator = CitationGenerator(args.seed, distinct)
+        paren_strings = generator.paren_strings(50000)
+        text = generator.opinion(args.words, args.density)
+
+        print(measure('parenthetical_fsm ' + name, bench_parenthetical_fsm(paren_strings)))
+        result = measure('  cached', bench_parenthetical_fsm(paren_strings, cached=True))
+        # The hit rate of one pass, starting from an empty cache (measure makes several)
+        cite_parser.clear_parenthetical_cache()
+        bench_parenthetical_fsm(paren_strings, cached=True)()
+        info = cite_parser.parenthetical_cache_info()
+        print('{}  hit rate {:.1%}'.format(result, info.hits / (info.hits + info.misses)))
+
+        for size in (0, cite_parser.PARENTHETICAL_CACHE_SIZE):
+            cite_parser.set_parenthetical_cache_size(size)
+            print(measure('  parse_string cache={}'.format(size), bench_parse_string(text, 'table')))
+
+
+def bench_get_case_text(paths, pyquery=False):
+    def run():
+        for path in paths:
+            case_xml_io.get_case_text(case_xml_io.parse_file(path) if pyquery else path)
+        return {'files': len(paths), 'MB': num_bytes / 2 ** 20}
+
+    num_bytes = sum(os.path.getsize(path) for path in paths)
+    return run
+
+
+def run_import_time(runs):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        import_time.time_run(import_time.FIRST_PARSE, cache_dir)  # Build the artifact
+        seconds = min(import_time.time_run(import_time.FIRST_PARSE, cache_dir) for _ in range(runs))
+        interpreter = min(import_time.time_run('pass', cache_dir) for _ in range(runs))
+    print('{:<28} {:8.3f} s  (interpreter startup {:.3f} s)'.format('import + first parse', seconds, interpreter))
+
+
+BENCHMARKS = ('parse_string', 'parse_spans', 'parse_many', 'parallel', 'count_citations', 'find_reporter_at_index',
+              'parenthetical_fsm', 'parenthetical_cache', 'get_case_text', 'import_time')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--words', type=int, default=200000, help="number of words in the synthetic opinion text")
+    parser.add_argument('--density', type=float, default=10.0, help="citations per 1000 words")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--files', type=int, default=20, help="number of case XML files for get_case_text")
+    parser.add_argument('--rows', type=int, default=50000, help="number of citation strings for parse_many")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes for parallel")
+    parser.add_argument('--distinct-parentheticals', type=int, default=2000,
+                        help="size of the pool of date parentheticals for the zipf parenthetical_cache run")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    args = parser.parse_args()
+
+    generator = CitationGenerator(args.seed)
+    text = generator.opinion(args.words, args.density)
+    words = text.split()
+    print('Corpus: {:,} tokens, {:.1f} citations per 1000 words, seed {}'.format(len(words), args.density, args.seed))
+
+    if 'parse_string' in args.only:
+        for engine in ('fsm', 'table'):
+            print(measure('parse_string engine=' + engine, bench_parse_string(text, engine)))
+
+    if 'parse_spans' in args.only:
+        for engine in ('fsm', 'table'):
+            print(measure('parse_spans engine=' + engine, bench_parse_spans(text, engine)))
+        print(measure('parse_spans bytes', bench_parse_spans(text.encode('utf-8'), 'table')))
+
+    if 'parse_many' in args.only:
+        run_parse_many(args, generator)
+
+    if 'parallel' in args.only:
+        # One much longer document, so each worker gets a chunk of a useful size
+        long_words = words * 10
+        print(measure('parse_tokens x10 engine=table', bench_parse_tokens_workers(long_words), repeat=1))
+        print(measure('  workers={}'.format(args.workers), bench_parse_tokens_workers(long_words, args.workers),
+                      repeat=1))
+
+    if 'count_citations' in args.only:
+        print(measure('count from parse_string', bench_count_citations(text, from_dicts=True)))
+        print(measure('CitationCounts.add_string', bench_count_citations(text)))
+
+    if 'find_reporter_at_index' in args.only:
+        print(measure('find_reporter_at_index', bench_find_reporter_at_index(words)))
+
+    if 'parenthetical_fsm' in args.only:
+        print(measure('parenthetical_fsm', bench_parenthetical_fsm(generator.paren_strings(50000))))
+
+    if 'parenthetical_cache' in args.only:
+        run_parenthetical_cache(args)
+
+    if 'get_case_text' in args.only:
+        with tempfile.TemporaryDirectory() as xml_dir:
+            paths = []
+            for i in range(args.files):
+                path = os.path.join(xml_dir, 'case{}.xml'.format(i))
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(generator.case_xml(args.words // args.files, args.density))
+                paths.append(path)
+            print(measure('get_case_text', bench_get_case_text(paths), repeat=1))
+            print(measure('get_case_text (PyQuery)', bench_get_case_text(paths, pyquery=True), repeat=1))
+
+    if 'import_time' in args.only:
+        run_import_time(runs=5)
+
+
+if __name__ == '__main__':
+    main()
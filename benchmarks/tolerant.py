@@ -0,0 +1,102 @@
+""" Compares the tolerant token dicts (the default) with exact ones (constant_data.build_tables(tolerant=False)): recall
+on citations whose reporters or courts are written with the spacing, apostrophe, and trailing comma variants found in
+real (and OCRed) text, and throughput on clean text.
+
+Run from the repository root with:
+
+    python -m benchmarks.tolerant [--citations N] [--words W] [--seed S]
+
+Each test citation is written once as generated and once with a variant of its reporter (e.g., 'F.Supp.2d' or
+'F. Supp.2d' for 'F. Supp. 2d', 'N. E. 2d' for 'N.E.2d', 'F. App’x' for "F. App'x"), of its date parenthetical's
+court ("(App. Dep't 1990)" for '(App. Dep’t 1990)'), or as a short cite with a comma after the reporter
+('343 U.S., at 585'). A variant counts as found if it parses to the same reporter (and court, for the court
+variants) as the citation as generated.
+"""
+import argparse
+import time
+
+from benchmarks.corpus import CitationGenerator
+from caseciteparser import cite_parser, constant_data, token_dict
+
+
+def make_test_citations(generator, count):
+    """ Returns a list of (kind, citation as generated, variant) tuples. """
+    rng = generator.rng
+    # Courts with a variant other than a trailing comma
+    courts = [court for court in constant_data.COURT_ABBREVIATIONS
+              if len(token_dict.get_token_string_variants(court)) > 2]
+    tests = []
+    while len(tests) < count:
+        volume, page, year = generator.number(1, 999), generator.number(1, 1500), generator.number(1850, 2020)
+        kind = rng.choice(('reporter', 'court', 'comma'))
+        if kind == 'reporter':
+            reporter = generator.reporter()
+            variants = [' '.join(tokens) for tokens in token_dict.get_token_string_variants(reporter)
+                        if not tokens[-1].endswith(',')][1:]
+            if not variants:
+                continue
+            tests.append((kind, '{} {} {} ({})'.format(volume, reporter, page, year),
+                          '{} {} {} ({})'.format(volume, rng.choice(variants), page, year)))
+        elif kind == 'court':
+            court = rng.choice(courts)
+            variant = ' '.join(rng.choice(token_dict.get_token_string_variants(court)[1:]))
+            tests.append((kind, '{} F.3d {} ({} {})'.format(volume, page, court, year),
+                          '{} F.3d {} ({} {})'.format(volume, page, variant, year)))
+        else:
+            reporter = generator.reporter()
+            tests.append((kind, '{} {} at {}'.format(volume, reporter, page),
+                          '{} {}, at {}'.format(volume, reporter, page)))
+    return tests
+
+
+def get_found(kind, citation, variant):
+    """ Returns True if variant parsed to the same citation data that matters for its kind as citation did. """
+    def key(string):
+        cites = cite_parser.parse_string(string)
+        if not cites or cites[0]['start_index'] != 0:
+            return None
+        return cites[0]['reporter'], cites[0].get('court_type') if kind == 'court' else None
+
+    expected = key(citation)
+    return expected is not None and key(variant) == expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--citations', type=int, default=3000, help="number of variant citations for recall")
+    parser.add_argument('--words', type=int, default=200000, help="words of clean text for throughput")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = CitationGenerator(args.seed)
+    tests = make_test_citations(generator, args.citations)
+    words = generator.opinion(args.words).split()
+
+    tolerant_tables = {name: getattr(constant_data, name) for name in constant_data.TABLE_NAMES}
+    exact_tables = constant_data.build_tables(tolerant=False)
+
+    print('{:<10} {:>10} {:>10} {:>10} {:>12} {:>10}'.format('tables', 'reporter', 'court', 'comma', 'tokens/s',
+                                                             'cites'))
+    for name, tables in (('exact', exact_tables), ('tolerant', tolerant_tables)):
+        constant_data.set_tables(tables)
+        recall = {}
+        for kind in ('reporter', 'court', 'comma'):
+            kind_tests = [test for test in tests if test[0] == kind]
+            recall[kind] = sum(get_found(*test) for test in kind_tests) / max(len(kind_tests), 1)
+
+        cite_parser.parse_tokens(words)
+        seconds = min(timed_parse(words) for _ in range(3))
+        print('{:<10} {:>10.1%} {:>10.1%} {:>10.1%} {:>12,.0f} {:>10}'.format(
+            name, recall['reporter'], recall['court'], recall['comma'], len(words) / seconds,
+            len(cite_parser.parse_tokens(words))))
+    constant_data.set_tables(tolerant_tables)
+
+
+def timed_parse(words):
+    start = time.perf_counter()
+    cite_parser.parse_tokens(words, engine='table')
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    main()
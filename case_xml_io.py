@@ -1,4 +1,22 @@
+import bz2
+import gzip
+import io
+import json
+import lzma
+import tarfile
+import traceback
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from operator import itemgetter
+from os import cpu_count
+
+from lxml import etree
 from pyquery import PyQuery
+from pyquery.text import extract_text, squash_html_whitespace
+
+import caseciteparser
 
 ### stuff for loading and parsing case xml ###
 
@@ -12,13 +30,26 @@ namespaces = {
 }
 
 
+PARAGRAPH_TAG = '{%s}p' % namespaces['casebody']
+FOOTNOTE_TAG = '{%s}footnote' % namespaces['casebody']
+
+# The whitespace characters, other than ' ', that PyQuery's text extraction squashes into a single space
+SQUASHED_WHITESPACE = ('\t', '\n', '\x0c', '\r', u'\u200b')
+
+
 def parse_file(path):
     return PyQuery(url=path, opener=open, encoding='UTF-8', parser='xml', namespaces=namespaces)
 
 
 def get_case_text(case):
-    if type(case) == str and case[-4:] == '.xml':
-        case = parse_file(case)
+    """ Returns the text of a case: its casebody paragraphs, separated by blank lines, with footnote labels and soft
+    hyphens removed.
+
+    :param case: The path to a case XML file or a binary file-like object holding one (read with iter_case_paragraphs,
+        without building a DOM), or a PyQuery object returned by parse_file. Any other string gives ''.
+    """
+    if (type(case) == str and case[-4:] == '.xml') or hasattr(case, 'read'):
+        return "\n\n".join(iter_case_paragraphs(case))
     elif type(case) == str:
         return ''
 
@@ -38,10 +69,388 @@ def get_case_text(case):
     return text
 
 
-def print_file_contents(filename):
+def iter_case_paragraphs(source):
+    """ Yields the text of each casebody paragraph of a case XML file, in document order, exactly as get_case_text
+    would produce it for a PyQuery DOM of the file (footnote labels and soft hyphens removed).
+
+    The file is read with an event-driven parser, and each paragraph is freed as soon as its text has been taken, so
+    memory use doesn't grow with the size of the file.
+
+    :param source: A path or a binary file-like object.
+    """
+    for paragraph in iter_paragraph_elements(source):
+        if len(paragraph) == 0:
+            text = get_plain_paragraph_text(paragraph.text)
+        else:
+            text = extract_text(paragraph)
+
+        # strip soft hyphens from line endings
+        yield text.replace(u'\xad', '')
+
+
+def get_plain_paragraph_text(text):
+    """ Returns what PyQuery's extract_text gives for an element with no children and the given text: the text with
+    runs of HTML whitespace squashed to a single space, stripped. Most paragraphs have nothing to squash, so that's
+    checked first.
+    """
+    if text is None:
+        return ''
+    if '  ' in text or any(char in text for char in SQUASHED_WHITESPACE):
+        text = squash_html_whitespace(text)
+    return text.strip()
+
+
+def iter_case_tokens(source):
+    """ Yields the word tokens of a case XML file (i.e., get_case_text(path).split()) as they are read, for passing
+    straight to caseciteparser.parse_stream or parse_tokens.
+
+    :param source: A path or a binary file-like object.
+    """
+    for paragraph in iter_paragraph_elements(source):
+        if len(paragraph) == 0 and paragraph.text is not None:
+            # A paragraph of plain text splits the same without extract_text's whitespace squashing, except that it
+            # also treats zero-width spaces as spaces
+            yield from paragraph.text.replace(u'\xad', '').replace(u'\u200b', ' ').split()
+        else:
+            yield from extract_text(paragraph).replace(u'\xad', '').split()
+
+
+def iter_paragraph_elements(source):
+    """ Yields the casebody paragraph elements of a case XML file in document order, with the labels stripped from
+    the start of footnotes, as the file is read. Each element (and everything before it) is freed once the next one
+    is requested, so don't hold on to them.
+
+    :param source: A path or a binary file-like object.
+    """
+    labels = {}  # The first child of each footnote that has a label, and the label to strip from its text
+    paragraphs = []  # The paragraphs started within the outermost open paragraph, in document order
+    open_paragraphs = 0
+
+    for event, elem in etree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == PARAGRAPH_TAG:
+                open_paragraphs += 1
+                paragraphs.append(elem)
+
+            parent = elem.getparent()
+            if parent is not None and parent.tag == FOOTNOTE_TAG and parent[0] is elem:
+                label = parent.get('label')
+                if label:
+                    labels[elem] = label
+            continue
+
+        # strip labels from footnotes:
+        label = labels.pop(elem, None)
+        if label is not None and elem.text is not None and elem.text.startswith(label):
+            elem.text = elem.text[len(label):]
+
+        if elem.tag == PARAGRAPH_TAG:
+            open_paragraphs -= 1
+
+        if open_paragraphs == 0:
+            yield from paragraphs
+            paragraphs.clear()
+
+            # Nothing outside an open paragraph is looked at again once it ends
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
 
-    pq = parse_file(filename)
 
-    file_text = get_case_text(pq)
+def parse_case_stream(source):
+    """ Returns a generator of the citations in a case XML file (see caseciteparser.parse_stream), reading the file
+    incrementally, so that neither its XML tree nor its full text is ever held in memory.
+
+    :param source: A path or a binary file-like object.
+    """
+    return caseciteparser.parse_stream(iter_case_tokens(source))
+
+
+def print_file_contents(filename):
+
+    file_text = get_case_text(filename)
 
     print(file_text)
+
+
+### stuff for reading cases out of bulk export archives ###
+
+# The size of the reads made from compressed archives
+READ_BUFFER_SIZE = 1 << 20
+
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+JSONL_EXTENSIONS = ('.jsonl', '.jsonl.gz', '.jsonl.bz2', '.jsonl.xz')
+
+# The function opening each kind of compressed file, by extension
+DECOMPRESSORS = {
+    '.gz': gzip.open,
+    '.tgz': gzip.open,
+    '.bz2': bz2.open,
+    '.tbz2': bz2.open,
+    '.xz': lzma.open,
+    '.txz': lzma.open,
+}
+
+
+def iter_archive_cases(path):
+    """ Yields (name, text) for each case in a bulk export archive, decompressing it as it is read, without extracting
+    anything to disk. The format is picked from the file name: a .zip or a tar (.tar, .tar.gz, .tgz, .tar.bz2, .tar.xz)
+    of case XML files, or a JSON lines file of cases (.jsonl, possibly compressed: .jsonl.gz, .jsonl.bz2, .jsonl.xz).
+
+    :param path: The path to the archive.
+    :return: A generator of (name, text) tuples, where text is what get_case_text returns for the case, and name is
+        the path of the XML file within the archive or the 'id' of the JSON case.
+    """
+    return ((name, get_member_text(member)) for name, member in iter_archive_members(path))
+
+
+def iter_archive_members(path):
+    """ Yields (name, member) for each case in a bulk export archive (see iter_archive_cases), without extracting its
+    text: member is either the bytes of a case XML file, or a JSON case. get_member_text(member) returns the text.
+    """
+    if path.endswith('.zip'):
+        return iter_zip_members(path)
+    elif path.endswith(TAR_EXTENSIONS):
+        return iter_tar_members(path)
+    elif path.endswith(JSONL_EXTENSIONS):
+        return iter_jsonl_members(path)
+    raise ValueError("Unknown archive format: {}".format(path))
+
+
+def get_member_text(member):
+    """ Returns the text of a case yielded by iter_archive_members, as get_case_text would extract it. """
+    if isinstance(member, bytes):
+        return get_case_text(io.BytesIO(member))
+    return get_json_case_text(member)
+
+
+def open_archive(path):
+    """ Opens a file, decompressing it if its extension says it is compressed, for reading as a stream of bytes in
+    reads of READ_BUFFER_SIZE.
+    """
+    opener = open
+    for extension, decompressor in DECOMPRESSORS.items():
+        if path.endswith(extension):
+            opener = decompressor
+    return io.BufferedReader(opener(path, 'rb'), READ_BUFFER_SIZE)
+
+
+def iter_zip_members(path):
+    """ Yields (name, XML bytes) for each case XML file in a zip archive, in the order they are stored. """
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.infolist():
+            if not member.is_dir() and member.filename.endswith('.xml'):
+                yield member.filename, archive.read(member)
+
+
+def iter_tar_members(path):
+    """ Yields (name, XML bytes) for each case XML file in a (possibly compressed) tar archive, reading it as a
+    stream.
+    """
+    with open_archive(path) as f, tarfile.open(fileobj=f, mode='r|') as archive:
+        for member in archive:
+            if member.isfile() and member.name.endswith('.xml'):
+                yield member.name, archive.extractfile(member).read()
+
+
+def iter_jsonl_members(path):
+    """ Yields (id, case) for each case in a (possibly compressed) JSON lines bulk export, one case per line. """
+    with open_archive(path) as f:
+        for line in f:
+            if line.strip():
+                case = json.loads(line)
+                yield str(case.get('id')), case
+
+
+def get_json_case_text(case):
+    """ Returns the text of a case from a JSON bulk export: the head matter and opinions of a case body in the 'text'
+    format, separated by blank lines, or the paragraphs of a case body in the 'xml' format as get_case_text would
+    extract them.
+    """
+    data = case['casebody']['data']
+
+    if isinstance(data, str):
+        return get_case_text(io.BytesIO(data.encode('utf-8')))
+
+    text_strings = [data.get('head_matter') or '']
+    text_strings.extend(opinion.get('text') or '' for opinion in data.get('opinions', ()))
+    text = "\n\n".join(text_string for text_string in text_strings if text_string)
+
+    # strip soft hyphens from line endings
+    return text.replace(u'\xad', '')
+
+
+def parse_archive(path, workers=None, max_pending=None, on_error=None, cache_dir=None, **parse_kwargs):
+    """ Parses every case in a bulk export archive (see iter_archive_cases) for citations, and yields (name,
+    citations) tuples as the cases finish, in completion order. The archive is read (and decompressed) in the current
+    process, and the raw case XML or JSON case is sent to a pool of worker processes, which extract its text and parse
+    it, as in parse_corpus.
+
+    Args:
+        path: the path to the archive.
+        workers, max_pending, on_error, cache_dir, **parse_kwargs: as in parse_corpus (on_error gets the name of the
+            case).
+
+    Returns:
+        A generator of (name, citations) tuples, where citations is the list returned by caseciteparser.parse_tokens.
+    """
+    _check_cache_kwargs(cache_dir, parse_kwargs)
+    return _run_corpus(partial(_parse_archive_member, cache_dir=cache_dir), iter_archive_members(path), workers,
+                       max_pending, on_error, parse_kwargs, key_fn=itemgetter(0))
+
+
+### stuff for parsing whole corpora of case xml ###
+
+# The parse_tokens keyword arguments that ParseCache.parse_tokens accepts too (and so can be used with cache_dir)
+CACHE_PARSE_KWARGS = ('as_objects', 'engine', 'resolve_short_cites')
+
+
+def parse_corpus(paths, workers=None, max_pending=None, on_error=None, cache_dir=None, **parse_kwargs):
+    """ Extracts the text of each case XML file in paths, parses it for citations, and yields (path, citations) tuples
+    as the files finish. Files are fanned out over a pool of worker processes; results come back in completion order,
+    not in the order of paths.
+
+    At most max_pending files are in flight at any time, so paths may be an arbitrarily long (or lazy) iterable and
+    memory stays bounded regardless of the size of the corpus.
+
+    If a file cannot be read or parsed, the run continues: (path, None) is yielded for that file, and, if given,
+    on_error(path, error_message) is called with the formatted traceback from the worker. If a worker process dies
+    outright, every file in flight at the time is reported this way, and the rest go to a new pool.
+
+    Args:
+        paths: an iterable of paths to case XML files.
+        workers: the number of worker processes (defaults to the number of CPUs). With workers=1, files are parsed in
+            the current process, which is handy for debugging.
+        max_pending: the maximum number of files submitted to the pool but not yet yielded (defaults to 4 * workers).
+        on_error: an optional callable taking (path, error_message).
+        cache_dir: if given, results are looked up in and saved to a caseciteparser.ParseCache with its disk tier in
+            this directory, so re-running an unchanged corpus skips the parsing. Only the parse_kwargs in
+            CACHE_PARSE_KWARGS can be used with it; others raise ValueError.
+        **parse_kwargs: extra keyword arguments passed through to caseciteparser.parse_tokens.
+
+    Returns:
+        A generator of (path, citations) tuples, where citations is the list returned by caseciteparser.parse_tokens.
+    """
+    _check_cache_kwargs(cache_dir, parse_kwargs)
+    return _run_corpus(partial(_parse_case_file, cache_dir=cache_dir), paths, workers, max_pending, on_error,
+                       parse_kwargs)
+
+
+def _check_cache_kwargs(cache_dir, parse_kwargs):
+    """ Raises ValueError if parse_kwargs can't be passed to ParseCache.parse_tokens, before any work is sent out. """
+    if cache_dir is not None:
+        unsupported = sorted(set(parse_kwargs) - set(CACHE_PARSE_KWARGS))
+        if unsupported:
+            raise ValueError("Not supported with cache_dir: {}".format(', '.join(unsupported)))
+
+
+def _parse_case_file(path, parse_kwargs, cache_dir=None):
+    words = list(iter_case_tokens(path))
+    return _parse_words(words, parse_kwargs, cache_dir)
+
+
+def _parse_archive_member(item, parse_kwargs, cache_dir=None):
+    name, member = item
+    if isinstance(member, bytes):
+        words = list(iter_case_tokens(io.BytesIO(member)))
+    else:
+        words = get_json_case_text(member).split()
+    return _parse_words(words, parse_kwargs, cache_dir)
+
+
+def _parse_words(words, parse_kwargs, cache_dir):
+    if cache_dir is None:
+        return caseciteparser.parse_tokens(words, **parse_kwargs)
+
+    # Each process keeps one cache per directory, so its memory tier lasts across files
+    cache = _parse_caches.get(cache_dir)
+    if cache is None:
+        cache = _parse_caches[cache_dir] = caseciteparser.ParseCache(cache_dir)
+    return cache.parse_tokens(words, **parse_kwargs)
+
+
+_parse_caches = {}
+
+
+def _run_corpus_item(fn, key, item, parse_kwargs):
+    try:
+        return key, fn(item, parse_kwargs), None
+    except Exception:
+        return key, None, traceback.format_exc()
+
+
+def _run_corpus(fn, items, workers, max_pending, on_error, parse_kwargs, key_fn=None):
+    """ Runs fn(item, parse_kwargs) over items on a process pool with a bounded number of items in flight, yielding
+    (key, result) tuples as they complete. key_fn(item) gives the key reported for each item (defaults to the item).
+
+    If a worker process dies (e.g., it is killed, or runs out of memory), the pool can't tell which item was to blame:
+    every item in flight at the time is reported as failed, and the run goes on with a new pool.
+    """
+    if workers is None:
+        workers = cpu_count() or 1
+    if max_pending is None:
+        max_pending = 4 * workers
+    if key_fn is None:
+        key_fn = _identity
+
+    def report(key, result, error):
+        if error is not None and on_error is not None:
+            on_error(key, error)
+        return key, result
+
+    if workers <= 1:
+        for item in items:
+            yield report(*_run_corpus_item(fn, key_fn(item), item, parse_kwargs))
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        pending = {}  # Future -> key
+        item_iter = iter(items)
+        exhausted = False
+
+        while True:
+            # Top up the pool until we hit the in-flight limit or run out of items
+            while not exhausted and len(pending) < max_pending:
+                item = next(item_iter, _NO_ITEM)
+                if item is _NO_ITEM:
+                    exhausted = True
+                else:
+                    key = key_fn(item)
+                    pending[executor.submit(_run_corpus_item, fn, key, item, parse_kwargs)] = key
+
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                key = pending.pop(future)
+                try:
+                    yield report(*future.result())
+                except BrokenProcessPool:
+                    broken = True
+                    yield report(key, None, traceback.format_exc())
+
+            if broken:
+                # Everything else in flight died with the pool (or finished just before it broke)
+                wait(pending)
+                for future, key in pending.items():
+                    try:
+                        yield report(*future.result())
+                    except BrokenProcessPool:
+                        yield report(key, None, traceback.format_exc())
+                pending.clear()
+                executor.shutdown(wait=False)
+                executor = ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown()
+
+
+def _identity(item):
+    return item
+
+
+_NO_ITEM = object()
@@ -1 +1,11 @@
+from .batch import parse_many
+from .budget import ParseBudget
+from .cache import ParseCache
 from .cite_parser import parse_string, parse_tokens
+from .citation import Citation
+from .citation_index import CitationIndex, CitationIndexWriter
+from .counts import CitationCounts
+from .incremental import reparse_tokens
+from .spans import parse_spans
+from .stats import CitationStats
+from .stream_parser import parse_stream
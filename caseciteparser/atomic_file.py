@@ -0,0 +1,27 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode='wb', encoding=None):
+    """ Opens a temporary file next to path for writing, and moves it over path once the with block finishes, so
+    concurrent readers see either the old file or the complete new one, never a partial one. If the block raises, the
+    temporary file is removed and path is left as it was.
+
+    Args:
+        path: the file to write.
+        mode: 'wb' or 'w'.
+        encoding: the encoding, for text mode.
+
+    Yields:
+        The open temporary file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,105 @@
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+
+from caseciteparser import constant_data
+from caseciteparser.cite_parser import classify_tokens, find_citation_anchors
+from caseciteparser.citation import Citation
+
+# The number of distinct strings each worker parses at a time, when parse_many uses a pool
+BATCH_CHUNK_SIZE = 20000
+
+
+def parse_many(strings, as_objects=False, workers=None, chunk_size=BATCH_CHUNK_SIZE):
+    """ Parses many short strings (e.g., citations from database rows) for citations, and returns a list with what
+    parse_string would return for each, in the same order.
+
+    Rather than parsing the strings one at a time, the words of all of them go into one list, which is classified and
+    searched for anchors (see cite_parser.find_citation_anchors) in a single pass; the table engine then only runs over
+    the strings that have an anchor, each bounded to its own words. Identical strings are only parsed once (each still
+    gets its own copy of the result).
+
+    :param strings: An iterable of strings.
+    :param as_objects: Whether to return Citation objects instead of dicts (see parse_tokens).
+    :param workers: If more than 1, and there are more than chunk_size distinct strings, the strings are parsed in
+        chunks of chunk_size on a pool of this many worker processes.
+    :param chunk_size: The number of distinct strings in each chunk sent to a worker.
+    :return: A list with one list of citations per string.
+    """
+    distinct_positions = {}
+    positions = [distinct_positions.setdefault(string, len(distinct_positions)) for string in strings]
+    distinct_strings = list(distinct_positions)
+
+    if workers is not None and workers > 1 and len(distinct_strings) > chunk_size:
+        chunks = [distinct_strings[i:i + chunk_size] for i in range(0, len(distinct_strings), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=constant_data.load_tables) as executor:
+            distinct_results = [cite_list for chunk_results in executor.map(parse_distinct_strings, chunks)
+                                for cite_list in chunk_results]
+    else:
+        distinct_results = parse_distinct_strings(distinct_strings)
+
+    results = []
+    used = bytearray(len(distinct_strings))
+    for position in positions:
+        cite_list = distinct_results[position]
+        if as_objects:
+            if cite_list:
+                words = distinct_strings[position].split()
+                cite_list = [Citation.from_citation_data(words, citation_data) for citation_data in cite_list]
+            else:
+                cite_list = []
+        elif used[position]:
+            cite_list = copy_citations(cite_list)
+        used[position] = True
+        results.append(cite_list)
+    return results
+
+
+def parse_distinct_strings(strings):
+    """ Returns parse_string(string) for each string, parsed over a shared list of words as described in parse_many.
+    """
+    from caseciteparser.table_engine import make_citation_data, run_table_engine
+
+    words = []
+    starts = []
+    for string in strings:
+        starts.append(len(words))
+        words.extend(string.split())
+    starts.append(len(words))
+
+    token_classes = classify_tokens(words)
+    anchors = find_citation_anchors(token_classes)
+
+    found = []
+
+    def emit(*args):
+        found.append(make_citation_data(*args))
+
+    results = []
+    for i in range(len(strings)):
+        start, stop = starts[i], starts[i + 1]
+        # A citation starts with a volume, so an anchor on a string's first word belongs to no citation of it
+        string_anchors = anchors[bisect_left(anchors, start + 1):bisect_left(anchors, stop)]
+        if not string_anchors:
+            results.append([])
+            continue
+
+        run_table_engine(words, emit, start_index=start + 1, stop_index=stop, token_classes=token_classes,
+                         anchors=string_anchors)
+        for citation_data in found:
+            citation_data['cite_string'] = " ".join(words[citation_data['start_index']:citation_data['end_index'] + 1])
+            citation_data['start_index'] -= start
+            citation_data['end_index'] -= start
+        results.append(found)
+        found = []
+    return results
+
+
+def copy_citations(cite_list):
+    """ Returns a copy of a list of citation dicts that shares no lists or dicts with it. """
+    copies = []
+    for citation_data in cite_list:
+        citation_data = dict(citation_data)
+        if 'stringcites' in citation_data:
+            citation_data['stringcites'] = [dict(stringcite) for stringcite in citation_data['stringcites']]
+        copies.append(citation_data)
+    return copies
@@ -0,0 +1,53 @@
+from time import perf_counter
+
+
+class ParseBudget:
+    """ A limit on the work parse_tokens may do on a single document, measured in state machine steps, in seconds, or
+    both. Pass one to parse_tokens(words, budget=...): if the budget runs out, parsing stops cleanly and the citations
+    found so far are returned. After each parse, 'steps' holds the number of steps taken and 'exhausted' tells whether
+    the budget ran out. The same object can be reused for many documents; each parse starts with a fresh budget.
+
+    The clock is only read every CHECK_INTERVAL steps, so a time limit may be overrun by that many steps.
+    """
+    CHECK_INTERVAL = 1024
+
+    def __init__(self, max_steps=None, max_seconds=None):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.steps = 0
+        self.exhausted = False
+        self._deadline = None
+
+    def start(self):
+        """ Called by the engines before parsing a document. Returns the step count at which check() must first be
+        called, or None if there is no limit at all.
+        """
+        self.steps = 0
+        self.exhausted = False
+
+        if self.max_seconds is not None:
+            self._deadline = perf_counter() + self.max_seconds
+        elif self.max_steps is None:
+            return None
+
+        return self._next_check(0)
+
+    def check(self, steps):
+        """ Called by the engines when the step count reaches the value returned by start() or by the previous call to
+        check(), before taking another step. Returns the step count of the next check, or None if the budget has run
+        out.
+        """
+        self.steps = steps
+
+        if (self.max_steps is not None and steps >= self.max_steps) or \
+                (self.max_seconds is not None and perf_counter() >= self._deadline):
+            self.exhausted = True
+            return None
+
+        return self._next_check(steps)
+
+    def _next_check(self, steps):
+        if self.max_seconds is not None:
+            next_check = steps + self.CHECK_INTERVAL
+            return next_check if self.max_steps is None else min(next_check, self.max_steps)
+        return self.max_steps
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+from array import array
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+from caseciteparser import constant_data
+from caseciteparser.atomic_file import atomic_write
+from caseciteparser.cite_parser import parse_tokens
+from caseciteparser.citation import Citation
+
+# The modules whose code decides what parse_tokens returns; changing any of them invalidates cached results
+PARSER_MODULES = ('cite_parser.py', 'citation.py', 'constant_data.py', 'table_engine.py', 'token_dict.py')
+
+CacheInfo = namedtuple('CacheInfo', 'memory_hits disk_hits misses memory_entries')
+
+_parser_key = None
+
+
+def get_parser_key():
+    """ Returns a digest of the source of the parser modules, computed once per process. """
+    global _parser_key
+    if _parser_key is None:
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for module in PARSER_MODULES:
+            with open(os.path.join(package_dir, module), 'rb') as f:
+                digest.update(f.read())
+        _parser_key = digest.hexdigest()[:16]
+    return _parser_key
+
+
+class ParseCache:
+    """ A content-addressed cache of parse_tokens results, for re-running a corpus whose text rarely changes.
+
+    Results are keyed by a hash of the word tokens together with the parser's own source (get_parser_key) and
+    constant_data.TABLE_KEY (which changes with the reporters_db version and the court, jurisdiction, and month
+    abbreviation lists), so a change to the parser or to its tables simply stops old entries from being found.
+
+    There are two tiers: a bounded in-memory LRU of the most recently used results, and, if a directory is given, one
+    JSON file per result on disk (sharded into subdirectories by the first two hex digits of the key), which can be
+    shared by many processes. Both hold results as JSON, so every lookup returns fresh dicts the caller may modify.
+
+    Args:
+        directory: the directory of the disk tier, or None to only cache in memory.
+        max_memory_entries: the number of results kept in memory.
+    """
+
+    def __init__(self, directory=None, max_memory_entries=1024):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = Lock()
+
+    def parse_string(self, string, as_objects=False, engine='fsm', resolve_short_cites=False):
+        """ Returns parse_string(string, as_objects, engine, resolve_short_cites=...), from the cache if possible. """
+        return self.parse_tokens(string.split(), as_objects, engine, resolve_short_cites)
+
+    def parse_tokens(self, words, as_objects=False, engine='fsm', resolve_short_cites=False):
+        """ Returns parse_tokens(words, as_objects, engine, resolve_short_cites=...), from the cache if possible. Every
+        engine gives the same results, so they share cache entries; results with and without resolve_short_cites are
+        cached separately. (Stats and budgets describe a particular run, so they aren't supported.)
+        """
+        key = self.get_key(words, resolve_short_cites)
+        cite_list = self._get(key)
+
+        if cite_list is None:
+            cite_list = parse_tokens(words, engine=engine, resolve_short_cites=resolve_short_cites)
+            self._put(key, json.dumps(cite_list, ensure_ascii=False, separators=(',', ':')))
+
+        if as_objects:
+            return [Citation.from_citation_data(words, citation_data) for citation_data in cite_list]
+        return cite_list
+
+    def get_key(self, words, resolve_short_cites=False):
+        """ Returns the cache key of a list of word tokens (parsed with or without resolve_short_cites) under the
+        tables currently loaded.
+        """
+        # The lengths of the words make the key unambiguous even for words containing the separator
+        digest = hashlib.sha256((get_parser_key() + '\0' + constant_data.TABLE_KEY + '\0').encode('utf-8'))
+        if resolve_short_cites:
+            digest.update(b'resolve_short_cites\0')
+        digest.update(array('q', map(len, words)))
+        digest.update('\0'.join(words).encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def info(self):
+        """ Returns a CacheInfo of the hit and miss counts and the number of results held in memory. """
+        return CacheInfo(self.memory_hits, self.disk_hits, self.misses, len(self._memory))
+
+    def clear_memory(self):
+        """ Empties the in-memory tier (the disk tier is left alone) and resets the counts. """
+        with self._lock:
+            self._memory.clear()
+            self.memory_hits = self.disk_hits = self.misses = 0
+
+    def _get(self, key):
+        """ Returns the decoded result cached under key, or None if there is none. """
+        with self._lock:
+            encoded = self._memory.get(key)
+            if encoded is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+        if encoded is not None:
+            return json.loads(encoded)
+
+        if self.directory is not None:
+            try:
+                with open(self._get_path(key), 'r', encoding='utf-8') as f:
+                    encoded = f.read()
+                cite_list = json.loads(encoded)
+            except (OSError, ValueError):  # Not on disk, or a damaged file that parsing again will overwrite
+                pass
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, encoded)
+                return cite_list
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put(self, key, encoded):
+        with self._lock:
+            self._remember(key, encoded)
+        if self.directory is not None:
+            save_result(encoded, self._get_path(key))
+
+    def _remember(self, key, encoded):
+        self._memory[key] = encoded
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+
+def save_result(encoded, path):
+    """ Atomically writes an encoded result to path, so concurrent processes never see a partial file. Failures are
+    ignored: the result just isn't cached on disk.
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path, 'w', encoding='utf-8') as f:
+            f.write(encoded)
+    except OSError:
+        pass
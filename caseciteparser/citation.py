@@ -0,0 +1,74 @@
+from sys import intern
+
+# The optional keys of a citation dict, in the order to_dict adds them. (Note the spelling of 'court_jursidiction',
+# which matches the dicts returned by parse_tokens.)
+OPTIONAL_KEYS = ('case_first_page', 'pincite', 'cite_type', 'date_paren_string', 'year', 'month', 'day', 'court_type',
+                 'court_jursidiction', 'antecedent_index', 'start_offset', 'end_offset')
+
+# Keys whose values repeat across many citations, so one shared copy of each string is kept
+INTERNED_KEYS = ('cite_type', 'year', 'month', 'court_type', 'court_jursidiction')
+
+
+class Citation:
+    """ A compact alternative to the citation dicts returned by parse_tokens (see its docstring for the meaning of each
+    attribute). Attributes that a dict would be missing are None.
+
+    The repetitive strings (reporter, court type and jurisdiction, etc.) are interned, and 'stringcites' is a tuple of
+    (volume, reporter, case_first_page) tuples. 'cite_string' is joined together right away, so that a Citation never
+    keeps the whole list of words it was parsed from alive.
+
+    Citations compare equal when their dicts would, and, as they can be modified, aren't hashable.
+    """
+    __slots__ = ('volume', 'reporter', 'start_index', 'end_index', 'stringcites', 'cite_string') + OPTIONAL_KEYS
+
+    __hash__ = None
+
+    def __init__(self, words, volume, reporter, start_index, end_index, stringcites=(), **optional_data):
+        self.cite_string = " ".join(words[start_index:end_index + 1])
+        self.volume = volume
+        self.reporter = intern(reporter)
+        self.start_index = start_index
+        self.end_index = end_index
+        self.stringcites = tuple((stringcite_volume, intern(stringcite_reporter), stringcite_first_page)
+                                 for stringcite_volume, stringcite_reporter, stringcite_first_page in stringcites)
+
+        for key in OPTIONAL_KEYS:
+            value = optional_data.get(key)
+            if value is not None and key in INTERNED_KEYS:
+                value = intern(value)
+            setattr(self, key, value)
+
+    @classmethod
+    def from_citation_data(cls, words, citation_data):
+        """ Builds a Citation from a citation dict (without its 'cite_string') and the word tokens it was parsed from.
+        """
+        stringcites = [(stringcite['volume'], stringcite['reporter'], stringcite['case_first_page'])
+                       for stringcite in citation_data.get('stringcites', ())]
+        optional_data = {key: citation_data[key] for key in OPTIONAL_KEYS if key in citation_data}
+
+        return cls(words, citation_data['volume'], citation_data['reporter'], citation_data['start_index'],
+                   citation_data['end_index'], stringcites, **optional_data)
+
+    def to_dict(self):
+        """ Returns the dict parse_tokens would have returned for this citation. """
+        citation_dict = {'reporter': self.reporter, 'volume': self.volume, 'start_index': self.start_index,
+                         'end_index': self.end_index, 'cite_string': self.cite_string}
+
+        for key in OPTIONAL_KEYS:
+            value = getattr(self, key)
+            if value is not None:
+                citation_dict[key] = value
+
+        if self.stringcites:
+            citation_dict['stringcites'] = [{'volume': volume, 'reporter': reporter, 'case_first_page': case_first_page}
+                                            for volume, reporter, case_first_page in self.stringcites]
+
+        return citation_dict
+
+    def __eq__(self, other):
+        if not isinstance(other, Citation):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return 'Citation({!r})'.format(self.cite_string)
@@ -0,0 +1,394 @@
+""" An on-disk inverted index from cited cases to the documents that cite them, built from parse_tokens output.
+
+Each full citation (and each of its parallel 'stringcites') is indexed under the normalized key of the case it cites,
+"volume reporter first_page" (e.g. "343 U.S. 579"). Each key's postings list holds a (document, pincite) pair for
+every time a document cites the case.
+
+An index is a single file, read through mmap, so opening one costs nothing and lookups only touch the pages they need.
+The file is laid out as follows, with every integer a signed 64-bit integer in the byte order of the machine that wrote
+it (recorded in the magic number):
+
+    header: magic, number of keys, number of postings, number of documents
+    key_offsets[keys + 1]: key i is key_data[key_offsets[i]:key_offsets[i + 1]]
+    posting_starts[keys + 1]: the postings of key i are postings posting_starts[i] to posting_starts[i + 1] - 1
+    posting_documents[postings]: the document number of each posting
+    pincite_offsets[postings + 1]: the pincite of posting j is pincite_data[pincite_offsets[j]:pincite_offsets[j + 1]]
+    document_offsets[documents + 1]: document n is document_data[document_offsets[n]:document_offsets[n + 1]]
+    key_data, pincite_data, document_data: UTF-8 strings back to back
+
+Keys are sorted (by their UTF-8 bytes), so a key is found by binary search; the postings of a key are sorted by
+document number. Writers that run out of memory spill sorted runs to disk in the same format, and any number of
+indexes (runs, or partial indexes built by parallel workers) are combined by a streaming merge (see merge_indexes).
+"""
+import heapq
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from collections import namedtuple
+from itertools import chain
+
+from caseciteparser.atomic_file import atomic_write
+from caseciteparser.citation import Citation
+
+MAGIC = b'CCPIDX1' + (b'L' if sys.byteorder == 'little' else b'B')
+
+HEADER = struct.Struct('=8s3q')
+
+DEFAULT_MAX_BUFFERED_POSTINGS = 1 << 20
+
+# The number of integers or bytes gathered in memory before a section is written to its temporary file
+SECTION_BUFFER_SIZE = 1 << 16
+
+Posting = namedtuple('Posting', 'document pincite')
+
+
+def get_key(volume, reporter, case_first_page):
+    """ Returns the normalized index key of a cited case: its volume, reporter, and first page separated by single
+    spaces.
+    """
+    return ' '.join((volume.strip(), ' '.join(reporter.split()), case_first_page.strip()))
+
+
+def split_key(key):
+    """ Returns the (volume, reporter, case_first_page) of an index key. (Volumes and pages never contain spaces, so
+    everything between the first and last spaces is the reporter.)
+    """
+    volume, rest = key.split(' ', 1)
+    reporter, case_first_page = rest.rsplit(' ', 1)
+    return volume, reporter, case_first_page
+
+
+def iter_citation_keys(citations):
+    """ Yields a (key, pincite) pair for each case cited by a list of citation dicts (or Citation objects): the case of
+    each full citation, with its pincite, and the cases of its parallel citations, which have no pincite of their own.
+    Short citations don't name a first page, so they're skipped.
+    """
+    for citation in citations:
+        if isinstance(citation, Citation):
+            citation = citation.to_dict()
+        if citation.get('case_first_page') is None:
+            continue
+
+        yield get_key(citation['volume'], citation['reporter'], citation['case_first_page']), citation.get('pincite')
+        for stringcite in citation.get('stringcites', ()):
+            yield get_key(stringcite['volume'], stringcite['reporter'], stringcite['case_first_page']), None
+
+
+class CitationIndexWriter:
+    """ Builds a citation index from the citations of one document after another.
+
+    Postings are gathered in memory; each time max_buffered_postings have been gathered, they're sorted and spilled to
+    a temporary run, and close() merges the runs into the final index. Documents are numbered in the order they're
+    added.
+
+    Use it as a context manager, or call close() when done:
+
+        with CitationIndexWriter('citations.idx') as writer:
+            for path, citations in case_xml_io.parse_corpus(paths, workers=8):
+                writer.add_document(path, citations or [])
+
+    Args:
+        path: the path of the index to write. It's only written (atomically) on close().
+        max_buffered_postings: the number of postings held in memory before spilling a run.
+    """
+
+    def __init__(self, path, max_buffered_postings=DEFAULT_MAX_BUFFERED_POSTINGS):
+        self.path = path
+        self.max_buffered_postings = max_buffered_postings
+        self.num_documents = 0
+        self._postings = []  # (key bytes, document number within the current run, pincite bytes) tuples
+        self._documents = []  # The documents of the current run
+        self._run_directory = None
+        self._run_paths = []
+
+    def add_document(self, document, citations):
+        """ Adds the citations (as returned by parse_tokens) of a document, given by any string (a path, or an ID). """
+        document_number = len(self._documents)
+        self._documents.append(str(document))
+        self.num_documents += 1
+
+        for key, pincite in iter_citation_keys(citations):
+            self._postings.append((key.encode('utf-8'), document_number, (pincite or '').encode('utf-8')))
+
+        if len(self._postings) >= self.max_buffered_postings:
+            self._spill()
+
+    def close(self):
+        """ Writes the index, merging any runs spilled to disk. """
+        try:
+            if not self._run_paths:
+                self._postings.sort()
+                write_index(self.path, self._postings, self._documents)
+            else:
+                self._spill()
+                merge_indexes(self._run_paths, self.path)
+        finally:
+            self._postings = []
+            self._documents = []
+            if self._run_directory is not None:
+                shutil.rmtree(self._run_directory, ignore_errors=True)
+                self._run_directory = None
+
+    def _spill(self):
+        if self._run_directory is None:
+            self._run_directory = tempfile.mkdtemp(prefix='citation_index_', dir=os.path.dirname(self.path) or None)
+
+        run_path = os.path.join(self._run_directory, 'run{:06d}.idx'.format(len(self._run_paths)))
+        self._postings.sort()
+        write_index(run_path, self._postings, self._documents)
+        self._run_paths.append(run_path)
+        self._postings = []
+        self._documents = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self._run_directory is not None:
+            shutil.rmtree(self._run_directory, ignore_errors=True)
+
+
+def build_citation_index(results, path, max_buffered_postings=DEFAULT_MAX_BUFFERED_POSTINGS):
+    """ Builds a citation index at path from an iterable of (document, citations) tuples, such as the output of
+    case_xml_io.parse_corpus (documents that failed to parse, with citations None, are indexed with no citations).
+    Returns the number of documents indexed.
+    """
+    with CitationIndexWriter(path, max_buffered_postings) as writer:
+        for document, citations in results:
+            writer.add_document(document, citations or [])
+    return writer.num_documents
+
+
+class CitationIndex:
+    """ A read-only, memory-mapped citation index (see the module docstring).
+
+    Use it as a context manager, or call close() when done:
+
+        with CitationIndex('citations.idx') as index:
+            for document, pincite in index.lookup('343', 'U.S.', '579'):
+                ...
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER.size or HEADER.unpack_from(self._map)[0] != MAGIC:
+            self._map.close()
+            raise ValueError('{} is not a citation index written on a machine of this byte order'.format(path))
+        _, self.num_keys, self.num_postings, self.num_documents = HEADER.unpack_from(self._map)
+
+        self._view = memoryview(self._map)
+        position = HEADER.size
+        sections = []
+        for count in (self.num_keys + 1, self.num_keys + 1, self.num_postings, self.num_postings + 1,
+                      self.num_documents + 1):
+            sections.append(self._view[position:position + 8 * count].cast('q'))
+            position += 8 * count
+        (self._key_offsets, self._posting_starts, self._posting_documents, self._pincite_offsets,
+         self._document_offsets) = sections
+
+        for offsets in (self._key_offsets, self._pincite_offsets, self._document_offsets):
+            sections.append(self._view[position:position + offsets[-1]])
+            position += offsets[-1]
+        self._key_data, self._pincite_data, self._document_data = sections[5:]
+        self._sections = sections
+
+    def lookup(self, volume, reporter, case_first_page):
+        """ Returns a list of the Posting(document, pincite) tuples of a cited case, in the order the documents were
+        indexed (pincite is None where a document cites the case without one).
+        """
+        return list(self.iter_postings(get_key(volume, reporter, case_first_page)))
+
+    def citing_documents(self, volume, reporter, case_first_page):
+        """ Returns the list of distinct documents that cite a case, in the order they were indexed. """
+        documents = []
+        for document, _ in self.iter_postings(get_key(volume, reporter, case_first_page)):
+            if not documents or documents[-1] != document:
+                documents.append(document)
+        return documents
+
+    def iter_postings(self, key):
+        """ Yields the Postings of an index key (see get_key). """
+        i = self._find_key(key.encode('utf-8'))
+        if i is None:
+            return
+
+        for j in range(self._posting_starts[i], self._posting_starts[i + 1]):
+            pincite = self._get_pincite(j)
+            yield Posting(self.get_document(self._posting_documents[j]), pincite or None)
+
+    def iter_keys(self):
+        """ Yields the (volume, reporter, case_first_page) of every cited case, in key order. """
+        for i in range(self.num_keys):
+            yield split_key(self._get_key(i).decode('utf-8'))
+
+    def iter_edges(self):
+        """ Yields the edges of the citation graph, as (citing document, (volume, reporter, case_first_page), pincite)
+        tuples, in key order.
+        """
+        for i in range(self.num_keys):
+            cited_case = split_key(self._get_key(i).decode('utf-8'))
+            for j in range(self._posting_starts[i], self._posting_starts[i + 1]):
+                yield self.get_document(self._posting_documents[j]), cited_case, self._get_pincite(j) or None
+
+    def get_document(self, document_number):
+        """ Returns the document with the given number (the order in which it was indexed). """
+        offsets = self._document_offsets
+        return bytes(self._document_data[offsets[document_number]:offsets[document_number + 1]]).decode('utf-8')
+
+    def __contains__(self, key):
+        return self._find_key(key.encode('utf-8')) is not None
+
+    def __len__(self):
+        return self.num_keys
+
+    def close(self):
+        if self._map is not None:
+            for section in self._sections:
+                section.release()
+            self._view.release()
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _find_key(self, key):
+        """ Returns the number of the key (bytes), or None if it isn't in the index. """
+        low, high = 0, self.num_keys
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.num_keys and self._get_key(low) == key:
+            return low
+        return None
+
+    def _get_key(self, i):
+        return bytes(self._key_data[self._key_offsets[i]:self._key_offsets[i + 1]])
+
+    def _get_pincite(self, j):
+        return bytes(self._pincite_data[self._pincite_offsets[j]:self._pincite_offsets[j + 1]]).decode('utf-8')
+
+    def _iter_raw_postings(self, document_base):
+        """ Yields (key bytes, document number + document_base, pincite bytes) for every posting, in order. """
+        for i in range(self.num_keys):
+            key = self._get_key(i)
+            for j in range(self._posting_starts[i], self._posting_starts[i + 1]):
+                yield (key, self._posting_documents[j] + document_base,
+                       bytes(self._pincite_data[self._pincite_offsets[j]:self._pincite_offsets[j + 1]]))
+
+    def _iter_documents(self):
+        for n in range(self.num_documents):
+            yield self.get_document(n)
+
+
+def merge_indexes(paths, path):
+    """ Merges citation indexes (e.g. partial indexes built by parallel workers over parts of a corpus) into one at
+    path, streaming through them without loading any into memory. The documents of the first index keep their numbers,
+    and those of each later index are numbered after the documents of the indexes before it.
+    """
+    indexes = [CitationIndex(index_path) for index_path in paths]
+    try:
+        document_bases = [0]
+        for index in indexes:
+            document_bases.append(document_bases[-1] + index.num_documents)
+
+        # Each index's document numbers fall in a range above the previous index's, so merging on the whole tuple keeps
+        # every key's postings in document order
+        postings = heapq.merge(*[index._iter_raw_postings(base) for index, base in zip(indexes, document_bases)])
+        write_index(path, postings, chain.from_iterable(index._iter_documents() for index in indexes))
+    finally:
+        for index in indexes:
+            index.close()
+
+
+class _Section:
+    """ A section of an index file being written, gathered in a temporary file since its length isn't known until all
+    of the postings have been seen.
+    """
+
+    def __init__(self, is_integers):
+        self.file = tempfile.TemporaryFile()
+        self.buffer = array('q') if is_integers else bytearray()
+
+    def append(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= SECTION_BUFFER_SIZE:
+            self.flush()
+
+    def extend(self, data):
+        self.buffer += data
+        if len(self.buffer) >= SECTION_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer)
+        del self.buffer[:]
+
+
+def write_index(path, postings, documents):
+    """ Atomically writes a citation index.
+
+    :param path: The path of the index.
+    :param postings: An iterable of (key bytes, document number, pincite bytes) tuples, sorted.
+    :param documents: An iterable of the documents, in document number order.
+    """
+    key_offsets, posting_starts, posting_documents, pincite_offsets, document_offsets = \
+        [_Section(True) for _ in range(5)]
+    key_data, pincite_data, document_data = [_Section(False) for _ in range(3)]
+    sections = (key_offsets, posting_starts, posting_documents, pincite_offsets, document_offsets, key_data,
+                pincite_data, document_data)
+
+    num_keys = num_postings = num_documents = 0
+    key_length = pincite_length = document_length = 0
+    key_offsets.append(0)
+    pincite_offsets.append(0)
+    document_offsets.append(0)
+
+    previous_key = None
+    for key, document_number, pincite in postings:
+        if key != previous_key:
+            posting_starts.append(num_postings)
+            key_data.extend(key)
+            key_length += len(key)
+            key_offsets.append(key_length)
+            num_keys += 1
+            previous_key = key
+        posting_documents.append(document_number)
+        pincite_data.extend(pincite)
+        pincite_length += len(pincite)
+        pincite_offsets.append(pincite_length)
+        num_postings += 1
+    posting_starts.append(num_postings)
+
+    for document in documents:
+        encoded = document.encode('utf-8')
+        document_data.extend(encoded)
+        document_length += len(encoded)
+        document_offsets.append(document_length)
+        num_documents += 1
+
+    try:
+        with atomic_write(path) as f:
+            f.write(HEADER.pack(MAGIC, num_keys, num_postings, num_documents))
+            for section in sections:
+                section.flush()
+                section.file.seek(0)
+                shutil.copyfileobj(section.file, f)
+    finally:
+        for section in sections:
+            section.file.close()
@@ -1,22 +1,48 @@
+from bisect import bisect_left
 from collections import namedtuple
-from caseciteparser import constant_data
+from functools import lru_cache
+from time import perf_counter
+from caseciteparser import constant_data, token_dict
+from caseciteparser.citation import Citation
 
 CitationState = namedtuple('CitationState', ['next_index', 'next_fn', 'citation_data', 'citation_is_ready'])
 
+# A date parenthetical is abandoned if no close paren is found within this many characters
+DATE_PAREN_MAX_LENGTH = 50
+
+# The number of distinct date parentheticals whose parse results are remembered (see cached_parenthetical_fsm)
+PARENTHETICAL_CACHE_SIZE = 8192
+
+# Token classes, as bit flags, computed once per token by classify_tokens
+TOKEN_DIGITS = 1  # e.g., '1407'
+TOKEN_DIGITS_COMMA = 2  # e.g., '1407,'
+TOKEN_NUMBER_OR_RANGE = 4  # Starts with a number or number range, e.g., '1412-13).'
+TOKEN_OPEN_PAREN = 8  # e.g., '(D.'
+TOKEN_REPORTER_START = 16  # The first token of a recognized reporter, e.g., 'F.'
+TOKEN_REPORTER_DIGIT_PREFIX = 32  # A reporter first token in constant_data.REPORTER_DIGIT_PREFIXES
+
 # Todo: create Enum for citation data
 
 
-def parse_string(string):
-    """ Returns parse_tokens(string.split())
+def parse_string(string, as_objects=False, engine='fsm', stats=None, budget=None, resolve_short_cites=False,
+                 workers=None):
+    """ Returns parse_tokens(string.split(), as_objects, engine, stats, budget, resolve_short_cites, workers)
 
     :param string: String to be parsed for citations.
+    :param as_objects: See parse_tokens.
+    :param engine: See parse_tokens.
+    :param stats: See parse_tokens.
+    :param budget: See parse_tokens.
+    :param resolve_short_cites: See parse_tokens.
+    :param workers: See parse_tokens.
     :return: A list of citation data
     """
     words = string.split()
-    return parse_tokens(words)
+    return parse_tokens(words, as_objects, engine, stats, budget, resolve_short_cites, workers)
 
 
-def parse_tokens(words):
+def parse_tokens(words, as_objects=False, engine='fsm', stats=None, budget=None, resolve_short_cites=False,
+                 workers=None):
     """ Parses a list of word tokens and returns a list of dicts, where each item in the list corresponds to a legal
     case citation found in the list of word tokens. Each dict contains at least four keys:
         'reporter': the reporter abbreviation (e.g., 'F.3d');
@@ -34,10 +60,46 @@ def parse_tokens(words):
         'day': the day the case was decided;
         'court_type': the type of the court (e.g., district, circuit, etc.); and
         'court_jurisdiction': the court's jurisdiction (e.g., a state or other geographical region).
+    If resolve_short_cites is True, each short cite whose volume and reporter match an earlier full cite (or one of its
+    stringcites) also has the key:
+        'antecedent_index': the index, in the returned list, of the latest such full cite.
+    If as_objects is True, each item is instead a compact Citation object (see citation.py), whose to_dict() method
+    returns the dict described above.
+    Two engines produce identical results: 'fsm', the citation state machine below, and 'table', the faster
+    table-driven loop in table_engine.py.
     :param words: Word tokens to parse for citations.
+    :param as_objects: Whether to return Citation objects instead of dicts.
+    :param engine: Either 'fsm' or 'table'.
+    :param stats: An optional stats.CitationStats object to add counts and timings of the state machine to (only
+        supported by the 'fsm' engine).
+    :param budget: An optional budget.ParseBudget limiting the work done on this document. If it runs out, the
+        citations found so far are returned and budget.exhausted is set.
+    :param resolve_short_cites: Whether to link each short cite to its full cite (see 'antecedent_index' above).
+    :param workers: If given, a very long list of words is split into chunks that are parsed on a pool of this many
+        worker processes, with the same results (see parallel.py). The chunks are always parsed with the 'table'
+        engine then, whatever engine is given, and neither stats nor budget is supported.
     :return: A dict as described in the function description above.
     """
-    return citation_fsm(words)
+    if engine not in ('fsm', 'table'):
+        raise ValueError("Unknown engine: {!r}".format(engine))
+
+    if workers is not None:
+        if stats is not None or budget is not None:
+            raise ValueError("Stats and budgets aren't supported with workers")
+        from caseciteparser.parallel import parallel_citation_data
+        citation_data_iter = parallel_citation_data(words, workers)
+        if resolve_short_cites:
+            citation_data_iter = iter_with_antecedents(citation_data_iter)
+        return [finish_citation(words, citation_data, as_objects) for citation_data in citation_data_iter]
+    elif engine == 'fsm':
+        return citation_fsm(words, as_objects=as_objects, stats=stats, budget=budget,
+                            resolve_short_cites=resolve_short_cites)
+    elif stats is not None:
+        raise ValueError("Stats are only collected by the 'fsm' engine")
+    else:
+        from caseciteparser.table_engine import table_citation_fsm
+        return table_citation_fsm(words, as_objects=as_objects, budget=budget,
+                                  resolve_short_cites=resolve_short_cites)
 
 
 def get_number_or_range_word_starts_with(word):
@@ -71,29 +133,264 @@ def word_is_number_followed_by_comma(word):
     return (len(word) > 1) and word[0:len(word)-1].isdigit() and word[len(word)-1] == ','
 
 
-def citation_fsm(words):
-    cite_list = []
-    state = CitationState(next_index=1, next_fn=do_scan_for_reporter, citation_data={}, citation_is_ready=False)
+def classify_tokens(words):
+    """ Classifies each word token once, so later passes can test token classes without re-examining the words.
+
+    Args:
+        words: the array of words to classify.
+
+    Returns:
+        A bytearray with one entry per word, each a combination of the TOKEN_* flags above.
+    """
+    reporter_dict = constant_data.REPORTER_TOKEN_DISAMBIGUATION_DICT
+    reporter_digit_prefixes = constant_data.REPORTER_DIGIT_PREFIXES
+    token_classes = bytearray(len(words))
+
+    for i, word in enumerate(words):
+        if word in reporter_dict:
+            if word in reporter_digit_prefixes:
+                token_classes[i] = TOKEN_REPORTER_START | TOKEN_REPORTER_DIGIT_PREFIX
+            else:
+                token_classes[i] = TOKEN_REPORTER_START
+        elif not word:
+            continue
+        elif word[0].isdigit():  # Any word starting with a digit starts with a number or number range
+            if word.isdigit():
+                token_classes[i] = TOKEN_DIGITS | TOKEN_NUMBER_OR_RANGE
+            elif word_is_number_followed_by_comma(word):
+                token_classes[i] = TOKEN_DIGITS_COMMA | TOKEN_NUMBER_OR_RANGE
+            else:
+                token_classes[i] = TOKEN_NUMBER_OR_RANGE
+        elif word[0] == '(':
+            token_classes[i] = TOKEN_OPEN_PAREN
+
+    return token_classes
+
+
+def find_citation_anchors(token_classes, start_index=1, stop_index=None):
+    """ Returns the sorted indices, in [start_index, stop_index), at which do_scan_for_reporter can do anything other
+    than move on to the next word: a reporter's first word preceded by a volume number. Reporters in which a number is
+    followed by another reporter's first word (constant_data.REPORTER_DIGIT_PREFIXES) are always anchors, because
+    skipping over one without a volume could otherwise skip past an anchor inside it.
+
+    Args:
+        token_classes: the result of classify_tokens.
+        start_index: the first index to consider. Must be at least 1.
+        stop_index: one past the last index to consider (defaults to the number of tokens).
+
+    Returns:
+        A list of indices.
+    """
+    if stop_index is None:
+        stop_index = len(token_classes)
+
+    anchors = []
+    for i in range(start_index, stop_index):
+        token_class = token_classes[i]
+        if token_class & TOKEN_REPORTER_START and (token_classes[i-1] & TOKEN_DIGITS or
+                                                   token_class & TOKEN_REPORTER_DIGIT_PREFIX):
+            anchors.append(i)
+
+    return anchors
+
+
+def citation_fsm(words, anchors=None, as_objects=False, stats=None, budget=None, resolve_short_cites=False):
+    """ Runs the citation state machine over words and returns the list of citations found, as dicts or, if
+    as_objects is True, Citation objects.
+    """
+    citation_data_iter = iter_citation_data(words, anchors, stats, budget)
+    if resolve_short_cites:
+        citation_data_iter = iter_with_antecedents(citation_data_iter)
+    return [finish_citation(words, citation_data, as_objects) for citation_data in citation_data_iter]
+
+
+class ShortCiteResolver:
+    """ Finds the antecedent of each short cite of a document as the citations go by, in constant time per citation:
+    every full cite records its index under its own (volume, reporter) and that of each of its stringcites, so a short
+    cite's antecedent is a single dict lookup rather than a search back through the earlier citations.
+    """
+
+    def __init__(self):
+        self.antecedents = {}  # (volume, reporter) -> index of the latest full cite with that volume and reporter
+
+    def resolve(self, index, volume, reporter, cite_type, parallel_cites=()):
+        """ Takes the index (in the list of citations) of the next citation, its volume, reporter, and cite type, and
+        the (volume, reporter) of each of its stringcites. Returns the index of the antecedent of a short cite, or None
+        if it has none (or isn't a short cite).
+        """
+        if cite_type == 'short_cite':
+            return self.antecedents.get((volume, reporter))
+        if cite_type == 'full_cite':
+            self.antecedents[(volume, reporter)] = index
+            for parallel_cite in parallel_cites:
+                self.antecedents[parallel_cite] = index
+        return None
+
+    def resolve_citation_data(self, index, citation_data):
+        """ Takes the index and citation data (or citation dict) of the next citation, and adds its 'antecedent_index'
+        if it's a short cite that has one.
+        """
+        antecedent_index = self.resolve(index, citation_data['volume'], citation_data['reporter'],
+                                        citation_data.get('cite_type'),
+                                        [(stringcite['volume'], stringcite['reporter'])
+                                         for stringcite in citation_data.get('stringcites', ())])
+        if antecedent_index is not None:
+            citation_data['antecedent_index'] = antecedent_index
+
+
+def iter_with_antecedents(citation_data_iter):
+    """ Passes citation data (or citation dicts) through, adding an 'antecedent_index' to each short cite that has
+    one (see ShortCiteResolver).
+    """
+    resolver = ShortCiteResolver()
+    for index, citation_data in enumerate(citation_data_iter):
+        resolver.resolve_citation_data(index, citation_data)
+        yield citation_data
+
+
+def iter_citation_data(words, anchors=None, stats=None, budget=None, start_index=1, window=None):
+    """ Runs the citation state machine over words, yielding the citation data of each citation as it is found (i.e.,
+    a citation dict without its 'cite_string'; see finish_citation).
+
+    Rather than calling do_scan_for_reporter on every word, the scan jumps straight to the next anchor (see
+    find_citation_anchors), since every other word would just fail to start a citation. The result is the same as
+    scanning every word.
+
+    Parsing takes time linear in the number of words, even though a failure sends the scan back to just after the start
+    of the failed citation: whether a state function eventually leads to a citation only depends on the words from its
+    index on, so every (state function, index) pair visited by a failed citation is remembered, and a later citation
+    that reaches one of them fails right away instead of walking the same words again.
+
+    If stats (a stats.CitationStats object) is given, every state function call goes through call_with_stats, which
+    records what the state machine does there; without it, the loop only pays for a few 'stats is None' checks. If
+    budget (a budget.ParseBudget object) is given, parsing stops once it runs out. Scanning starts at start_index, as
+    it would right after a citation ending at start_index - 1.
+
+    If window (a stream_parser.StreamWindow) is given, words and anchors are its buffered tokens and their anchors, and
+    window.advance is called before each step to read and drop tokens around the state machine's position. Indices in
+    anchors (and the remembered failures) are then indices into the whole stream, words[0] being at window.offset,
+    while the citation data yielded is indexed into words, until the next step.
+    """
+    if anchors is None:
+        anchors = find_citation_anchors(classify_tokens(words))
+
+    if stats is not None:
+        stats.documents += 1
+        stats.tokens += len(words)
+        stats.anchors += len(anchors)
+
+    state = CitationState(next_index=start_index, next_fn=do_scan_for_reporter, citation_data={},
+                          citation_is_ready=False)
+    failed_steps = set()  # The (state function, index) pairs known to end in failure
+    citation_steps = []  # The (state function, index) pairs visited by the citation in progress
+    steps = 0
+    next_budget_check = budget.start() if budget is not None else None
+    offset = 0  # The index of words[0]
+
+    while True:
+        if window is not None:
+            state = window.advance(state)
+            if window.offset != offset:
+                offset = window.offset
+                failed_steps = {step for step in failed_steps if step[1] >= offset}
+        if state.next_index >= len(words):
+            break
+
+        if steps == next_budget_check:
+            next_budget_check = budget.check(steps)
+            if next_budget_check is None:
+                return
+        steps += 1
+
+        next_fn = state.next_fn
+        if next_fn is do_scan_for_reporter:
+            # Skip ahead to the next word that could start a citation
+            anchor_pos = bisect_left(anchors, state.next_index + offset)
+            if anchor_pos == len(anchors):
+                break
+            index = anchors[anchor_pos] - offset
+        else:
+            index = state.next_index
+            step = (next_fn, index + offset)
+            if step in failed_steps:
+                next_fn = do_fail_known_step
+            else:
+                citation_steps.append(step)
 
-    while state.next_index < len(words):
         # Call next function
-        next_state = state.next_fn(words, state.next_index, state.citation_data)
+        if stats is None:
+            next_state = next_fn(words, index, state.citation_data)
+        else:
+            next_state = call_with_stats(stats, next_fn, words, index, state.citation_data)
 
-        # If a citation is ready, add it to the list
+        # If a citation is ready, hand it out
         if next_state.citation_is_ready:
-            cite_list.append(next_state.citation_data)
+            if stats is not None:
+                stats.citations += 1
+            citation_steps.clear()
+            yield next_state.citation_data
             state = CitationState(next_index=next_state.next_index, next_fn=next_state.next_fn,
                                   citation_data={}, citation_is_ready=False)
         else:  # Transition to the next state
+            if next_state.next_fn is do_scan_for_reporter and state.next_fn is not do_scan_for_reporter:
+                if is_failure(state, next_state):
+                    failed_steps.update(citation_steps)
+                    if stats is not None:
+                        # Everything since the start of the citation gets scanned again
+                        stats.backtracks += 1
+                        stats.rescanned_tokens += index + 1 - next_state.next_index
+                citation_steps.clear()
             state = next_state
 
-    return cite_list
+    if budget is not None:
+        budget.steps = steps
+
+
+def is_failure(state, next_state):
+    """ Returns True if the transition from state to next_state abandons a citation in progress and sends the scan back
+    to just after its start (rather than past its end, as when a full cite turns out to have no date parenthetical).
+    """
+    return state.next_fn is not do_scan_for_reporter and next_state.next_fn is do_scan_for_reporter and \
+        not next_state.citation_is_ready and next_state.next_index <= state.next_index
+
+
+def call_with_stats(stats, fn, words, index, citation_data):
+    """ Calls the state function fn(words, index, citation_data) for iter_citation_data, adding its count and timing
+    (and, for do_scan_for_reporter, how deep its reporter lookup went) to stats.
+    """
+    if fn is do_scan_for_reporter:
+        depth = token_dict.get_match_depth(constant_data.REPORTER_TOKEN_DISAMBIGUATION_DICT, words, index)
+        stats.trie_depths[depth] += 1
+
+    start_time = perf_counter()
+    next_state = fn(words, index, citation_data)
+    elapsed = perf_counter() - start_time
+
+    stats.calls[fn.__name__] += 1
+    stats.seconds[fn.__name__] += elapsed
+    return next_state
+
+
+def finish_citation(words, citation_data, as_objects=False):
+    """ Turns the citation data collected by the state functions into a result: either a Citation object, or the dict
+    itself with its 'cite_string' filled in.
+    """
+    if as_objects:
+        return Citation.from_citation_data(words, citation_data)
+
+    citation_data['cite_string'] = " ".join(words[citation_data['start_index']:citation_data['end_index'] + 1])
+    return citation_data
 
 
 def failure_citation_state(index):
     return CitationState(next_index=index, next_fn=do_scan_for_reporter, citation_data={}, citation_is_ready=False)
 
 
+def do_fail_known_step(words, index, citation_data):
+    """ Stands in for a state function call that is already known to end in failure (see iter_citation_data). """
+    return failure_citation_state(citation_data['start_index']+2)
+
+
 def do_scan_for_reporter(words, index, citation_data):
     (end_index, reporter_str) = constant_data.find_reporter_at_index(words, index)
 
@@ -133,7 +430,6 @@ def do_parse_short_cite_pincite(words, index, citation_data):
     if pincite_if_valid is not None:
         citation_data['pincite'] = pincite_if_valid
         citation_data['end_index'] = index
-        citation_data['cite_string'] = " ".join(words[citation_data['start_index']:index+1])
         citation_data['cite_type'] = 'short_cite'
         return CitationState(next_index=index + 1, next_fn=do_scan_for_reporter,
                              citation_data=citation_data, citation_is_ready=True)
@@ -227,26 +523,70 @@ def do_parse_date_parenthetical(words, index, citation_data):
         return CitationState(next_index=index + 1, next_fn=do_scan_for_reporter,
                              citation_data={}, citation_is_ready=False)
 
-    paren_string = words[index]
-
-    while index < len(words):
-        if paren_string.find(')') != -1:
-            paren_string = paren_string[1:paren_string.find(')')]
-            paren_data = parenthetical_fsm(paren_string)
-            citation_data.update(paren_data)
-            citation_data['end_index'] = index
-            citation_data['cite_string'] = " ".join(words[citation_data['start_index']:index + 1])
-            citation_data['cite_type'] = 'full_cite'
-            return CitationState(next_index=index + 1, next_fn=do_scan_for_reporter,
-                                 citation_data=citation_data, citation_is_ready=True)
-        elif len(paren_string) > 50:  # Couldn't find a close paren in time
-            return failure_citation_state(citation_data['start_index']+2)
-        else:
-            index = index + 1
-            paren_string = paren_string + ' ' + words[index]
+    (end_index, paren_string) = find_date_parenthetical(words, index, len(words))
 
-    # We ran out of words and still didn't find our paren!
-    return failure_citation_state(citation_data['start_index']+2)
+    if paren_string is not None:
+        paren_data = cached_parenthetical_fsm(paren_string)
+        citation_data.update(paren_data)
+        citation_data['end_index'] = end_index
+        citation_data['cite_type'] = 'full_cite'
+        return CitationState(next_index=end_index + 1, next_fn=do_scan_for_reporter,
+                             citation_data=citation_data, citation_is_ready=True)
+    else:  # Couldn't find a close paren in time, or ran out of words
+        return failure_citation_state(citation_data['start_index']+2)
+
+
+def find_date_parenthetical(words, index, stop_index):
+    """ Looks for the close paren of a date parenthetical whose first word, words[index], starts with '('. Each word is
+    looked at once, and the words are only joined together once the close paren is found.
+
+    Args:
+        words: the array of words.
+        index: the index of the word starting with '('.
+        stop_index: the index of the first word that may not be looked at (usually len(words)).
+
+    Returns:
+        A tuple of the form (end_index, paren_string), where end_index is the index of the word containing the close
+        paren and paren_string is the text between the parens, or (None, None) if no close paren appears within
+        DATE_PAREN_MAX_LENGTH characters (or before stop_index).
+    """
+    start_index = index
+    length = len(words[index])
+
+    while ')' not in words[index]:
+        if length > DATE_PAREN_MAX_LENGTH or index + 1 >= stop_index:
+            return None, None
+        index = index + 1
+        length = length + 1 + len(words[index])
+
+    paren_string = " ".join(words[start_index:index + 1])
+    return index, paren_string[1:paren_string.find(')')]
+
+
+def cached_parenthetical_fsm(paren_string):
+    """ Returns parenthetical_fsm(paren_string), from a bounded, thread-safe LRU cache keyed on the stripped string
+    (the same few courts and years make up most of the date parentheticals in a corpus). The dict returned is shared
+    with later calls, so callers must copy it rather than modify it.
+    """
+    return _parenthetical_cache(paren_string.strip())
+
+
+def set_parenthetical_cache_size(size):
+    """ Replaces the cache of cached_parenthetical_fsm with an empty one holding up to size results (0 turns caching
+    off; None removes the bound).
+    """
+    global _parenthetical_cache
+    _parenthetical_cache = lru_cache(maxsize=size)(parenthetical_fsm)
+
+
+def parenthetical_cache_info():
+    """ Returns the functools CacheInfo(hits, misses, maxsize, currsize) of cached_parenthetical_fsm's cache. """
+    return _parenthetical_cache.cache_info()
+
+
+def clear_parenthetical_cache():
+    """ Empties cached_parenthetical_fsm's cache and resets its hit and miss counts. """
+    _parenthetical_cache.cache_clear()
 
 
 def parenthetical_fsm(paren_string):
@@ -255,7 +595,9 @@ def parenthetical_fsm(paren_string):
 
     paren_data = {'date_paren_string': paren_string}
 
-    # Parse year (it's always going to be there
+    # Parse year (it's always going to be there, unless the parenthetical is empty)
+    if not paren_tokens:
+        return paren_data
     possible_year = paren_tokens.pop()
     if (len(possible_year) != 4) or (not possible_year.isdigit()):
         return paren_data
@@ -273,6 +615,9 @@ def parenthetical_fsm(paren_string):
     return paren_data
 
 
+_parenthetical_cache = lru_cache(maxsize=PARENTHETICAL_CACHE_SIZE)(parenthetical_fsm)
+
+
 def do_parse_court(paren_tokens, index, paren_data):
     # Parse court
     (court_end_index, court_string) = constant_data.find_court_at_index(paren_tokens, index)
@@ -0,0 +1,300 @@
+from array import array
+
+from caseciteparser.cite_parser import iter_citation_data
+
+CITE_TYPES = ('full_cite', 'short_cite')
+
+# Stored in the 'year' column for citations without a (numeric) year
+NO_YEAR = 0
+
+# Stored in the dictionary-encoded columns for citations without a value
+NO_CODE = -1
+
+
+class StringColumn:
+    """ A nullable column of strings in the Arrow layout: the UTF-8 bytes of every value back to back in one buffer,
+    plus an offsets buffer (value i is data[offsets[i]:offsets[i+1]]) and a validity byte per value.
+    """
+
+    def __init__(self):
+        self.offsets = array('q', [0])
+        self.data = bytearray()
+        self.validity = bytearray()
+
+    def append(self, value):
+        if value is None:
+            self.validity.append(0)
+        else:
+            self.data += value.encode('utf-8')
+            self.validity.append(1)
+        self.offsets.append(len(self.data))
+
+    def __len__(self):
+        return len(self.validity)
+
+    def __getitem__(self, i):
+        if not self.validity[i]:
+            return None
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def to_list(self):
+        return [self[i] for i in range(len(self))]
+
+    def copy(self):
+        column = StringColumn()
+        column.offsets = array('q', self.offsets)
+        column.data = bytearray(self.data)
+        column.validity = bytearray(self.validity)
+        return column
+
+
+class Dictionary:
+    """ Assigns consecutive integer codes to strings, for dictionary-encoded columns. """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, value):
+        if value is None:
+            return NO_CODE
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class CitationColumns:
+    """ Citations for a batch of documents, written straight into column buffers instead of one dict per citation.
+
+    There is one row per citation in the citation columns:
+        document_index (int32): the index, in document_ids, of the document the citation was found in;
+        start_index, end_index (int64): as in the dicts returned by parse_tokens;
+        volume, case_first_page, pincite (strings, possibly missing);
+        reporter, court_type, court_jurisdiction (int32 codes into reporters, court_types, and court_jurisdictions, or
+            NO_CODE if missing);
+        cite_type (int8 code into CITE_TYPES); and
+        year (int16, or NO_YEAR if missing).
+    And there is one row per stringcite in the stringcite columns:
+        stringcite_citation (int64): the row, in the citation columns, of the citation the stringcite belongs to;
+        stringcite_volume, stringcite_case_first_page (strings); and
+        stringcite_reporter (int32 code into reporters).
+
+    The columns can be exported with to_numpy() or to_arrow(), and more documents added afterwards.
+    """
+
+    def __init__(self):
+        self.document_ids = []
+
+        self.document_index = array('i')
+        self.start_index = array('q')
+        self.end_index = array('q')
+        self.volume = StringColumn()
+        self.reporter = array('i')
+        self.case_first_page = StringColumn()
+        self.pincite = StringColumn()
+        self.cite_type = array('b')
+        self.year = array('h')
+        self.court_type = array('i')
+        self.court_jurisdiction = array('i')
+
+        self.stringcite_citation = array('q')
+        self.stringcite_volume = StringColumn()
+        self.stringcite_reporter = array('i')
+        self.stringcite_case_first_page = StringColumn()
+
+        self._reporters = Dictionary()
+        self._court_types = Dictionary()
+        self._court_jurisdictions = Dictionary()
+
+        # Whether tables returned by to_arrow() may still be using the column buffers
+        self._exported = False
+
+    @property
+    def reporters(self):
+        return self._reporters.values
+
+    @property
+    def court_types(self):
+        return self._court_types.values
+
+    @property
+    def court_jurisdictions(self):
+        return self._court_jurisdictions.values
+
+    def __len__(self):
+        return len(self.start_index)
+
+    def add_document(self, document_id, words):
+        """ Parses a document's word tokens and appends its citations to the columns.
+
+        Returns:
+            The number of citations found.
+        """
+        document_index = len(self.document_ids)
+        self.document_ids.append(document_id)
+
+        num_citations = 0
+        for citation_data in iter_citation_data(words):
+            self.add_citation(document_index, citation_data)
+            num_citations += 1
+
+        return num_citations
+
+    def add_citation(self, document_index, citation_data):
+        """ Appends one citation (a dict as returned by parse_tokens, with or without 'cite_string') to the columns. """
+        if self._exported:
+            self._unshare_buffers()
+        row = len(self.start_index)
+
+        self.document_index.append(document_index)
+        self.start_index.append(citation_data['start_index'])
+        self.end_index.append(citation_data['end_index'])
+        self.volume.append(citation_data['volume'])
+        self.reporter.append(self._reporters.encode(citation_data['reporter']))
+        self.case_first_page.append(citation_data.get('case_first_page'))
+        self.pincite.append(citation_data.get('pincite'))
+        self.cite_type.append(CITE_TYPES.index(citation_data['cite_type']))
+        self.year.append(parse_year(citation_data.get('year')))
+        self.court_type.append(self._court_types.encode(citation_data.get('court_type')))
+        self.court_jurisdiction.append(self._court_jurisdictions.encode(citation_data.get('court_jursidiction')))
+
+        for stringcite in citation_data.get('stringcites', ()):
+            self.stringcite_citation.append(row)
+            self.stringcite_volume.append(stringcite['volume'])
+            self.stringcite_reporter.append(self._reporters.encode(stringcite['reporter']))
+            self.stringcite_case_first_page.append(stringcite['case_first_page'])
+
+    def _unshare_buffers(self):
+        """ Gives the columns new copies of their buffers, leaving the old ones (and any tables exported from them)
+        unchanged. Buffers that are in use by Arrow can't be resized, so this is done before appending after to_arrow().
+        """
+        for name, column in list(vars(self).items()):
+            if isinstance(column, array):
+                setattr(self, name, array(column.typecode, column))
+            elif isinstance(column, StringColumn):
+                setattr(self, name, column.copy())
+        self._exported = False
+
+    def to_numpy(self):
+        """ Returns the columns as two NumPy structured arrays, (citations, stringcites). Strings are stored as
+        fixed-width unicode fields (missing strings are empty), and dictionary-encoded columns keep their codes.
+        Requires numpy.
+        """
+        import numpy as np
+
+        citation_columns = [
+            ('document_index', np.frombuffer(self.document_index, dtype=np.int32)),
+            ('start_index', np.frombuffer(self.start_index, dtype=np.int64)),
+            ('end_index', np.frombuffer(self.end_index, dtype=np.int64)),
+            ('volume', _string_column_to_numpy(np, self.volume)),
+            ('reporter', np.frombuffer(self.reporter, dtype=np.int32)),
+            ('case_first_page', _string_column_to_numpy(np, self.case_first_page)),
+            ('pincite', _string_column_to_numpy(np, self.pincite)),
+            ('cite_type', np.frombuffer(self.cite_type, dtype=np.int8)),
+            ('year', np.frombuffer(self.year, dtype=np.int16)),
+            ('court_type', np.frombuffer(self.court_type, dtype=np.int32)),
+            ('court_jurisdiction', np.frombuffer(self.court_jurisdiction, dtype=np.int32)),
+        ]
+        stringcite_columns = [
+            ('citation', np.frombuffer(self.stringcite_citation, dtype=np.int64)),
+            ('volume', _string_column_to_numpy(np, self.stringcite_volume)),
+            ('reporter', np.frombuffer(self.stringcite_reporter, dtype=np.int32)),
+            ('case_first_page', _string_column_to_numpy(np, self.stringcite_case_first_page)),
+        ]
+
+        return _structured_array(np, citation_columns), _structured_array(np, stringcite_columns)
+
+    def to_arrow(self):
+        """ Returns the columns as two pyarrow Tables, (citations, stringcites). Numeric and string columns share their
+        buffers with this object instead of being copied, dictionary-encoded columns become Arrow dictionary arrays
+        (including 'document_id', encoded by document_index), and missing values are nulls. Requires pyarrow.
+
+        The tables keep the buffers as they are when this is called: the next citation added to this object copies the
+        columns first, so the tables never change under their users.
+        """
+        import pyarrow as pa
+
+        self._exported = True
+
+        document_ids = pa.array(self.document_ids)
+
+        citations = pa.table({
+            'document_id': pa.DictionaryArray.from_arrays(
+                _numeric_column_to_arrow(pa, pa.int32(), self.document_index), document_ids),
+            'start_index': _numeric_column_to_arrow(pa, pa.int64(), self.start_index),
+            'end_index': _numeric_column_to_arrow(pa, pa.int64(), self.end_index),
+            'volume': _string_column_to_arrow(pa, self.volume),
+            'reporter': _dictionary_column_to_arrow(pa, self.reporter, self.reporters),
+            'case_first_page': _string_column_to_arrow(pa, self.case_first_page),
+            'pincite': _string_column_to_arrow(pa, self.pincite),
+            'cite_type': pa.DictionaryArray.from_arrays(_numeric_column_to_arrow(pa, pa.int8(), self.cite_type),
+                                                        pa.array(CITE_TYPES)),
+            'year': _numeric_column_to_arrow(pa, pa.int16(), self.year,
+                                             _validity_bitmap(pa, pa.int16(), self.year, NO_YEAR)),
+            'court_type': _dictionary_column_to_arrow(pa, self.court_type, self.court_types),
+            'court_jurisdiction': _dictionary_column_to_arrow(pa, self.court_jurisdiction, self.court_jurisdictions),
+        })
+
+        stringcites = pa.table({
+            'citation': _numeric_column_to_arrow(pa, pa.int64(), self.stringcite_citation),
+            'volume': _string_column_to_arrow(pa, self.stringcite_volume),
+            'reporter': _dictionary_column_to_arrow(pa, self.stringcite_reporter, self.reporters),
+            'case_first_page': _string_column_to_arrow(pa, self.stringcite_case_first_page),
+        })
+
+        return citations, stringcites
+
+
+def parse_documents_columnar(documents):
+    """ Parses a batch of documents into a CitationColumns object.
+
+    :param documents: An iterable of (document_id, words) tuples, where words is a list of word tokens.
+    :return: A CitationColumns object holding the citations of every document.
+    """
+    columns = CitationColumns()
+    for document_id, words in documents:
+        columns.add_document(document_id, words)
+    return columns
+
+
+def parse_year(year):
+    try:
+        return int(year)
+    except (TypeError, ValueError):
+        return NO_YEAR
+
+
+def _structured_array(np, columns):
+    num_rows = len(columns[0][1])
+    result = np.empty(num_rows, dtype=[(name, column.dtype) for name, column in columns])
+    for name, column in columns:
+        result[name] = column
+    return result
+
+
+def _string_column_to_numpy(np, column):
+    return np.array([value or '' for value in column.to_list()], dtype=str)
+
+
+def _numeric_column_to_arrow(pa, arrow_type, column, validity_bitmap=None):
+    return pa.Array.from_buffers(arrow_type, len(column), [validity_bitmap, pa.py_buffer(column)])
+
+
+def _validity_bitmap(pa, arrow_type, column, missing_value):
+    # Arrow booleans are bit-packed, so a comparison produces exactly the validity bitmap we need
+    import pyarrow.compute as pc
+    return pc.not_equal(_numeric_column_to_arrow(pa, arrow_type, column), missing_value).buffers()[1]
+
+
+def _string_column_to_arrow(pa, column):
+    validity = _validity_bitmap(pa, pa.uint8(), column.validity, 0)
+    return pa.Array.from_buffers(pa.large_string(), len(column),
+                                 [validity, pa.py_buffer(column.offsets), pa.py_buffer(column.data)])
+
+
+def _dictionary_column_to_arrow(pa, codes, values):
+    validity = _validity_bitmap(pa, pa.int32(), codes, NO_CODE)
+    indices = _numeric_column_to_arrow(pa, pa.int32(), codes, validity)
+    return pa.DictionaryArray.from_arrays(indices, pa.array(values, pa.string()))
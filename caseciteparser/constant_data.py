@@ -1,5 +1,17 @@
+import hashlib
+import os
+import pickle
+from importlib.util import find_spec
+
 from caseciteparser import token_dict
-from reporters_db import REPORTERS
+from caseciteparser.atomic_file import atomic_write
+
+# Bump this whenever the structure of the tables built by build_tables changes, so stale artifacts aren't loaded
+TABLE_FORMAT_VERSION = 4
+
+# The module attributes that are built by build_tables, and only loaded on first use
+TABLE_NAMES = ('REPORTER_TOKEN_DISAMBIGUATION_DICT', 'COURT_TOKEN_DICT', 'GEO_TOKEN_DICT', 'MONTH_TOKEN_DICT',
+               'REPORTER_MAX_TOKENS', 'REPORTER_DIGIT_PREFIXES')
 
 COURT_ABBREVIATIONS = ['Admin. Ct.', 'Adm.', 'Alder. Ct.', 'App. Ct.', 'App. Ct.', 'App. Dep’t', 'App. Div.', 'ASBCA',
                        'B.A.P.', 'Bankr.', 'B.C.A.', 'B.I.A.', 'B.P.A.I.', 'B.T.A.', 'Bor. Ct.', 'C.D.', 'Ch.',
@@ -30,7 +42,7 @@ GEOGRAPHIC_ABBREVIATIONS = ['Ala.', 'Alaska', 'Ariz.', 'Ark.', 'Cal.', 'Colo.',
 MONTH_ABBREVIATIONS = ['Jan.', 'Feb.', 'Mar.', 'Apr.', 'May', 'June', 'July', 'Aug.', 'Sept.', 'Oct.', 'Nov.', 'Dec.']
 
 
-def create_reporter_token_disambiguation_dict(reporters):
+def create_reporter_token_disambiguation_dict(reporters, tolerant=True):
     """ Creates a structure of the form {<reporter token_1>: {... -> {<reporter token_N>: {'' -> <proper reporter>}}}}.
     For example, 'F. 3d' would get mapped to 'F.' -> '3d.' -> '' -> 'F.3d'. This is useful so we can efficiently check
     whether a given string is a recognized reporter abbreviation, and, if so, determine the corresponding proper Bluebook
@@ -38,6 +50,8 @@ def create_reporter_token_disambiguation_dict(reporters):
 
     Args:
         reporters: An object structured like the 'REPORTERS' object in Free Law Project's reporters_db package.
+        tolerant: Whether to also add the spacing, apostrophe, and trailing comma variants of each reporter (see
+            token_dict.get_token_string_variants), after all of the reporters as written.
 
     Returns:
         A dict of the form described above.
@@ -60,6 +74,15 @@ def create_reporter_token_disambiguation_dict(reporters):
             token_dict.add_token_string_to_structure(reporter_token_disambiguation_dict, reporter_variation.split(),
                                           reporter_variation_proper)
 
+    if tolerant:
+        for reporter_base, reporter_data in reporters.items():
+            for reporter_edition in reporter_data[0]['editions']:
+                token_dict.add_token_string_variants_to_structure(reporter_token_disambiguation_dict, reporter_edition,
+                                                                  reporter_edition)
+            for reporter_variation, reporter_variation_proper in reporter_data[0]['variations'].items():
+                token_dict.add_token_string_variants_to_structure(reporter_token_disambiguation_dict,
+                                                                  reporter_variation, reporter_variation_proper)
+
     return reporter_token_disambiguation_dict
 
 
@@ -79,29 +102,163 @@ def find_reporter_at_index(words, start_index):
                   disambiguate_reporter(['blabla', 'F.', '3d.', 'asdasd'], 1) -> (3, 'F.3d')
     """
 
-    return token_dict.find_token_string_at_index(REPORTER_TOKEN_DISAMBIGUATION_DICT, words, start_index)
+    return token_dict.find_token_string_at_index(_tables['REPORTER_TOKEN_DISAMBIGUATION_DICT'], words, start_index)
 
 
-def create_token_dict_from_string_list(string_list):
+def create_token_dict_from_string_list(string_list, tolerant=True):
     structure = {}
     for string_elem in string_list:
         token_dict.add_token_string_to_structure(structure, string_elem.split(), string_elem)
+    if tolerant:
+        for string_elem in string_list:
+            token_dict.add_token_string_variants_to_structure(structure, string_elem, string_elem)
     return structure
 
 
 def find_court_at_index(words, start_index):
-    return token_dict.find_token_string_at_index(COURT_TOKEN_DICT, words, start_index)
+    return token_dict.find_token_string_at_index(_tables['COURT_TOKEN_DICT'], words, start_index)
 
 
 def find_geo_at_index(words, start_index):
-    return token_dict.find_token_string_at_index(GEO_TOKEN_DICT, words, start_index)
+    return token_dict.find_token_string_at_index(_tables['GEO_TOKEN_DICT'], words, start_index)
 
 
 def find_month_at_index(words, start_index):
-    return token_dict.find_token_string_at_index(MONTH_TOKEN_DICT, words, start_index)
+    return token_dict.find_token_string_at_index(_tables['MONTH_TOKEN_DICT'], words, start_index)
+
+
+def build_tables(tolerant=True):
+    """ Builds the token dicts used by the find_*_at_index functions from reporters_db and the abbreviation lists above.
+
+    Args:
+        tolerant: Whether the token dicts also match the common spacing, apostrophe, and trailing comma variants of
+            each string (see token_dict.get_token_string_variants). load_tables always builds tolerant tables; exact
+            ones are only built for comparison.
+
+    Returns:
+        A dict mapping each name in TABLE_NAMES to its value.
+    """
+    from reporters_db import REPORTERS
+
+    reporter_dict = create_reporter_token_disambiguation_dict(REPORTERS, tolerant)
+
+    return {
+        'REPORTER_TOKEN_DISAMBIGUATION_DICT': reporter_dict,
+        'COURT_TOKEN_DICT': create_token_dict_from_string_list(COURT_ABBREVIATIONS, tolerant),
+        'GEO_TOKEN_DICT': create_token_dict_from_string_list(GEOGRAPHIC_ABBREVIATIONS, tolerant),
+        'MONTH_TOKEN_DICT': create_token_dict_from_string_list(MONTH_ABBREVIATIONS, tolerant),
+        # The most tokens find_reporter_at_index can look at past its start index
+        'REPORTER_MAX_TOKENS': token_dict.get_max_depth(reporter_dict),
+        # Reporter first tokens of a reporter in which a number is followed by a reporter's first token, which could be
+        # a citation anchor hidden inside it (see cite_parser.find_citation_anchors). Reporters that merely contain a
+        # number, like 'La.App. 1 Cir.' or the 'F. 4th' spacing variant, can't hide one; no reporter in reporters_db
+        # does, but a new one could.
+        'REPORTER_DIGIT_PREFIXES': frozenset(token for token, child in reporter_dict.items()
+                                             if token_dict.contains_digit_token_before({token: child}, reporter_dict)),
+    }
+
+
+def get_reporters_db_version():
+    """ Returns the installed reporters_db version, read from its dist-info directory name (importlib.metadata would
+    cost more to import than loading the tables does), or the modification time of the package if there is none.
+    """
+    package_dir = os.path.dirname(find_spec('reporters_db').origin)
+    site_dir = os.path.dirname(package_dir)
+
+    for name in os.listdir(site_dir):
+        if name.startswith('reporters_db-') and name.endswith('.dist-info'):
+            return name[len('reporters_db-'):-len('.dist-info')]
+
+    # Not installed as a distribution (e.g., a source checkout on the path), so key on the package itself
+    return 'mtime' + str(int(os.path.getmtime(package_dir)))
+
+
+def get_table_key():
+    """ Returns a string identifying the tables build_tables would build: it changes whenever the reporters_db version,
+    TABLE_FORMAT_VERSION, or any of the abbreviation lists above change.
+    """
+    source = repr((TABLE_FORMAT_VERSION, COURT_ABBREVIATIONS, GEOGRAPHIC_ABBREVIATIONS, MONTH_ABBREVIATIONS))
+    digest = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+    return 'reporters_db-' + get_reporters_db_version() + '-' + digest
+
+
+def get_cache_dir():
+    """ Returns the directory holding precompiled tables: $CASECITEPARSER_CACHE_DIR if set, otherwise
+    caseciteparser/ under $XDG_CACHE_HOME (or ~/.cache).
+    """
+    cache_dir = os.environ.get('CASECITEPARSER_CACHE_DIR')
+    if cache_dir:
+        return cache_dir
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'caseciteparser')
+
+
+def get_table_artifact_path():
+    return os.path.join(get_cache_dir(), 'tables-' + get_table_key() + '.pickle')
+
+
+def load_tables():
+    """ Loads the precompiled tables for the installed reporters_db version, building (and saving) them first if no
+    artifact exists yet, and sets them as attributes of this module. If the cache directory isn't writable, the tables
+    are just built in memory.
+
+    Returns:
+        A dict mapping each name in TABLE_NAMES to its value.
+    """
+    table_key = get_table_key()
+    path = get_table_artifact_path()
+
+    tables = None
+    try:
+        with open(path, 'rb') as f:
+            tables = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    if tables is None or tables.get('TABLE_KEY') != table_key:
+        tables = build_tables()
+        tables['TABLE_KEY'] = table_key
+        save_tables(tables, path)
+
+    set_tables(tables)
+    return tables
+
+
+def set_tables(tables):
+    """ Sets tables (a dict like the one build_tables returns) as the tables used by this module, and empties the cache
+    of date parenthetical results parsed with the old ones (see cite_parser.cached_parenthetical_fsm).
+    """
+    from caseciteparser import cite_parser
+
+    globals().update(tables)
+    _tables.update(tables)
+    cite_parser.clear_parenthetical_cache()
+
+
+def save_tables(tables, path):
+    """ Atomically writes tables to path, so concurrent workers never see a partial artifact. Failures are ignored. """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as f:
+            pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
+
+
+class LazyTables(dict):
+    """ The tables used by the find_*_at_index functions, by name. Looking one up before the tables are loaded loads
+    them.
+    """
+
+    def __missing__(self, name):
+        return load_tables()[name]
+
+
+_tables = LazyTables()
 
 
-REPORTER_TOKEN_DISAMBIGUATION_DICT = create_reporter_token_disambiguation_dict(REPORTERS)
-COURT_TOKEN_DICT = create_token_dict_from_string_list(COURT_ABBREVIATIONS)
-GEO_TOKEN_DICT = create_token_dict_from_string_list(GEOGRAPHIC_ABBREVIATIONS)
-MONTH_TOKEN_DICT = create_token_dict_from_string_list(MONTH_ABBREVIATIONS)
\ No newline at end of file
+def __getattr__(name):
+    # The tables are only loaded the first time one of them is used (see load_tables)
+    if name in TABLE_NAMES or name == 'TABLE_KEY':
+        return load_tables()[name]
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,118 @@
+from collections import Counter
+
+
+class CitationCounts:
+    """ Aggregate counts of the citations in a batch of documents, for jobs that only need totals. add_tokens runs the
+    same state machine as parse_tokens (see table_engine.py), but counts each citation as it is found instead of
+    building its dict and cite string. Counts from different documents or worker processes can be combined with merge.
+
+    Attributes:
+        documents: the number of documents counted.
+        tokens: the number of word tokens in those documents.
+        citations: the number of citations found.
+        cite_types: a Counter mapping each cite type ('full_cite' or 'short_cite') to the number of citations of it.
+        reporters: a Counter mapping each reporter to the number of times it was cited, as the reporter of a citation
+            or of one of its stringcites.
+        stringcites: the number of stringcites found.
+        courts: a Counter mapping a (court type, court jurisdiction) pair, either of which may be None, to the number of
+            citations whose date parenthetical names that court.
+        years: a Counter mapping a year to the number of citations whose date parenthetical has that year.
+    """
+
+    def __init__(self):
+        self.documents = 0
+        self.tokens = 0
+        self.citations = 0
+        self.cite_types = Counter()
+        self.reporters = Counter()
+        self.stringcites = 0
+        self.courts = Counter()
+        self.years = Counter()
+
+    def add_tokens(self, words, budget=None):
+        """ Counts the citations parse_tokens(words) would return.
+
+        :param words: Word tokens to parse for citations.
+        :param budget: An optional budget.ParseBudget, as for parse_tokens.
+        """
+        from caseciteparser.table_engine import run_table_engine
+
+        reporters = []
+        cite_types = []
+        paren_data_list = []
+        stringcite_reporters = []
+
+        def emit(start_index, end_index, volume, reporter, case_first_page, pincite, stringcites, cite_type,
+                 paren_data):
+            reporters.append(reporter)
+            cite_types.append(cite_type)
+            if stringcites is not None:
+                stringcite_reporters.extend(stringcite[1] for stringcite in stringcites)
+            if paren_data is not None:
+                paren_data_list.append(paren_data)
+
+        run_table_engine(words, emit, budget=budget)
+
+        self.documents += 1
+        self.tokens += len(words)
+        self.citations += len(reporters)
+        self.cite_types.update(cite_types)
+        self.reporters.update(reporters)
+        self.reporters.update(stringcite_reporters)
+        self.stringcites += len(stringcite_reporters)
+        self.add_paren_data(paren_data_list)
+
+    def add_string(self, string, budget=None):
+        """ Counts the citations parse_string(string) would return. """
+        self.add_tokens(string.split(), budget)
+
+    def add_citations(self, citations, num_tokens=0):
+        """ Counts a document's citations that have already been parsed (dicts returned by parse_tokens). """
+        self.documents += 1
+        self.tokens += num_tokens
+        self.citations += len(citations)
+        self.cite_types.update(citation['cite_type'] for citation in citations)
+        for citation in citations:
+            self.reporters[citation['reporter']] += 1
+            for stringcite in citation.get('stringcites', ()):
+                self.reporters[stringcite['reporter']] += 1
+                self.stringcites += 1
+        self.add_paren_data([citation for citation in citations if 'date_paren_string' in citation])
+
+    def add_paren_data(self, paren_data_list):
+        """ Counts the courts and years of a list of date parenthetical results (or citation dicts). """
+        for paren_data in paren_data_list:
+            court = (paren_data.get('court_type'), paren_data.get('court_jursidiction'))
+            if court != (None, None):
+                self.courts[court] += 1
+            if 'year' in paren_data:
+                self.years[paren_data['year']] += 1
+
+    def merge(self, other):
+        """ Adds the counts of another CitationCounts object to this one. """
+        self.documents += other.documents
+        self.tokens += other.tokens
+        self.citations += other.citations
+        self.cite_types.update(other.cite_types)
+        self.reporters.update(other.reporters)
+        self.stringcites += other.stringcites
+        self.courts.update(other.courts)
+        self.years.update(other.years)
+
+    def __eq__(self, other):
+        return isinstance(other, CitationCounts) and vars(self) == vars(other)
+
+    def report(self, top=10):
+        """ Returns a human-readable summary of the counts, listing the top most common reporters, courts and years. """
+        short_cites = self.cite_types['short_cite']
+        lines = ['{} documents, {} tokens, {} citations ({} full cites, {} short cites, {:.1%} short), {} stringcites'
+                 .format(self.documents, self.tokens, self.citations, self.cite_types['full_cite'], short_cites,
+                         short_cites / max(self.citations, 1), self.stringcites)]
+
+        for name, counter in (('reporters', self.reporters), ('courts', self.courts), ('years', self.years)):
+            lines.append('{}:'.format(name))
+            for key, count in counter.most_common(top):
+                if isinstance(key, tuple):
+                    key = ' '.join(part for part in key if part is not None)
+                lines.append('  {:<32} {:>10}'.format(key, count))
+        return '\n'.join(lines)
@@ -0,0 +1,94 @@
+from caseciteparser.cite_parser import (ShortCiteResolver, classify_tokens, find_citation_anchors, finish_citation,
+                                        iter_citation_data)
+from caseciteparser.stream_parser import get_lookahead
+
+# The number of words past an edit that are first looked at for citation anchors
+INITIAL_WINDOW = 256
+
+
+def reparse_tokens(words, citations, edit_start, edit_end, new_tokens, resolve_short_cites=False):
+    """ Updates the citations of a document after an edit, without parsing the whole document again: the result is the
+    same as parse_tokens(new_words, resolve_short_cites=resolve_short_cites), where new_words is words with
+    words[edit_start:edit_end] replaced by new_tokens.
+
+    Only the part of the document the edit can affect is parsed again. Parsing restarts right after the last citation
+    that ends more than a lookahead window (see stream_parser.get_lookahead) before the edit, since nothing up to that
+    point could have looked at the edited words. It stops at the first citation found after the edit that ends where
+    one of the old citations ended (shifted by the change in length): from there on, the state machine is in the same
+    state as before, looking at the same words, so the rest of the old citations are kept, with their 'start_index'
+    and 'end_index' shifted. With resolve_short_cites, the 'antecedent_index' of every citation from the edit on is
+    worked out again (it is an index into the list of citations, so it changes whenever citations are added or
+    removed before it); that only takes a dict lookup per citation.
+
+    :param words: The word tokens the citations were parsed from.
+    :param citations: The list of citation dicts parse_tokens(words, resolve_short_cites=resolve_short_cites)
+        returned. It isn't modified.
+    :param edit_start: The index of the first word replaced.
+    :param edit_end: The index after the last word replaced (equal to edit_start for an insertion).
+    :param new_tokens: The word tokens replacing words[edit_start:edit_end] (empty for a deletion).
+    :param resolve_short_cites: Whether the citations link short cites to their full cites (see parse_tokens).
+    :return: A tuple (new_words, new_citations).
+    """
+    if not 0 <= edit_start <= edit_end <= len(words):
+        raise ValueError("Invalid edit range [{}, {}) for {} words".format(edit_start, edit_end, len(words)))
+
+    new_tokens = list(new_tokens)
+    new_words = words[:edit_start] + new_tokens + words[edit_end:]
+    new_edit_end = edit_start + len(new_tokens)
+    shift = new_edit_end - edit_end
+
+    # The citations before the edit that are certain to be found again
+    lookahead = get_lookahead()
+    num_kept = 0
+    while num_kept < len(citations) and citations[num_kept]['end_index'] + 1 + lookahead <= edit_start:
+        num_kept += 1
+    start_index = citations[num_kept - 1]['end_index'] + 1 if num_kept else 1
+
+    # The old citations after the edit, by where they end in new_words
+    old_ends = {citation['end_index'] + shift: i for i, citation in enumerate(citations)
+                if i >= num_kept and citation['end_index'] >= edit_end}
+
+    new_citations = citations[:num_kept]
+
+    # Anchors are only found for a window of words past the edit, which grows until the parse is back in step with the
+    # old one (this keeps a small edit from costing a pass over the whole document)
+    window_end = new_edit_end + INITIAL_WINDOW
+    while True:
+        window_end = min(window_end, len(new_words))
+        first = start_index - 1
+        anchors = [anchor + first for anchor in find_citation_anchors(classify_tokens(new_words[first:window_end]))]
+
+        for citation_data in iter_citation_data(new_words, anchors, start_index=start_index):
+            new_citations.append(finish_citation(new_words, citation_data))
+            start_index = citation_data['end_index'] + 1
+
+            if citation_data['end_index'] in old_ends:
+                # Back in step with the old parse
+                for citation in citations[old_ends[citation_data['end_index']] + 1:]:
+                    new_citations.append(dict(citation, start_index=citation['start_index'] + shift,
+                                              end_index=citation['end_index'] + shift))
+                return new_words, finish_citations(new_citations, num_kept, resolve_short_cites)
+
+        if window_end == len(new_words):
+            return new_words, finish_citations(new_citations, num_kept, resolve_short_cites)
+
+        # Out of anchors in the window: go on from the last citation found, with a bigger window
+        window_end = start_index + 2 * max(window_end - start_index, INITIAL_WINDOW)
+
+
+def finish_citations(new_citations, num_kept, resolve_short_cites):
+    """ If resolve_short_cites is set, gives each citation after the first num_kept (all of which are new dicts, not
+    the caller's) its 'antecedent_index' in new_citations. Returns new_citations.
+    """
+    if resolve_short_cites:
+        resolver = ShortCiteResolver()
+        for index, citation in enumerate(new_citations):
+            if index < num_kept:
+                # Nothing before the edit changed, so neither did its antecedents; it only has to be seen
+                resolver.resolve(index, citation['volume'], citation['reporter'], citation.get('cite_type'),
+                                 [(stringcite['volume'], stringcite['reporter'])
+                                  for stringcite in citation.get('stringcites', ())])
+            else:
+                citation.pop('antecedent_index', None)
+                resolver.resolve_citation_data(index, citation)
+    return new_citations
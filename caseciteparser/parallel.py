@@ -0,0 +1,122 @@
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+
+from caseciteparser import constant_data
+from caseciteparser.cite_parser import classify_tokens, find_citation_anchors
+from caseciteparser.stream_parser import get_lookahead
+
+# The smallest number of words parse_tokens splits among workers; shorter documents are parsed in one piece
+PARALLEL_MIN_CHUNK_SIZE = 50000
+
+# How many times the state machine's lookahead (see stream_parser.get_lookahead) each chunk reaches into the next one
+OVERLAP_LOOKAHEADS = 8
+
+
+def parallel_citation_data(words, workers, chunk_size=None, overlap=None):
+    """ Returns the citation data (see cite_parser.iter_citation_data) of every citation in words, in order, parsing
+    chunks of the words on a pool of worker processes. The result is the same as parsing the words in one piece.
+
+    Each worker runs the table engine over its chunk plus an overlap into the next chunk, recording every anchor it
+    tries to start a citation at (see table_engine.run_table_engine). The scan of the chunk after it starts in the
+    middle of whatever the previous chunk was parsing there, so its first few attempts may be ones the sequential parse
+    never makes; but once both workers try the same anchor, they are in the same state, and parse the same citations
+    from there on. Each chunk's citations are therefore taken from the first anchor tried by both it and the chunk
+    before it, up to the first anchor tried by both it and the chunk after it. An attempt that would have needed words
+    past the end of a worker's overlap can't be trusted, and if no common anchor is found before it (a citation longer
+    than the overlap, say), the rest of the document is parsed in this process instead.
+
+    :param words: Word tokens to parse for citations.
+    :param workers: The number of worker processes.
+    :param chunk_size: The number of words in each chunk (defaults to splitting words evenly among the workers, but not
+        into chunks smaller than PARALLEL_MIN_CHUNK_SIZE). Chunks are never smaller than twice the overlap.
+    :param overlap: The number of words each chunk's parse reaches into the next chunk (defaults to OVERLAP_LOOKAHEADS
+        times the lookahead). The results don't depend on it; only how often the fallback is needed does.
+    :return: A list of citation data dicts.
+    """
+    from caseciteparser.table_engine import make_citation_data, run_table_engine
+
+    if overlap is None:
+        overlap = OVERLAP_LOOKAHEADS * get_lookahead()
+    if chunk_size is None:
+        chunk_size = max(-(-len(words) // workers), PARALLEL_MIN_CHUNK_SIZE)
+    chunk_size = max(chunk_size, 2 * overlap, 1)
+
+    # Chunk k covers [starts[k], starts[k + 1]) and is parsed with words up to its end plus the overlap
+    starts = list(range(1, len(words), chunk_size)) or [1]
+    ends = starts[1:] + [len(words)]
+    slice_ends = [min(end + overlap, len(words)) for end in ends]
+
+    if len(starts) == 1 or workers <= 1:
+        chunk_results = [parse_chunk(words[start - 1:slice_end], start - 1, overlap)
+                         for start, slice_end in zip(starts, slice_ends)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=constant_data.load_tables) as executor:
+            chunk_results = list(executor.map(parse_chunk, [words[start - 1:slice_end]
+                                                            for start, slice_end in zip(starts, slice_ends)],
+                                              [start - 1 for start in starts], [overlap] * len(starts)))
+
+    citation_data_list = []
+    sync_anchor = 1  # The scan of the sequential parse tries this anchor, and chunk k's parse agrees from there on
+    for k, (chunk_citation_data, attempts, cut_anchor, _) in enumerate(chunk_results):
+        if k == len(chunk_results) - 1:
+            next_sync_anchor = len(words) + 1
+        else:
+            next_sync_anchor = find_sync_anchor(attempts, cut_anchor, sync_anchor, starts[k + 1],
+                                                chunk_results[k + 1][1], chunk_results[k + 1][3])
+            if next_sync_anchor is None:
+                # Fall back to parsing the rest in one piece, from where the sequential parse is known to be
+                run_table_engine(words, lambda *args: citation_data_list.append(make_citation_data(*args)),
+                                 start_index=sync_anchor)
+                return citation_data_list
+
+        # A citation found from an attempt at anchor a starts at a - 1, with its volume
+        citation_data_list.extend(citation_data for citation_data in chunk_citation_data
+                                  if sync_anchor - 1 <= citation_data['start_index'] < next_sync_anchor - 1)
+        sync_anchor = next_sync_anchor
+
+    return citation_data_list
+
+
+def find_sync_anchor(attempts, cut_anchor, sync_anchor, next_start, next_attempts, next_overlap_anchor):
+    """ Returns the first anchor, at or after both sync_anchor and next_start (the start of the next chunk), that a
+    chunk's parse tried before any attempt it can't trust (cut_anchor), and that the next chunk's parse tried too; or
+    None if there is no such anchor. next_attempts and next_overlap_anchor are what parse_chunk returned for the next
+    chunk.
+    """
+    next_attempt_set = set(next_attempts)
+    for anchor in attempts[bisect_left(attempts, max(sync_anchor, next_start)):]:
+        if cut_anchor is not None and anchor >= cut_anchor:
+            return None
+        if anchor in next_attempt_set:
+            return anchor
+
+    # If the chunk's scan got to the end of its overlap without starting a citation it couldn't finish, the sequential
+    # parse tries the first anchor after the overlap next
+    if cut_anchor is None and next_overlap_anchor in next_attempt_set:
+        return next_overlap_anchor
+    return None
+
+
+def parse_chunk(words, offset, overlap):
+    """ Runs in a worker process: parses a chunk of words (starting at index offset of the whole document, and
+    including the overlap into the next chunk). Returns (citation data list, attempts, cut anchor, overlap anchor),
+    all with indices into the whole document: the citations found, the anchors tried and the first attempt that would
+    have needed more words (see table_engine.run_table_engine), and the first anchor after the overlap the previous
+    chunk's words reach into (or None).
+    """
+    from caseciteparser.table_engine import make_citation_data, run_table_engine
+
+    citation_data_list = []
+    attempts = []
+    token_classes = classify_tokens(words)
+    anchors = find_citation_anchors(token_classes)
+    cut_anchor = run_table_engine(words, lambda *args: citation_data_list.append(make_citation_data(*args)),
+                                  token_classes=token_classes, anchors=anchors, attempts=attempts)
+
+    for citation_data in citation_data_list:
+        citation_data['start_index'] += offset
+        citation_data['end_index'] += offset
+    pos = bisect_left(anchors, 1 + overlap)
+    overlap_anchor = anchors[pos] + offset if pos < len(anchors) else None
+    return (citation_data_list, [anchor + offset for anchor in attempts],
+            cut_anchor + offset if cut_anchor is not None else None, overlap_anchor)
@@ -0,0 +1,331 @@
+""" A long-running parse service, so programs that aren't written in Python (or that parse one short document at a
+time) don't pay for starting Python and loading the reporter tables on every call.
+
+Run it with:
+
+    python -m caseciteparser.server [--host HOST] [--port PORT | --unix-socket PATH] [--workers N]
+
+and POST a JSON object to /parse: {"text": "..."} for one document, or {"texts": ["...", ...]} for several. The
+response is {"citations": [...]} (or {"results": [[...], ...]}, one list per text), holding the citation dicts
+parse_string returns. An optional "engine" key picks the parse_string engine. GET /health returns counts of what the
+server has done so far.
+
+Documents from concurrent requests are collected into batches and parsed on a pool of worker processes that load the
+tables once, at startup. Requests beyond what the pool can keep up with wait in a bounded queue; once it's full, new
+requests are turned away right away with 503 Service Unavailable (and a Retry-After header) instead of piling up. A
+request with more texts than the whole queue holds could never be accepted, so it gets 413 Payload Too Large instead.
+If parsing fails in the pool (a worker dies, say), the requests waiting on it get 500 Internal Server Error.
+"""
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from caseciteparser import constant_data
+from caseciteparser.cite_parser import parse_string
+
+DEFAULT_PORT = 8300
+
+# The largest request body accepted
+MAX_BODY_BYTES = 64 * 2 ** 20
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class ParseServer:
+    """ Serves parse requests over HTTP/1.1 (with keep-alive) on a TCP or Unix socket.
+
+    Args:
+        workers: the number of worker processes (defaults to the number of CPUs).
+        batch_size: the most documents sent to a worker at once.
+        batch_delay: how long (in seconds) to wait for more documents before sending out a batch that isn't full.
+        max_queue: the most documents waiting for a worker before requests are refused with 503 (at least 1). This is
+            also the most texts a single request may have.
+    """
+
+    def __init__(self, workers=None, batch_size=32, batch_delay=0.002, max_queue=1024):
+        if max_queue < 1:
+            # asyncio.Queue would take 0 to mean unbounded
+            raise ValueError("max_queue must be at least 1")
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_queue = max_queue
+
+        self.requests = 0
+        self.documents = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failed = 0
+
+        self._executor = None
+        self._queue = None
+        self._batcher = None
+        self._batch_tasks = set()  # The _parse_batch tasks still running
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT, unix_socket=None):
+        """ Starts the worker pool (loading the tables in every worker) and begins accepting connections. """
+        loop = asyncio.get_running_loop()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=constant_data.load_tables)
+        # Make sure every worker has started and loaded the tables before the first request comes in
+        await asyncio.gather(*[loop.run_in_executor(self._executor, parse_batch, [], 'fsm')
+                               for _ in range(self.workers)])
+
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._batcher = asyncio.ensure_future(self._run_batches())
+
+        if unix_socket is not None:
+            self._server = await asyncio.start_unix_server(self._handle_connection, path=unix_socket)
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server
+
+    async def close(self):
+        """ Stops accepting connections, lets the batches sent to the pool finish, fails the requests whose documents
+        are still queued, and shuts the pool down.
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        self._batcher.cancel()
+        await asyncio.gather(self._batcher, return_exceptions=True)
+        await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+        while not self._queue.empty():
+            fail_batch([self._queue.get_nowait()], ConnectionAbortedError('Server closed'))
+        # Waiting for the workers to exit blocks, so do it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+    async def parse(self, texts, engine='fsm'):
+        """ Queues texts for parsing and returns their citation lists. Raises TooManyTexts if there are more of them
+        than the queue holds, or asyncio.QueueFull if there isn't room for all of them right now.
+        """
+        if len(texts) > self._queue.maxsize:
+            raise TooManyTexts('At most {} texts per request'.format(self._queue.maxsize))
+        if self._queue.maxsize - self._queue.qsize() < len(texts):
+            raise asyncio.QueueFull
+
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._queue.put_nowait((text, engine, future))
+            futures.append(future)
+
+        self.documents += len(texts)
+        # Wait for every text, even if one fails, so no failure goes unretrieved
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    async def _run_batches(self):
+        """ Takes documents off the queue in batches and sends each batch to the pool, keeping at most two batches per
+        worker in flight; while the pool is busy, documents wait in the queue (which is what applies backpressure).
+        """
+        loop = asyncio.get_running_loop()
+        in_flight = asyncio.Semaphore(2 * self.workers)
+
+        while True:
+            batch = [await self._queue.get()]
+
+            try:
+                # Give concurrent requests a moment to fill the batch
+                deadline = loop.time() + self.batch_delay
+                while len(batch) < self.batch_size:
+                    if not self._queue.empty():
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+
+                await in_flight.acquire()
+            except asyncio.CancelledError:  # Closing, with this batch taken off the queue but not sent out
+                fail_batch(batch, ConnectionAbortedError('Server closed'))
+                raise
+
+            self.batches += 1
+            task = asyncio.ensure_future(self._parse_batch(loop, batch, in_flight))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _parse_batch(self, loop, batch, in_flight):
+        try:
+            # A batch holds documents of one engine each, so group them
+            engines = {engine for text, engine, future in batch}
+            for engine in engines:
+                items = [(text, future) for text, item_engine, future in batch if item_engine == engine]
+                try:
+                    results = await loop.run_in_executor(self._executor, parse_batch, [text for text, _ in items],
+                                                         engine)
+                except Exception as e:  # E.g., BrokenProcessPool, or a result that couldn't be pickled
+                    fail_batch([(text, engine, future) for text, future in items], e)
+                else:
+                    for (_, future), result in zip(items, results):
+                        if not future.done():
+                            future.set_result(result)
+        finally:
+            in_flight.release()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                status, response, extra_headers = await self._respond(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                write_response(writer, status, response, extra_headers, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as e:  # A malformed request
+            write_response(writer, 413 if isinstance(e, BodyTooLarge) else 400, {'error': str(e)}, (), False)
+        finally:
+            writer.close()
+
+    async def _respond(self, method, path, body):
+        """ Returns (status, JSON-serializable response, extra headers) for a request. """
+        if path == '/health':
+            return 200, {'status': 'ok', 'workers': self.workers, 'requests': self.requests,
+                         'documents': self.documents, 'batches': self.batches, 'rejected': self.rejected,
+                         'failed': self.failed, 'queued': self._queue.qsize()}, ()
+        if path != '/parse':
+            return 404, {'error': 'Not found'}, ()
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}, (('Allow', 'POST'),)
+
+        try:
+            data = json.loads(body)
+            engine = data.get('engine', 'fsm')
+            if 'texts' in data:
+                texts = data['texts']
+            else:
+                texts = [data['text']]
+            if not all(isinstance(text, str) for text in texts) or engine not in ('fsm', 'table'):
+                raise ValueError
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return 400, {'error': 'Expected a JSON object with "text" or "texts", and optionally "engine"'}, ()
+
+        self.requests += 1
+        try:
+            results = await self.parse(texts, engine)
+        except TooManyTexts as e:
+            self.rejected += 1
+            return 413, {'error': str(e)}, ()
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return 503, {'error': 'Too many documents queued'}, (('Retry-After', '1'),)
+        except Exception as e:
+            self.failed += 1
+            return 500, {'error': 'Parsing failed: {!r}'.format(e)}, ()
+
+        if 'texts' in data:
+            return 200, {'results': results}, ()
+        return 200, {'citations': results[0]}, ()
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+class TooManyTexts(ValueError):
+    pass
+
+
+def fail_batch(batch, exception):
+    """ Fails the future of every (text, engine, future) item of a batch that isn't done yet with exception. """
+    for _, _, future in batch:
+        if not future.done():
+            future.set_exception(exception)
+
+
+def parse_batch(texts, engine):
+    """ Runs in a worker process: parses each text of a batch. """
+    return [parse_string(text, engine=engine) for text in texts]
+
+
+async def read_request(reader):
+    """ Reads one HTTP/1.1 request, and returns (method, path, headers, body), or None if the connection was closed
+    before a new request started. Raises ValueError if the request is malformed.
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    parts = request_line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError('Malformed request line')
+    method, path = parts[0], parts[1]
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise asyncio.IncompleteReadError(line, None)
+        line = line.decode('latin-1').rstrip('\r\n')
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY_BYTES:
+        raise BodyTooLarge('Request body too large')
+    body = await reader.readexactly(length) if length else b''
+
+    return method, path.split('?', 1)[0], headers, body
+
+
+def write_response(writer, status, response, extra_headers, keep_alive):
+    body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+    lines = ['HTTP/1.1 {} {}'.format(status, REASONS[status]),
+             'Content-Type: application/json; charset=utf-8',
+             'Content-Length: {}'.format(len(body)),
+             'Connection: {}'.format('keep-alive' if keep_alive else 'close')]
+    lines.extend('{}: {}'.format(name, value) for name, value in extra_headers)
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+
+async def serve(host='127.0.0.1', port=DEFAULT_PORT, unix_socket=None, **server_kwargs):
+    """ Runs a ParseServer until cancelled. """
+    server = ParseServer(**server_kwargs)
+    await server.start(host, port, unix_socket)
+    print('Serving on {}'.format(unix_socket or '{}:{}'.format(host, port)), flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix-socket', help="listen on this Unix socket instead of a TCP port")
+    parser.add_argument('--workers', type=int, help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--batch-delay', type=float, default=0.002, help="seconds to wait to fill a batch")
+    parser.add_argument('--max-queue', type=int, default=1024, help="documents queued before answering 503")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix_socket, workers=args.workers, batch_size=args.batch_size,
+                          batch_delay=args.batch_delay, max_queue=args.max_queue))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
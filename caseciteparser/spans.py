@@ -0,0 +1,152 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+
+from caseciteparser import constant_data
+from caseciteparser.cite_parser import finish_citation, iter_citation_data, iter_with_antecedents
+
+TOKEN_PATTERNS = {str: re.compile(r'\S+'), bytes: re.compile(rb'\S+')}
+
+# Tokens that might be volume numbers (tokens of ASCII digits and non-ASCII characters), with the token after each as
+# group 2. Every token for which str.isdigit() is True matches (the digits that aren't ASCII, like '²', are all
+# non-ASCII), so the candidates only need checking with isdigit(). The next token is only looked ahead at, so that it
+# can be a candidate itself.
+VOLUME_CANDIDATE_PATTERNS = {str: re.compile(r'(?<!\S)([^\s\x00-/:-\x7f]+)\s+(?=(\S+))'),
+                             bytes: re.compile(rb'(?<!\S)([^\s\x00-/:-\x7f]+)\s+(?=(\S+))')}
+
+_digit_prefix_patterns = {}
+
+
+def get_text_type(text):
+    """ Returns str for a str, or bytes for any other bytes-like object (bytes, bytearray, mmap). """
+    return str if isinstance(text, str) else bytes
+
+
+def iter_token_spans(text):
+    """ Yields the (start, end) span of each whitespace-delimited token of text, so that text[start:end] is the same
+    token str.split() (or bytes.split(), for bytes) would give. Offsets are character offsets in a str, and byte
+    offsets in bytes, a bytearray, or an mmap (where only ASCII whitespace separates tokens).
+    """
+    for match in TOKEN_PATTERNS[get_text_type(text)].finditer(text):
+        yield match.span()
+
+
+class SpanWords:
+    """ The word tokens of a text, as a read-only sequence that parse_tokens can parse in place of a list of words. Only
+    the start offset of each token is stored; a token is only copied out of the text (and decoded from UTF-8, for
+    bytes) when it is looked at.
+
+    Args:
+        text: A str, or a bytes-like object (bytes, bytearray, or mmap) holding UTF-8 text.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.is_bytes = get_text_type(text) is bytes
+        self.token_pattern = TOKEN_PATTERNS[get_text_type(text)]
+        self.starts = array('q', map(re.Match.start, self.token_pattern.finditer(text)))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self.starts)))]
+
+        token = self.token_pattern.match(self.text, self.starts[i]).group()
+        if self.is_bytes:
+            return token.decode('utf-8', 'replace')
+        return token
+
+    def __iter__(self):
+        for i in range(len(self.starts)):
+            yield self[i]
+
+    def get_span(self, i):
+        """ Returns the (start, end) offsets of token i. """
+        return self.token_pattern.match(self.text, self.starts[i]).span()
+
+    def get_token_index(self, offset):
+        """ Returns the index of the token containing offset (or the last token starting before it). """
+        return bisect_right(self.starts, offset) - 1
+
+
+def find_span_anchors(words):
+    """ Returns the same anchors as find_citation_anchors(classify_tokens(words)) for SpanWords, but without looking at
+    every token: volume numbers (with the tokens after them) are found with a regular expression, and only the tokens
+    after them are looked up in the reporter dict.
+    """
+    reporter_dict = constant_data.REPORTER_TOKEN_DISAMBIGUATION_DICT
+    text_type = bytes if words.is_bytes else str
+    starts = words.starts
+    anchors = []
+
+    # A reporter's first word preceded by a volume number
+    for match in VOLUME_CANDIDATE_PATTERNS[text_type].finditer(words.text):
+        volume, word = match.groups()
+        if text_type is bytes:
+            volume, word = volume.decode('utf-8', 'replace'), word.decode('utf-8', 'replace')
+        if word in reporter_dict and volume.isdigit() and volume not in reporter_dict:
+            anchors.append(bisect_left(starts, match.start(2)))
+
+    # Reporters that could hide an anchor (see cite_parser.find_citation_anchors) are anchors wherever they appear
+    for match in get_digit_prefix_pattern(text_type).finditer(words.text):
+        i = bisect_left(starts, match.start())
+        if i >= 1:
+            anchors.append(i)
+
+    return sorted(set(anchors))
+
+
+def get_digit_prefix_pattern(text_type):
+    """ Returns a regular expression matching any whole token in constant_data.REPORTER_DIGIT_PREFIXES. """
+    prefixes = constant_data.REPORTER_DIGIT_PREFIXES
+    key = (prefixes, text_type)
+    if key not in _digit_prefix_patterns:
+        alternatives = '|'.join(re.escape(prefix) for prefix in sorted(prefixes, key=len, reverse=True)) or '(?!)'
+        pattern = r'(?<!\S)(?:' + alternatives + r')(?!\S)'
+        if text_type is bytes:
+            pattern = pattern.encode('utf-8')
+        _digit_prefix_patterns[key] = re.compile(pattern)
+    return _digit_prefix_patterns[key]
+
+
+def parse_spans(text, as_objects=False, engine='fsm', budget=None, resolve_short_cites=False):
+    """ Parses a text for citations without splitting it into a list of words first (see SpanWords), and returns what
+    parse_string would, with two more keys in each citation:
+        'start_offset': the offset in text of the start of the citation's first word; and
+        'end_offset': the offset in text just past the end of its last word,
+    so text[start_offset:end_offset] is the citation as it appears in the text. Offsets are character offsets for a
+    str, and byte offsets for a bytes-like object (bytes, bytearray, or mmap), which is decoded as UTF-8 and split
+    on ASCII whitespace only.
+
+    :param text: A str, or a bytes-like object holding UTF-8 text.
+    :param as_objects: See parse_tokens.
+    :param engine: See parse_tokens.
+    :param budget: See parse_tokens.
+    :param resolve_short_cites: See parse_tokens.
+    :return: A list of citation dicts (or Citation objects).
+    """
+    words = SpanWords(text)
+    anchors = find_span_anchors(words)
+
+    if engine == 'fsm':
+        citation_data_iter = iter_citation_data(words, anchors, budget=budget)
+    elif engine == 'table':
+        from caseciteparser.table_engine import make_citation_data, run_table_engine
+        citation_data_list = []
+        run_table_engine(words, lambda *args: citation_data_list.append(make_citation_data(*args)), anchors=anchors,
+                         budget=budget)
+        citation_data_iter = citation_data_list
+    else:
+        raise ValueError("Unknown engine: {!r}".format(engine))
+
+    if resolve_short_cites:
+        citation_data_iter = iter_with_antecedents(citation_data_iter)
+
+    cite_list = []
+    for citation_data in citation_data_iter:
+        citation_data['start_offset'] = words.starts[citation_data['start_index']]
+        citation_data['end_offset'] = words.get_span(citation_data['end_index'])[1]
+        cite_list.append(finish_citation(words, citation_data, as_objects))
+    return cite_list
@@ -0,0 +1,60 @@
+from collections import Counter
+
+
+class CitationStats:
+    """ Counters describing what the citation state machine did, for finding out why a batch of documents parses
+    slowly. Pass one to parse_tokens(words, stats=...) to fill it in; when no stats object is passed, none of this is
+    tracked. The same object can be passed for many documents (or merged across workers) to get totals.
+
+    Attributes:
+        documents: the number of documents parsed.
+        tokens: the number of word tokens in those documents.
+        anchors: the number of words the scan had to look at (see cite_parser.find_citation_anchors).
+        citations: the number of citations found.
+        calls: a Counter mapping each state function name (e.g., 'do_scan_for_reporter') to the number of times it was
+            called.
+        seconds: a Counter mapping each state function name to the total time spent in it.
+        backtracks: the number of near misses that sent the scan back to just after the start of the failed citation
+            (see cite_parser.failure_citation_state).
+        rescanned_tokens: the number of tokens the scan has to go over again because of those backtracks.
+        trie_depths: a Counter mapping a depth to the number of reporter lookups made by do_scan_for_reporter that
+            walked that many tokens into the reporter trie before stopping.
+    """
+
+    def __init__(self):
+        self.documents = 0
+        self.tokens = 0
+        self.anchors = 0
+        self.citations = 0
+        self.calls = Counter()
+        self.seconds = Counter()
+        self.backtracks = 0
+        self.rescanned_tokens = 0
+        self.trie_depths = Counter()
+
+    def merge(self, other):
+        """ Adds the counts of another CitationStats object to this one. """
+        self.documents += other.documents
+        self.tokens += other.tokens
+        self.anchors += other.anchors
+        self.citations += other.citations
+        self.calls.update(other.calls)
+        self.seconds.update(other.seconds)
+        self.backtracks += other.backtracks
+        self.rescanned_tokens += other.rescanned_tokens
+        self.trie_depths.update(other.trie_depths)
+
+    def report(self):
+        """ Returns a human-readable summary of the counts. """
+        lines = ['{} documents, {} tokens, {} anchors, {} citations'.format(self.documents, self.tokens, self.anchors,
+                                                                            self.citations),
+                 '{} backtracks, {} tokens rescanned'.format(self.backtracks, self.rescanned_tokens)]
+
+        for name, calls in self.calls.most_common():
+            seconds = self.seconds[name]
+            lines.append('  {:<32} {:>10} calls {:10.4f} s {:8.2f} us/call'.format(name, calls, seconds,
+                                                                                1e6 * seconds / calls))
+
+        lines.append('reporter trie depths: ' + ', '.join('{}: {}'.format(depth, count)
+                                                          for depth, count in sorted(self.trie_depths.items())))
+        return '\n'.join(lines)
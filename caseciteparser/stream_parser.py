@@ -0,0 +1,141 @@
+from bisect import bisect_left
+from itertools import islice
+
+from caseciteparser import constant_data
+from caseciteparser.cite_parser import (DATE_PAREN_MAX_LENGTH, classify_tokens, do_scan_for_reporter,
+                                        find_citation_anchors, finish_citation, iter_citation_data,
+                                        iter_with_antecedents)
+
+# Once this many tokens are behind the scan position, they are dropped from the buffer
+DROP_THRESHOLD = 4096
+
+# The minimum number of tokens read into the buffer at a time
+READ_SIZE = 1024
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+
+def parse_stream(source, chunk_size=DEFAULT_CHUNK_SIZE, budget=None, resolve_short_cites=False):
+    """ Parses a stream of text or word tokens for citations, yielding each citation as soon as it is complete.
+
+    Unlike parse_tokens, the full list of words is never held in memory: only a small window of tokens around the
+    current position of the citation state machine is buffered. The citations yielded are the same dicts that
+    parse_tokens would return for the whole stream, including 'start_index' and 'end_index', which are indices into the
+    whole stream of tokens rather than into the buffer.
+
+    :param source: Either a file-like object with a read() method returning str (read in chunks of chunk_size
+        characters and split on whitespace), or an iterable of word tokens.
+    :param chunk_size: The number of characters to read at a time if source is a file-like object.
+    :param budget: An optional budget.ParseBudget limiting the work done on the stream (see parse_tokens).
+    :param resolve_short_cites: Whether to link each short cite to its full cite (see parse_tokens). Only the
+        (volume, reporter) of each full cite is remembered, not the citations themselves.
+    :return: A generator of citation dicts, in the order parse_tokens would return them.
+    """
+    if hasattr(source, 'read'):
+        tokens = iter_tokens(source, chunk_size)
+    else:
+        tokens = iter(source)
+
+    window = StreamWindow(tokens)
+    citation_data_iter = iter_citation_data(window.words, window.anchors, budget=budget, window=window)
+    if resolve_short_cites:
+        citation_data_iter = iter_with_antecedents(citation_data_iter)
+    for citation_data in citation_data_iter:
+        # Translate the citation's indices while its words are still buffered
+        citation_data = finish_citation(window.words, citation_data)
+        citation_data['start_index'] += window.offset
+        citation_data['end_index'] += window.offset
+        yield citation_data
+
+
+class StreamWindow:
+    """ The buffered window of a stream of tokens that parse_stream runs the citation state machine over (see
+    cite_parser.iter_citation_data).
+
+    Attributes:
+        words: the buffered tokens.
+        offset: the index, in the whole stream, of words[0].
+        anchors: the stream indices of the citation anchors (see find_citation_anchors) among the buffered tokens.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.lookahead = get_lookahead()
+        self.words = []
+        self.offset = 0
+        self.anchors = []
+        self.exhausted = False
+
+    def advance(self, state):
+        """ Drops the tokens behind the state machine that it can't look at again, and reads enough of the stream for
+        its next step to see every token it could possibly look at. Returns the state, with its index into words
+        updated.
+        """
+        words = self.words
+        anchors = self.anchors
+
+        # Between citations, nothing before the word preceding the scan position can be looked at again
+        if state.next_fn is do_scan_for_reporter and state.next_index > DROP_THRESHOLD:
+            drop = state.next_index - 1
+            del words[:drop]
+            self.offset += drop
+            state = state._replace(next_index=state.next_index - drop)
+            del anchors[:bisect_left(anchors, self.offset)]
+
+        index = state.next_index
+        while True:
+            if state.next_fn is do_scan_for_reporter:
+                # The scan skips ahead to the next word that could start a citation, if there's one yet
+                anchor_pos = bisect_left(anchors, state.next_index + self.offset)
+                index = anchors[anchor_pos] - self.offset if anchor_pos < len(anchors) else len(words)
+            if self.exhausted or index + self.lookahead <= len(words):
+                return state
+            self.read(index + self.lookahead)
+
+    def read(self, needed):
+        """ Reads tokens until there are at least needed tokens in words, or the stream runs out. """
+        words = self.words
+        while not self.exhausted and len(words) < needed:
+            chunk = list(islice(self.tokens, max(needed - len(words), READ_SIZE)))
+            if chunk:
+                # Whether a token is an anchor depends on it and the token before it
+                first = max(len(words) - 1, 0)
+                words.extend(chunk)
+                self.anchors.extend(anchor + first + self.offset
+                                    for anchor in find_citation_anchors(classify_tokens(words[first:])))
+            else:
+                self.exhausted = True
+
+
+def get_lookahead():
+    """ Returns how many tokens past its index a citation state function can look at: a stringcite's volume, reporter,
+    and first page, or the words of a date parenthetical up to DATE_PAREN_MAX_LENGTH characters (each word adds at
+    least one character, for the space before it).
+    """
+    return max(constant_data.REPORTER_MAX_TOKENS + 2, DATE_PAREN_MAX_LENGTH + 1) + 1
+
+
+def iter_tokens(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yields the whitespace-delimited tokens of a text stream, reading chunk_size characters at a time. Tokens that
+    straddle two chunks are stitched back together, so the result is the same as stream.read().split().
+    """
+    carry = ''
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        text = carry + chunk
+        parts = text.split()
+
+        # If the chunk ends mid-word, hold the partial word back until we see the rest of it
+        if parts and not text[-1].isspace():
+            carry = parts.pop()
+        else:
+            carry = ''
+
+        yield from parts
+
+    if carry:
+        yield carry
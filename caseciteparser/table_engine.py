@@ -0,0 +1,278 @@
+from bisect import bisect_left
+
+from caseciteparser import constant_data
+from caseciteparser.cite_parser import (DATE_PAREN_MAX_LENGTH, ShortCiteResolver, cached_parenthetical_fsm,
+                                        classify_tokens, find_citation_anchors, find_date_parenthetical,
+                                        get_number_or_range_word_starts_with, word_is_number_followed_by_comma)
+from caseciteparser.citation import Citation
+
+# Integer states of the table engine, one per do_* function of the citation state machine in cite_parser.py
+SCAN_FOR_REPORTER = 0  # do_scan_for_reporter
+REPORTER_FOUND = 1  # do_reporter_found
+PARSE_SHORT_CITE_PINCITE = 2  # do_parse_short_cite_pincite
+PARSE_STRINGCITE_OR_PINCITE = 3  # do_parse_stringcite_or_pincite
+PARSE_STRINGCITE = 4  # do_parse_stringcite
+PARSE_DATE_PARENTHETICAL = 5  # do_parse_date_parenthetical
+
+
+def run_table_engine(words, emit, start_index=1, stop_index=None, token_classes=None, anchors=None, budget=None,
+                     attempts=None):
+    """ Runs the citation state machine of cite_parser.py as a single loop over integer states, keeping the citation
+    being parsed in local variables instead of allocating a CitationState and a dict along the way. It finds exactly
+    the citations iter_citation_data finds, in the same order.
+
+    For each citation found, emit is called with (start_index, end_index, volume, reporter, case_first_page, pincite,
+    stringcites, cite_type, paren_data), where case_first_page and pincite may be None, stringcites is a list of
+    (volume, reporter, case_first_page) tuples or None, and paren_data is the dict returned by cached_parenthetical_fsm
+    for a full cite (shared with other citations, so emit must not modify it) or None for a short cite.
+
+    Args:
+        words: the array of words to parse.
+        emit: the callable described above.
+        start_index: the index at which scanning starts (at least 1, since a citation starts with a volume).
+        stop_index: the words at and after this index are treated as if they didn't exist (defaults to len(words)).
+        token_classes: the result of classify_tokens(words), if already computed.
+        anchors: the result of find_citation_anchors for [start_index, stop_index), if already computed.
+        budget: an optional budget.ParseBudget; parsing stops once it runs out.
+        attempts: an optional list, to which the index of every anchor the scan tries to start a citation at is
+            appended.
+
+    Returns:
+        The index of the anchor of the first citation attempt that needed a word at or after stop_index (reading to
+        the end of a reporter or date parenthetical counts), or None if there was none. With more words, that attempt
+        and the ones after it could have turned out differently; the citations before it could not.
+    """
+    n = len(words) if stop_index is None else stop_index
+    if anchors is None:
+        if token_classes is None:
+            token_classes = classify_tokens(words)
+        anchors = find_citation_anchors(token_classes, start_index, n)
+
+    reporter_dict = constant_data.REPORTER_TOKEN_DISAMBIGUATION_DICT
+    num_anchors = len(anchors)
+    anchor_pos = 0
+
+    state = SCAN_FOR_REPORTER
+    index = start_index
+
+    # The citation being parsed
+    start = volume = reporter = case_first_page = pincite = stringcites = None
+
+    # The states (as index * 8 + state) known to end in failure, and those visited by the citation being parsed
+    failed_steps = set()
+    citation_steps = []
+
+    steps = 0
+    next_budget_check = budget.start() if budget is not None else None
+    cut_anchor = None
+
+    while index < n:
+        if steps == next_budget_check:
+            next_budget_check = budget.check(steps)
+            if next_budget_check is None:
+                return
+        steps += 1
+
+        if state == SCAN_FOR_REPORTER:
+            # Skip ahead to the next word that could start a citation
+            while anchor_pos < num_anchors and anchors[anchor_pos] < index:
+                anchor_pos += 1
+            if anchor_pos == num_anchors:
+                break
+            index = anchors[anchor_pos]
+            anchor_pos += 1
+            if attempts is not None:
+                attempts.append(index)
+
+            # Walk the reporter trie (see token_dict.find_token_string_at_index)
+            i = index
+            node = reporter_dict
+            reporter = None
+            while i < n:
+                child = node.get(words[i])
+                if child is None:
+                    break
+                node = child
+                i += 1
+                if '' in node:
+                    reporter = node['']
+                    end = i
+            if i == n and cut_anchor is None:
+                cut_anchor = index
+            if reporter is not None:
+                i = end
+
+            if reporter is not None and words[index - 1].isdigit():
+                start = index - 1
+                volume = words[start]
+                case_first_page = pincite = stringcites = None
+                citation_steps = []
+                state = REPORTER_FOUND
+                index = i
+            else:
+                index = i if reporter is not None else index + 1
+            continue
+
+        # A (state, index) pair already visited by a failed citation fails again (see cite_parser.iter_citation_data)
+        step = index * 8 + state
+        if step not in failed_steps:
+            citation_steps.append(step)
+            word = words[index]
+
+            if state == REPORTER_FOUND:
+                if word == "at":
+                    state = PARSE_SHORT_CITE_PINCITE
+                    index += 1
+                    continue
+                elif word.isdigit():
+                    case_first_page = word
+                    state = PARSE_DATE_PARENTHETICAL
+                    index += 1
+                    continue
+                elif word_is_number_followed_by_comma(word):
+                    case_first_page = get_number_or_range_word_starts_with(word)
+                    state = PARSE_STRINGCITE_OR_PINCITE
+                    index += 1
+                    continue
+
+            elif state == PARSE_SHORT_CITE_PINCITE:
+                pincite = get_number_or_range_word_starts_with(word)
+                if pincite is not None:
+                    emit(start, index, volume, reporter, None, pincite, None, 'short_cite', None)
+                    state = SCAN_FOR_REPORTER
+                    index += 1
+                    continue
+
+            elif state == PARSE_STRINGCITE_OR_PINCITE or state == PARSE_STRINGCITE:
+                if word.isdigit():
+                    # Is the next word the start of a reporter?
+                    i = index + 1
+                    node = reporter_dict
+                    stringcite_reporter = None
+                    while i < n:
+                        child = node.get(words[i])
+                        if child is None:
+                            break
+                        node = child
+                        i += 1
+                        if '' in node:
+                            stringcite_reporter = node['']
+                            end = i
+                    if i == n and cut_anchor is None:
+                        cut_anchor = start + 1
+                    if stringcite_reporter is not None:
+                        i = end
+
+                    if stringcite_reporter is not None and i < n:
+                        possible_first_page = words[i]
+                        if possible_first_page.isdigit():
+                            stringcite = (word, stringcite_reporter, possible_first_page)
+                            next_state = PARSE_DATE_PARENTHETICAL
+                        elif word_is_number_followed_by_comma(possible_first_page):
+                            stringcite = (word, stringcite_reporter, possible_first_page[0:len(possible_first_page)-1])
+                            next_state = PARSE_STRINGCITE
+                        else:
+                            next_state = None
+
+                        if next_state is not None:
+                            if stringcites is None:
+                                stringcites = []
+                            stringcites.append(stringcite)
+                            state = next_state
+                            index = i + 1
+                            continue
+
+                if state == PARSE_STRINGCITE_OR_PINCITE:
+                    pincite_if_valid = get_number_or_range_word_starts_with(word)
+                    if pincite_if_valid is not None:
+                        if word == pincite_if_valid:
+                            pincite = pincite_if_valid
+                            state = PARSE_DATE_PARENTHETICAL
+                            index += 1
+                            continue
+                        elif word == pincite_if_valid + ',':
+                            pincite = pincite_if_valid
+                            state = PARSE_STRINGCITE
+                            index += 1
+                            continue
+
+            else:  # PARSE_DATE_PARENTHETICAL
+                if len(word) == 0 or word[0] != '(':
+                    # Not a full cite after all, but nothing to back up for either
+                    state = SCAN_FOR_REPORTER
+                    index += 1
+                    continue
+
+                (end_index, paren_string) = find_date_parenthetical(words, index, n)
+                if paren_string is not None:
+                    emit(start, end_index, volume, reporter, case_first_page, pincite, stringcites, 'full_cite',
+                         cached_parenthetical_fsm(paren_string))
+                    state = SCAN_FOR_REPORTER
+                    index = end_index + 1
+                    continue
+                elif index + DATE_PAREN_MAX_LENGTH >= n and cut_anchor is None:
+                    cut_anchor = start + 1
+
+        # Failure: go back to scanning right after the first word of the reporter
+        failed_steps.update(citation_steps)
+        state = SCAN_FOR_REPORTER
+        index = start + 2
+        anchor_pos = bisect_left(anchors, index)
+
+    if state != SCAN_FOR_REPORTER and cut_anchor is None:
+        cut_anchor = start + 1
+    if budget is not None:
+        budget.steps = steps
+    return cut_anchor
+
+
+def make_citation_data(start_index, end_index, volume, reporter, case_first_page, pincite, stringcites, cite_type,
+                       paren_data):
+    """ An emit function for run_table_engine that returns the citation data iter_citation_data would have yielded. """
+    citation_data = {'reporter': reporter, 'volume': volume, 'start_index': start_index}
+
+    if case_first_page is not None:
+        citation_data['case_first_page'] = case_first_page
+    if pincite is not None:
+        citation_data['pincite'] = pincite
+    if stringcites is not None:
+        citation_data['stringcites'] = [{'volume': stringcite_volume, 'reporter': stringcite_reporter,
+                                         'case_first_page': stringcite_first_page}
+                                        for stringcite_volume, stringcite_reporter, stringcite_first_page
+                                        in stringcites]
+    if paren_data is not None:
+        citation_data.update(paren_data)
+
+    citation_data['end_index'] = end_index
+    citation_data['cite_type'] = cite_type
+    return citation_data
+
+
+def table_citation_fsm(words, as_objects=False, budget=None, resolve_short_cites=False):
+    """ Returns the same list as cite_parser.citation_fsm, computed by run_table_engine. """
+    cite_list = []
+    resolver = ShortCiteResolver() if resolve_short_cites else None
+
+    if as_objects:
+        def emit(start_index, end_index, volume, reporter, case_first_page, pincite, stringcites, cite_type,
+                 paren_data):
+            optional_data = dict(paren_data) if paren_data is not None else {}
+            optional_data['case_first_page'] = case_first_page
+            optional_data['pincite'] = pincite
+            optional_data['cite_type'] = cite_type
+            if resolver is not None:
+                optional_data['antecedent_index'] = resolver.resolve(
+                    len(cite_list), volume, reporter, cite_type,
+                    [(stringcite[0], stringcite[1]) for stringcite in stringcites or ()])
+            cite_list.append(Citation(words, volume, reporter, start_index, end_index, stringcites or (),
+                                      **optional_data))
+    else:
+        def emit(start_index, end_index, *args):
+            citation_data = make_citation_data(start_index, end_index, *args)
+            citation_data['cite_string'] = " ".join(words[start_index:end_index + 1])
+            if resolver is not None:
+                resolver.resolve_citation_data(len(cite_list), citation_data)
+            cite_list.append(citation_data)
+
+    run_table_engine(words, emit, budget=budget)
+    return cite_list
@@ -1,4 +1,11 @@
-def add_token_string_to_structure(structure, tokens, result_string):
+# Apostrophes that text uses interchangeably (e.g., "F. App'x" and 'F. App’x')
+APOSTROPHES = ("'", '’', '‘')
+
+# A token string with more optional spaces than this only gets its fully joined and fully split spacings as variants
+MAX_OPTIONAL_SPACES = 8
+
+
+def add_token_string_to_structure(structure, tokens, result_string, overwrite=True):
     ''' Adds a token string to the structure described for the create_reporter_string_disambiguation_dict
     function.
 
@@ -6,6 +13,7 @@ def add_token_string_to_structure(structure, tokens, result_string):
         structure: An object structured as described above for create_reporter_string_disambiguation_dict.
         tokens: A tokenized string (e.g., ['F.', '3d']).
         result_string: A proper reporter string (e.g., 'F.3d').
+        overwrite: Whether to replace the result string if the token string is already in the structure.
 
     Returns:
         Nothing. It makes the addition to 'structure' in place.
@@ -18,13 +26,106 @@ def add_token_string_to_structure(structure, tokens, result_string):
             structure_ptr[token] = {}
         structure_ptr = structure_ptr[token]
 
-    structure_ptr[''] = result_string
+    if overwrite or '' not in structure_ptr:
+        structure_ptr[''] = result_string
+
+
+def add_token_string_variants_to_structure(structure, string, result_string):
+    ''' Adds every variant of a string (see get_token_string_variants) to the structure, without replacing the result
+    of any token string already there. A variant can still extend a string that was added exactly (e.g., 'F. 4th' runs
+    past 'F.' followed by a page number, '4'), which is why find_token_string_at_index falls back to the longest token
+    string it walked past.
+    '''
+    for tokens in get_token_string_variants(string):
+        add_token_string_to_structure(structure, tokens, result_string, overwrite=False)
+
+
+def get_token_string_variants(string):
+    ''' Returns the tokenizations of the ways a string is commonly written differently in text, so that looking them up
+    takes the same single dict probe per word as looking up the string itself:
+        - with either a straight or a curly apostrophe (e.g., "F. App'x" and 'F. App’x');
+        - with any of the spaces after a period dropped or added (e.g., 'F. Supp. 2d', 'F.Supp.2d', and 'F. Supp.2d';
+          'N.E.2d' and 'N. E. 2d'); and
+        - with a comma after the last word (e.g., 'U.S.,' as in '343 U.S., at 585').
+
+    Args:
+        string: A string (e.g., 'F. Supp. 2d').
+
+    Returns:
+        A list of token lists, starting with string.split().
+    '''
+    spellings = [string]
+    if any(apostrophe in string for apostrophe in APOSTROPHES):
+        for apostrophe in APOSTROPHES[:2]:
+            spelling = string
+            for other in APOSTROPHES:
+                spelling = spelling.replace(other, apostrophe)
+            if spelling not in spellings:
+                spellings.append(spelling)
+
+    variants = []
+    for spelling in spellings:
+        for tokens in get_spacing_variants(spelling):
+            if tokens not in variants:
+                variants.append(tokens)
+                if not tokens[-1].endswith(','):
+                    variants.append(tokens[:-1] + [tokens[-1] + ','])
+
+    return variants
+
+
+def get_spacing_variants(string):
+    ''' Returns the tokenizations of a string with every combination of spaces after its periods (other than a final
+    period) dropped or added, starting with string.split(). Spaces that don't follow a period are always kept.
+    '''
+    # Split the string into pieces ending at each period or space, noting which can be joined to the next piece
+    pieces = []  # (piece, whether a space may be dropped or added after it)
+    for token in string.split():
+        start = 0
+        for i, char in enumerate(token):
+            if char == '.' and i + 1 < len(token):
+                pieces.append((token[start:i + 1], False))
+                start = i + 1
+        pieces.append((token[start:], token.endswith('.')))
+    pieces[-1] = (pieces[-1][0], None)
+
+    # The breaks of the string as written: True after a token, False inside one
+    original_breaks = []
+    for token in string.split():
+        original_breaks.extend([False] * (token.count('.') - token.endswith('.')) + [True])
+    original_breaks.pop()
+
+    optional = [i for i, (piece, may_change) in enumerate(pieces[:-1]) if may_change or not original_breaks[i]]
+    if len(optional) > MAX_OPTIONAL_SPACES:
+        choices = [[False] * len(optional), [True] * len(optional)]
+    else:
+        choices = [[bool(bits >> j & 1) for j in range(len(optional))] for bits in range(1 << len(optional))]
+
+    variants = [string.split()]
+    for choice in choices:
+        breaks = list(original_breaks)
+        for i, has_space in zip(optional, choice):
+            breaks[i] = has_space
+        tokens = [pieces[0][0]]
+        for (piece, _), has_space in zip(pieces[1:], breaks):
+            if has_space:
+                tokens.append(piece)
+            else:
+                tokens[-1] += piece
+        if tokens not in variants:
+            variants.append(tokens)
+
+    return variants
 
 
 def find_token_string_at_index(structure, words, start_index):
     i = start_index
     dict_ptr = structure
 
+    # The longest token string seen so far, which is what we recognized if the walk goes on past it and then breaks
+    end_index = start_index + 1
+    result_string = None
+
     while i < len(words):
         current_word = words[i]
 
@@ -32,11 +133,48 @@ def find_token_string_at_index(structure, words, start_index):
         if current_word in dict_ptr:
             dict_ptr = dict_ptr[current_word]
             i = i + 1
+
+            # If there's a '' entry here, it means that we just saw a recognized reporter
+            if '' in dict_ptr:
+                end_index = i
+                result_string = dict_ptr['']
         else:  # We ran into a word we didn't recognize
             break
 
-    # If there's a '' entry where we broke, it means that we just saw a recognized reporter. If not, return None.
-    result_string = dict_ptr.get('', None)
-    end_index = i if (result_string is not None) else start_index + 1
-
     return end_index, result_string
+
+
+def get_match_depth(structure, words, start_index):
+    """ Returns how many words find_token_string_at_index(structure, words, start_index) walks past before it stops,
+    whether or not it recognizes a token string, and including any words past the longest one it falls back to.
+    """
+    i = start_index
+    dict_ptr = structure
+
+    while i < len(words) and words[i] in dict_ptr:
+        dict_ptr = dict_ptr[words[i]]
+        i = i + 1
+
+    return i - start_index
+
+
+def get_max_depth(structure):
+    """ Returns the number of tokens in the longest token string stored in the structure (i.e., the most words that
+    find_token_string_at_index can walk past before it stops).
+    """
+    child_depths = [get_max_depth(child) for token, child in structure.items() if token != '']
+    return 1 + max(child_depths) if child_depths else 0
+
+
+def contains_digit_token_before(structure, next_tokens):
+    """ Returns True if any token string stored in the structure has a token made up only of digits followed by one of
+    next_tokens (e.g., 'La.App. 1 F.' for next_tokens containing 'F.').
+    """
+    for token, child in structure.items():
+        if token == '':
+            continue
+        if token.isdigit() and any(next_token != '' and next_token in next_tokens for next_token in child):
+            return True
+        if contains_digit_token_before(child, next_tokens):
+            return True
+    return False
@@ -1,13 +1,814 @@
 from pprint import pprint
+import asyncio
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+import random
+import tarfile
+import tempfile
+import zipfile
 import caseciteparser
 import case_xml_io
 
+# Fragments of citations (and near misses) that random test documents are assembled from
+CITATION_FRAGMENTS = ("Charlesworth v. Mack, 727 F. Supp. 1407, 1412 (D. Mass. 1990). Mydlach v. DaimlerChrysler "
+                      "Corp., 226 Ill. 2d 307, 311, 875 N.E.2d 1047 (2007). Youngstown, 343 U.S. at 585. 23 F.3d 1261, "
+                      "1264 (7th Cir. 1994) (and cases cited therein) 12 F.3d 4, 5 F.3d 6, 7 (x y z La.App. 1 Cir. 3 "
+                      "La.App. 2 Cir. 5 ( ) (Jan. 5, 2001) 1234-56). at the court held that").split()
+
 
 def test(do_interactive_mode):
+    do_automated_tests()
+
     if do_interactive_mode:
         do_interactive_tests()
 
 
+def do_automated_tests():
+    print("~~~~~AUTOMATED TESTS~~~~~")
+
+    do_engine_differential_test()
+    do_empty_parenthetical_test()
+    do_budget_test()
+    do_stats_test()
+    do_case_text_test()
+    do_archive_test()
+    do_table_artifact_test()
+    do_cache_test()
+    do_corpus_test()
+    do_corpus_cache_test()
+    do_stream_test()
+    do_incremental_test()
+    do_server_test()
+    do_citation_index_test()
+    do_short_cite_test()
+    do_parenthetical_cache_test()
+    do_tolerant_matching_test()
+    do_span_test()
+    do_columnar_test()
+    do_counts_test()
+    do_parse_many_test()
+    do_parallel_test()
+
+
+def make_random_documents(num_documents, max_length, seed=0):
+    rng = random.Random(seed)
+    return [[rng.choice(CITATION_FRAGMENTS) for _ in range(rng.randint(0, max_length))]
+            for _ in range(num_documents)]
+
+
+def do_engine_differential_test():
+    # The table engine and the citation state machine must agree on every document, in both output formats
+    for words in make_random_documents(3000, 200):
+        expected = caseciteparser.parse_tokens(words)
+        assert caseciteparser.parse_tokens(words, engine='table') == expected, words
+        assert [citation.to_dict() for citation in caseciteparser.parse_tokens(words, True, 'table')] == expected, words
+
+    # A Citation keeps only its own words, not the document's, and isn't hashable (it compares by value)
+    words = list(CITATION_FRAGMENTS)
+    citation = caseciteparser.parse_tokens(words, as_objects=True)[0]
+    words[citation.start_index] = 'changed'
+    assert citation.cite_string == caseciteparser.parse_tokens(CITATION_FRAGMENTS)[0]['cite_string']
+    assert type(citation).__hash__ is None
+    print("Engine differential test passed.")
+
+
+def do_empty_parenthetical_test():
+    # An empty date parenthetical ends a full cite that just has no date, in every engine
+    from caseciteparser.cite_parser import parenthetical_fsm
+    for paren_string in ('', '  '):
+        assert parenthetical_fsm(paren_string) == {'date_paren_string': ''}
+    for text, end_index in (('1 U.S. 1 ()', 3), ('1 U.S. 1 ( )', 4), ('See 1 U.S. 1, 3 ().', 5)):
+        expected = caseciteparser.parse_string(text)
+        assert len(expected) == 1 and expected[0]['end_index'] == end_index, text
+        assert expected[0]['date_paren_string'] == '' and 'year' not in expected[0], text
+        assert caseciteparser.parse_string(text, engine='table') == expected, text
+        assert list(caseciteparser.parse_stream(text.split())) == expected, text
+    print("Empty parenthetical test passed.")
+
+
+def do_budget_test():
+    # A stringcite chain that never gets a date parenthetical fails at every cite, but still parses in linear time
+    chain = " ".join("{} F.3d {},".format(i + 1, i + 2) for i in range(2000)).split() + ["and"]
+    for engine in ('fsm', 'table'):
+        budget = caseciteparser.ParseBudget(max_steps=2 * len(chain))
+        assert caseciteparser.parse_tokens(chain, engine=engine, budget=budget) == [] and not budget.exhausted
+    assert list(caseciteparser.parse_stream(chain)) == []
+
+    # Running out of budget returns the citations found so far
+    words = list(CITATION_FRAGMENTS) * 20
+    expected = caseciteparser.parse_tokens(words)
+    for engine in ('fsm', 'table'):
+        budget = caseciteparser.ParseBudget(max_steps=100)
+        partial = caseciteparser.parse_tokens(words, engine=engine, budget=budget)
+        assert budget.exhausted and budget.steps == 100 and 0 < len(partial) < len(expected), engine
+        assert partial == expected[:len(partial)], engine
+    print("Budget test passed.")
+
+
+def do_stats_test():
+    # Collecting stats must not change the results, and must count what the state machine does on a known document
+    text = ("See Charlesworth v. Mack, 727 F. Supp. 1407, 1412 (D. Mass. 1990); 727 F. Supp. at 1410; 12 F.3d 4 and 5 "
+            "U.S. at x.")
+    stats = caseciteparser.CitationStats()
+    assert caseciteparser.parse_string(text, stats=stats) == caseciteparser.parse_string(text)
+    # Anchors: both 'F.', 'F.3d' and 'U.S.', all preceded by volumes. '12 F.3d 4' has no date parenthetical, which
+    # skips past it; '5 U.S. at x.' has no pincite, which sends the scan back to just after '5 U.S.'
+    assert (stats.documents, stats.tokens, stats.anchors, stats.citations) == (1, 25, 4, 2)
+    assert stats.calls == {'do_scan_for_reporter': 4, 'do_reporter_found': 4, 'do_parse_date_parenthetical': 2,
+                           'do_parse_short_cite_pincite': 2, 'do_parse_stringcite_or_pincite': 1}
+    assert (stats.backtracks, stats.rescanned_tokens) == (1, 2)
+    assert stats.trie_depths == {1: 2, 2: 2} and set(stats.seconds) == set(stats.calls)
+
+    # A near miss that is already known to fail is counted as one call, and stats add up across documents
+    # (each cite of a stringcite chain with no date parenthetical fails, and the next one reaches the same steps)
+    chain = " ".join("{} F.3d {},".format(i + 1, i + 2) for i in range(5)).split() + ["and"]
+    words = list(CITATION_FRAGMENTS) * 20
+    total = caseciteparser.CitationStats()
+    for document in (chain, words, text.split()):
+        document_stats = caseciteparser.CitationStats()
+        assert caseciteparser.parse_tokens(document, stats=document_stats) == caseciteparser.parse_tokens(document)
+        if document is chain:
+            assert document_stats.calls['do_fail_known_step'] == 3 and document_stats.backtracks == 5
+        total.merge(document_stats)
+    assert total.documents == 3 and total.citations == len(caseciteparser.parse_tokens(words)) + 2
+    assert total.calls['do_fail_known_step'] == 3
+    print("Stats test passed.")
+
+
+def do_case_text_test():
+    # The streaming extractor must produce exactly the text of the PyQuery DOM path
+    case_xml = ('<?xml version="1.0" encoding="UTF-8"?>\n<mets xmlns="http://www.loc.gov/METS/" xmlns:casebody="'
+                'http://nrs.harvard.edu/urn-3:HLS.Libr.US_Case_Law.Schema.Case_Body:v1"><casebody:casebody>'
+                '<casebody:p>See Youngstown, 343 U.S. at 585, and 727 F. Supp. 1407, 1412 (D. Ma\xadss.\n1990).'
+                '</casebody:p>'
+                '<casebody:p>Held <casebody:em>in\tpart</casebody:em> that</casebody:p>'
+                '<casebody:footnote label="1"><casebody:p>1 Cf. 12 F.3d 4 (7th Cir. 1994).</casebody:p>'
+                '<casebody:p>1 label kept here</casebody:p></casebody:footnote>'
+                '</casebody:casebody></mets>\n')
+    with tempfile.TemporaryDirectory() as xml_dir:
+        path = os.path.join(xml_dir, "case.xml")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(case_xml)
+        expected = case_xml_io.get_case_text(case_xml_io.parse_file(path))
+        assert case_xml_io.get_case_text(path) == expected
+        assert list(case_xml_io.iter_case_tokens(path)) == expected.split()
+        assert list(case_xml_io.parse_case_stream(path)) == caseciteparser.parse_string(expected)
+
+        # ... and read straight out of archives
+        with zipfile.ZipFile(os.path.join(xml_dir, "cases.zip"), 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.write(path, "case.xml")
+        with tarfile.open(os.path.join(xml_dir, "cases.tar.xz"), 'w:xz') as archive:
+            archive.add(path, "case.xml")
+        for archive_name in ("cases.zip", "cases.tar.xz"):
+            assert list(case_xml_io.iter_archive_cases(os.path.join(xml_dir, archive_name))) == [("case.xml", expected)]
+
+    # Paragraphs with no child elements skip extract_text, but must come out the same
+    from lxml import etree
+    from pyquery.text import extract_text
+    for text in (None, '', 'plain text', ' padded\t', 'two  spaces', 'tab\there', 'line\r\nbreaks', 'zero\u200bwidth',
+                 'no\xa0break', '\u2003em space\u2003', '  \n '):
+        paragraph = etree.Element('p')
+        paragraph.text = text
+        assert case_xml_io.get_plain_paragraph_text(text) == extract_text(paragraph), repr(text)
+    print("Case text test passed.")
+
+
+def do_archive_test():
+    # Every archive format must give the text of each case, and parse_archive must parse it (and report bad cases) in
+    # the workers
+    documents = [' '.join(words) for words in make_random_documents(6, 300, seed=5)]
+    case_xmls = {"case{}.xml".format(i): make_case_xml([document, 'See 343 U.S. at 585.'])
+                 for i, document in enumerate(documents)}
+    json_cases = [{'id': 1, 'casebody': {'status': 'ok', 'data': {'head_matter': 'Smith v. Jones, 12 F.3d 4 (1994)',
+                                                                  'opinions': [{'text': documents[0]},
+                                                                               {'text': 'So ord\xadered.'}]}}},
+                  {'id': 2, 'casebody': {'status': 'ok', 'data': case_xmls["case1.xml"]}},
+                  {'id': 3, 'casebody': {'status': 'ok', 'data': {'head_matter': None, 'opinions': []}}}]
+    expected_json = {'1': 'Smith v. Jones, 12 F.3d 4 (1994)\n\n' + documents[0] + '\n\nSo ordered.', '3': ''}
+
+    with tempfile.TemporaryDirectory() as archive_dir:
+        xml_dir = os.path.join(archive_dir, "xml")
+        os.mkdir(xml_dir)
+        expected_xml = {}
+        for name, case_xml in case_xmls.items():
+            with open(os.path.join(xml_dir, name), 'w', encoding='utf-8') as f:
+                f.write(case_xml)
+            expected_xml[name] = case_xml_io.get_case_text(os.path.join(xml_dir, name))
+        expected_json['2'] = expected_xml["case1.xml"]
+
+        with zipfile.ZipFile(os.path.join(archive_dir, "cases.zip"), 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, case_xml in case_xmls.items():
+                archive.writestr(name, case_xml)
+        with tarfile.open(os.path.join(archive_dir, "cases.tar.gz"), 'w:gz') as archive:
+            for name in case_xmls:
+                archive.add(os.path.join(xml_dir, name), name)
+        lines = b''.join(json.dumps(case).encode('utf-8') + b'\n\n' for case in json_cases)
+        for extension, opener in (('', open), ('.gz', gzip.open), ('.bz2', bz2.open), ('.xz', lzma.open)):
+            with opener(os.path.join(archive_dir, "cases.jsonl" + extension), 'wb') as f:
+                f.write(lines)
+
+        for archive_name, expected in (("cases.zip", expected_xml), ("cases.tar.gz", expected_xml),
+                                       ("cases.jsonl", expected_json), ("cases.jsonl.gz", expected_json),
+                                       ("cases.jsonl.bz2", expected_json), ("cases.jsonl.xz", expected_json)):
+            path = os.path.join(archive_dir, archive_name)
+            assert dict(case_xml_io.iter_archive_cases(path)) == expected, archive_name
+            expected_citations = {name: caseciteparser.parse_string(text) for name, text in expected.items()}
+            for workers in (1, 2):
+                assert dict(case_xml_io.parse_archive(path, workers=workers)) == expected_citations, archive_name
+
+        # A case that can't be read is reported without stopping the run
+        with zipfile.ZipFile(os.path.join(archive_dir, "cases.zip"), 'a') as archive:
+            archive.writestr("broken.xml", "<casebody:p>not XML")
+        with open(os.path.join(archive_dir, "cases.jsonl"), 'ab') as f:
+            f.write(json.dumps({'id': 4, 'casebody': {'status': 'error'}}).encode('utf-8') + b'\n')
+        for archive_name, bad_name, expected in (("cases.zip", "broken.xml", expected_xml),
+                                                 ("cases.jsonl", '4', expected_json)):
+            errors = []
+            results = dict(case_xml_io.parse_archive(os.path.join(archive_dir, archive_name), workers=2,
+                                                     on_error=lambda name, error: errors.append(name)))
+            assert errors == [bad_name] and results.pop(bad_name) is None, archive_name
+            assert set(results) == set(expected), archive_name
+
+        try:
+            case_xml_io.iter_archive_cases(os.path.join(archive_dir, "cases.rar"))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Unknown archive format accepted")
+    print("Archive test passed.")
+
+
+def do_table_artifact_test():
+    # The pickled tables must be rebuilt whenever anything they are built from changes
+    from caseciteparser import cite_parser, constant_data
+    original_tables = {name: getattr(constant_data, name) for name in constant_data.TABLE_NAMES + ('TABLE_KEY',)}
+    original_env = os.environ.get('CASECITEPARSER_CACHE_DIR')
+    original_get_version = constant_data.get_reporters_db_version
+    original_format_version = constant_data.TABLE_FORMAT_VERSION
+    original_months = constant_data.MONTH_ABBREVIATIONS
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ['CASECITEPARSER_CACHE_DIR'] = cache_dir
+        try:
+            keys = [constant_data.load_tables()['TABLE_KEY']]
+            assert os.listdir(cache_dir) == [os.path.basename(constant_data.get_table_artifact_path())]
+
+            # An artifact with the wrong key at the expected path (e.g., a hash collision) isn't trusted
+            with open(constant_data.get_table_artifact_path(), 'wb') as f:
+                f.write(b'not a pickle')
+            assert constant_data.load_tables()['TABLE_KEY'] == keys[0]
+
+            def bump_format_version():
+                constant_data.TABLE_FORMAT_VERSION += 1
+
+            def upgrade_reporters_db():
+                constant_data.get_reporters_db_version = lambda: 'upgraded'
+
+            def add_month():
+                constant_data.MONTH_ABBREVIATIONS = constant_data.MONTH_ABBREVIATIONS + ['Smarch']
+
+            # Cached date parentheticals were parsed with the old tables, so they must not outlive them
+            assert 'month' not in cite_parser.cached_parenthetical_fsm('Smarch 5, 1990')
+            for change in (bump_format_version, upgrade_reporters_db, add_month):
+                change()
+                tables = constant_data.load_tables()
+                assert tables['TABLE_KEY'] not in keys, change
+                keys.append(tables['TABLE_KEY'])
+                assert len(os.listdir(cache_dir)) == len(keys), change
+            assert constant_data.find_month_at_index(['Smarch'], 0) == (1, 'Smarch')
+            assert cite_parser.cached_parenthetical_fsm('Smarch 5, 1990')['month'] == 'Smarch'
+        finally:
+            constant_data.TABLE_FORMAT_VERSION = original_format_version
+            constant_data.get_reporters_db_version = original_get_version
+            constant_data.MONTH_ABBREVIATIONS = original_months
+            if original_env is None:
+                del os.environ['CASECITEPARSER_CACHE_DIR']
+            else:
+                os.environ['CASECITEPARSER_CACHE_DIR'] = original_env
+            constant_data.set_tables(original_tables)
+    assert constant_data.get_table_key() == original_tables['TABLE_KEY']
+    assert constant_data.find_month_at_index(['Smarch'], 0) == (1, None)
+    assert 'month' not in cite_parser.cached_parenthetical_fsm('Smarch 5, 1990')
+    print("Table artifact test passed.")
+
+
+def do_cache_test():
+    documents = make_random_documents(50, 200, seed=1)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = caseciteparser.ParseCache(cache_dir, max_memory_entries=10)
+        for words in documents + documents:
+            expected = caseciteparser.parse_tokens(words)
+            assert cache.parse_tokens(words) == expected
+            assert [citation.to_dict() for citation in cache.parse_tokens(words, as_objects=True)] == expected
+        assert cache.info() == (100, 50, 50, 10), cache.info()
+
+        # A second cache (e.g., in the next run) finds the results on disk
+        cache = caseciteparser.ParseCache(cache_dir)
+        for words in documents:
+            cache.parse_tokens(words)[:0] = [{}]  # Callers get their own copy to modify
+            assert cache.parse_tokens(words) == caseciteparser.parse_tokens(words)
+        assert cache.info() == (50, 50, 0, 50), cache.info()
+
+        # A damaged file on disk is a miss, and is overwritten with the result parsed again
+        words = documents[0]
+        path = cache._get_path(cache.get_key(words))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('[{"volume"')
+        for expected_info in ((0, 0, 1, 1), (0, 1, 0, 1)):
+            cache = caseciteparser.ParseCache(cache_dir)
+            assert cache.parse_tokens(words) == caseciteparser.parse_tokens(words)
+            assert cache.info() == expected_info, cache.info()
+
+        # Results parsed with other tables aren't found, even by a cache made before the tables changed
+        from caseciteparser import constant_data
+        original_tables = {name: getattr(constant_data, name) for name in constant_data.TABLE_NAMES + ('TABLE_KEY',)}
+        constant_data.set_tables(dict(original_tables, TABLE_KEY='other'))
+        try:
+            assert cache.parse_tokens(words) == caseciteparser.parse_tokens(words)
+            assert cache.info() == (0, 1, 1, 2), cache.info()
+        finally:
+            constant_data.set_tables(original_tables)
+        assert cache.parse_tokens(words) == caseciteparser.parse_tokens(words)
+        assert cache.info() == (1, 1, 1, 2), cache.info()
+    print("Cache test passed.")
+
+
+def make_case_xml(paragraphs):
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<mets xmlns="http://www.loc.gov/METS/" xmlns:casebody="'
+            'http://nrs.harvard.edu/urn-3:HLS.Libr.US_Case_Law.Schema.Case_Body:v1"><casebody:casebody>' +
+            ''.join('<casebody:p>{}</casebody:p>'.format(paragraph) for paragraph in paragraphs) +
+            '</casebody:casebody></mets>\n')
+
+
+def do_corpus_test():
+    # parse_corpus must keep at most max_pending files in flight, and report failures without stopping
+    with tempfile.TemporaryDirectory() as xml_dir:
+        paths = []
+        for i, words in enumerate(make_random_documents(8, 200, seed=3)):
+            paths.append(os.path.join(xml_dir, "case{}.xml".format(i)))
+            with open(paths[-1], 'w', encoding='utf-8') as f:
+                f.write(make_case_xml([' '.join(words)]))
+        bad_path = os.path.join(xml_dir, "missing.xml")
+        paths.insert(3, bad_path)
+
+        consumed = []
+
+        def iter_paths():
+            for path in paths:
+                consumed.append(path)
+                yield path
+
+        errors = []
+        results = {}
+        for path, citations in case_xml_io.parse_corpus(iter_paths(), workers=2, max_pending=3,
+                                                        on_error=lambda path, error: errors.append(path)):
+            assert len(consumed) - len(results) <= 3
+            results[path] = citations
+        assert set(results) == set(paths)
+        assert errors == [bad_path] and results[bad_path] is None
+        for path in paths:
+            if path != bad_path:
+                assert results[path] == caseciteparser.parse_tokens(list(case_xml_io.iter_case_tokens(path))), path
+
+    # A worker that dies takes the items in flight with it, but the rest of the run goes on with a new pool
+    errors = []
+    results = dict(case_xml_io._run_corpus(_exit_on_item, range(12), 2, 2, lambda item, error: errors.append(item),
+                                           {'crash_on': 5}))
+    assert set(results) == set(range(12))
+    assert 5 in errors and results[5] is None
+    assert all(results[item] == item * 2 for item in range(12) if item not in errors)
+    assert len(errors) <= 2
+    print("Corpus test passed.")
+
+
+def _exit_on_item(item, parse_kwargs):
+    if item == parse_kwargs['crash_on']:
+        os._exit(1)
+    return item * 2
+
+
+def do_corpus_cache_test():
+    # parse_corpus with a cache must pass the options the cache supports through, and refuse the others up front
+    with tempfile.TemporaryDirectory() as xml_dir:
+        paths = []
+        for i, words in enumerate(make_random_documents(6, 300, seed=7)):
+            paths.append(os.path.join(xml_dir, "case{}.xml".format(i)))
+            with open(paths[-1], 'w', encoding='utf-8') as f:
+                f.write(make_case_xml([' '.join(words), 'Youngstown, 343 U.S. 579 (1952), and 343 U.S. at 585.']))
+        expected = {path: caseciteparser.parse_tokens(list(case_xml_io.iter_case_tokens(path)),
+                                                      resolve_short_cites=True) for path in paths}
+
+        cache_dir = os.path.join(xml_dir, "cache")
+        for workers in (1, 2, 1):
+            results = dict(case_xml_io.parse_corpus(paths, workers=workers, cache_dir=cache_dir, engine='table',
+                                                    resolve_short_cites=True))
+            assert results == expected, workers
+        assert any('antecedent_index' in citation for citations in expected.values() for citation in citations)
+
+        for kwargs in ({'budget': caseciteparser.ParseBudget(max_steps=10)}, {'stats': caseciteparser.CitationStats()}):
+            for parse in (lambda: case_xml_io.parse_corpus(paths, cache_dir=cache_dir, **kwargs),
+                          lambda: case_xml_io.parse_archive(paths[0], cache_dir=cache_dir, **kwargs)):
+                try:
+                    parse()
+                except ValueError:
+                    pass
+                else:
+                    raise AssertionError(kwargs)
+    print("Corpus cache test passed.")
+
+
+def do_stream_test():
+    # Reading text in small chunks must give what parse_string gives for the whole text, even with tokens split across
+    # chunks and documents long enough for the buffer to drop tokens
+    from caseciteparser.stream_parser import DROP_THRESHOLD
+    rng = random.Random(9)
+    separators = (' ', '  ', '\n', '\t ', '\n\n')
+    documents = make_random_documents(20, 300, seed=9) + [list(CITATION_FRAGMENTS) * (3 * DROP_THRESHOLD //
+                                                                                      len(CITATION_FRAGMENTS))]
+    for words in documents:
+        text = ''.join(rng.choice(separators) + word for word in words) + rng.choice(('', ' '))
+        expected = caseciteparser.parse_string(text)
+        for chunk_size in (1, 5, 64, 4096):
+            assert list(caseciteparser.parse_stream(io.StringIO(text), chunk_size=chunk_size)) == expected, chunk_size
+    assert len(documents[-1]) > 2 * DROP_THRESHOLD and expected[-1]['end_index'] > 2 * DROP_THRESHOLD
+
+    # The stream runs the same state machine loop as parse_tokens, so a budget stops both at the same citation
+    words = documents[-1]
+    for max_steps in (1, 100, 4000):
+        budget = caseciteparser.ParseBudget(max_steps=max_steps)
+        expected = caseciteparser.parse_tokens(words, budget=budget)
+        expected_steps = budget.steps
+        assert list(caseciteparser.parse_stream(words, budget=budget)) == expected, max_steps
+        assert budget.steps == expected_steps and budget.exhausted, max_steps
+    print("Stream test passed.")
+
+
+def do_incremental_test():
+    # After any sequence of edits, reparse_tokens must give what a full parse of the edited words gives
+    rng = random.Random(2)
+    for words in make_random_documents(300, 300, seed=2):
+        citations = caseciteparser.parse_tokens(words)
+        for _ in range(5):
+            edit_start = rng.randint(0, len(words))
+            edit_end = rng.randint(edit_start, min(len(words), edit_start + rng.choice((0, 1, 3, 20))))
+            new_tokens = [rng.choice(CITATION_FRAGMENTS) for _ in range(rng.choice((0, 1, 2, 5, 30)))]
+            words, citations = caseciteparser.reparse_tokens(words, citations, edit_start, edit_end, new_tokens)
+            assert citations == caseciteparser.parse_tokens(words), (words, edit_start, edit_end, new_tokens)
+
+    # Short cites linked to their full cites keep the right antecedent as citations come and go before them
+    full_cites = ['Charlesworth v. Mack, 727 F. Supp. 1407 (D. Mass. 1990).', 'See 23 F.3d 1261 (7th Cir. 1994).',
+                  '12 F.3d 4, 5 F.3d 6 (1990).']
+    short_cites = ['727 F. Supp. at 1410.', '23 F.3d at 1264.', '5 F.3d at 7.', 'the court held that']
+    for _ in range(300):
+        words = ' '.join(rng.choice(full_cites + short_cites) for _ in range(rng.randint(0, 20))).split()
+        citations = caseciteparser.parse_tokens(words, resolve_short_cites=True)
+        for _ in range(5):
+            edit_start = rng.randint(0, len(words))
+            edit_end = rng.randint(edit_start, min(len(words), edit_start + rng.choice((0, 1, 4, 20))))
+            new_tokens = ' '.join(rng.choice(full_cites + short_cites) for _ in range(rng.randint(0, 3))).split()
+            old_citations = citations
+            old_copies = [dict(citation) for citation in citations]
+            words, citations = caseciteparser.reparse_tokens(words, citations, edit_start, edit_end, new_tokens,
+                                                             resolve_short_cites=True)
+            assert citations == caseciteparser.parse_tokens(words, resolve_short_cites=True), words
+            assert old_citations == old_copies
+    print("Incremental test passed.")
+
+
+def do_server_test():
+    # The parse service must give what parse_string gives, and reject malformed requests
+    from caseciteparser.server import ParseServer
+
+    async def request(socket_path, method, path, body=b''):
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        writer.write('{} {} HTTP/1.1\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(
+            method, path, len(body)).encode('latin-1') + body)
+        response = await reader.read()
+        writer.close()
+        head, _, body = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(body)
+
+    async def run(socket_path, texts):
+        server = ParseServer(workers=1, max_queue=len(texts))
+        await server.start(unix_socket=socket_path)
+        try:
+            status, response = await request(socket_path, 'POST', '/parse', json.dumps({'texts': texts}).encode())
+            assert status == 200 and response['results'] == [caseciteparser.parse_string(text) for text in texts]
+            responses = await asyncio.gather(*[request(socket_path, 'POST', '/parse',
+                                                       json.dumps({'text': text, 'engine': 'table'}).encode())
+                                               for text in texts])
+            assert [response for status, response in responses] == \
+                [{'citations': caseciteparser.parse_string(text)} for text in texts]
+            # More texts than the queue holds could never be accepted; a full queue only turns requests away for now
+            status, _ = await request(socket_path, 'POST', '/parse', json.dumps({'texts': texts + texts[:1]}).encode())
+            assert status == 413
+            first = asyncio.ensure_future(server.parse(texts))
+            await asyncio.sleep(0)  # Let it fill the queue before the batcher gets to run
+            status, _, headers = await server._respond('POST', '/parse', json.dumps({'text': texts[0]}).encode())
+            assert status == 503 and ('Retry-After', '1') in headers
+            assert await first == [caseciteparser.parse_string(text) for text in texts]
+            assert (await request(socket_path, 'GET', '/health'))[1]['rejected'] == 2
+            assert (await request(socket_path, 'POST', '/parse', b'{"txt": ""}'))[0] == 400
+            assert (await request(socket_path, 'GET', '/parse'))[0] == 405
+            assert (await request(socket_path, 'GET', '/nowhere'))[0] == 404
+
+            # A worker that dies fails the requests waiting on it with 500, rather than leaving them hanging
+            for process in list(server._executor._processes.values()):
+                process.kill()
+            status, response = await request(socket_path, 'POST', '/parse', json.dumps({'texts': texts[:3]}).encode())
+            assert status == 500 and 'BrokenProcessPool' in response['error'], response
+            assert (await request(socket_path, 'GET', '/health'))[1]['failed'] == 1
+        finally:
+            await server.close()
+        assert not server._batch_tasks and server._batcher.done()
+
+    texts = [' '.join(words) for words in make_random_documents(50, 300, seed=3)]
+    try:
+        ParseServer(max_queue=0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("An unbounded queue was accepted")
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run(os.path.join(directory, 'parse.sock'), texts))
+    print("Server test passed.")
+
+
+def do_citation_index_test():
+    # Spilling runs and merging partial indexes must give the same index as building it in one go
+    from caseciteparser.citation_index import (Posting, build_citation_index, iter_citation_keys, merge_indexes,
+                                               split_key)
+
+    results = [('doc{}'.format(i), caseciteparser.parse_tokens(words))
+               for i, words in enumerate(make_random_documents(1000, 300, seed=4))]
+    expected = {}
+    for document, citations in results:
+        for key, pincite in iter_citation_keys(citations):
+            expected.setdefault(key, []).append(Posting(document, pincite))
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, name) for name in ('whole', 'spilled', 'part1', 'part2', 'merged')]
+        build_citation_index(results, paths[0])
+        build_citation_index(results, paths[1], max_buffered_postings=10)
+        build_citation_index(results[:400], paths[2])
+        build_citation_index(results[400:], paths[3], max_buffered_postings=10)
+        merge_indexes(paths[2:4], paths[4])
+        for path in (paths[1], paths[4]):
+            with open(paths[0], 'rb') as f, open(path, 'rb') as g:
+                assert f.read() == g.read(), path
+
+        with caseciteparser.CitationIndex(paths[0]) as index:
+            assert len(index) == len(expected) and index.num_documents == len(results)
+            for key, postings in expected.items():
+                assert index.lookup(*split_key(key)) == postings, key
+            assert index.lookup('1', 'U.S.', '2') == []
+    print("Citation index test passed.")
+
+
+def do_short_cite_test():
+    # Each short cite must point at the latest earlier full cite with its volume and reporter (or a parallel cite's)
+    rng = random.Random(5)
+    sentences = ('Mydlach, 226 Ill. 2d 307, 311, 875 N.E.2d 1047 (2007).', '875 N.E.2d at 1050.',
+                 '226 Ill. 2d at 309.', '12 F.3d 4, 6 (7th Cir. 1990).', '12 F.3d at 5.', '343 U.S. at 585.',
+                 '12 F.3d 9, 875 N.E.2d 1 (1990).', 'the court held that')
+    for _ in range(300):
+        words = ' '.join(rng.choice(sentences) for _ in range(rng.randint(0, 30))).split()
+        expected = caseciteparser.parse_tokens(words)
+        for i, citation in enumerate(expected):
+            if citation['cite_type'] == 'short_cite':
+                for j in range(i - 1, -1, -1):
+                    antecedent = expected[j]
+                    cited = [(antecedent['volume'], antecedent['reporter'])] + \
+                        [(stringcite['volume'], stringcite['reporter'])
+                         for stringcite in antecedent.get('stringcites', ())]
+                    if antecedent['cite_type'] == 'full_cite' and (citation['volume'], citation['reporter']) in cited:
+                        citation['antecedent_index'] = j
+                        break
+
+        for engine in ('fsm', 'table'):
+            assert caseciteparser.parse_tokens(words, engine=engine, resolve_short_cites=True) == expected, words
+            assert [citation.to_dict() for citation in caseciteparser.parse_tokens(
+                words, as_objects=True, engine=engine, resolve_short_cites=True)] == expected, words
+        assert list(caseciteparser.parse_stream(words, resolve_short_cites=True)) == expected, words
+    print("Short cite test passed.")
+
+
+def do_parenthetical_cache_test():
+    # Cached parenthetical results must match fresh ones, with or without surrounding spaces, and be evicted in time
+    from caseciteparser import cite_parser
+
+    paren_strings = ['7th Cir. 1994', ' D. Mass. 1990', '2007 ', 'Jan. 5, 2001', '', 'La.App. 1 Cir. 3']
+    cite_parser.set_parenthetical_cache_size(4)
+    try:
+        for paren_string in paren_strings * 3:
+            assert cite_parser.cached_parenthetical_fsm(paren_string) == cite_parser.parenthetical_fsm(paren_string)
+        info = cite_parser.parenthetical_cache_info()
+        assert info.currsize == 4 and info.hits + info.misses == 18, info
+    finally:
+        cite_parser.set_parenthetical_cache_size(cite_parser.PARENTHETICAL_CACHE_SIZE)
+    print("Parenthetical cache test passed.")
+
+
+def do_tolerant_matching_test():
+    # Spacing, apostrophe, and trailing comma variants must parse like the citations as written
+    for written, variant in (('12 F. Supp. 2d 4 (1990)', '12 F.Supp.2d 4 (1990)'),
+                             ('12 F. Supp. 2d 4 (1990)', '12 F. Supp.2d 4 (1990)'),
+                             ('875 N.E.2d 1047 (2007)', '875 N. E. 2d 1047 (2007)'),
+                             ("5 F. App'x 9 (2001)", '5 F. App’x 9 (2001)'),
+                             ('7 A.D.2d 3 (App. Dep’t 1990)', "7 A.D.2d 3 (App. Dep't 1990)"),
+                             ('343 U.S. at 585', '343 U.S., at 585')):
+        # The strings copied from the text itself differ, of course
+        expected = caseciteparser.parse_string(written)
+        for citation in expected:
+            citation['end_index'] += len(variant.split()) - len(written.split())
+        actual = caseciteparser.parse_string(variant)
+        for citation in expected + actual:
+            del citation['cite_string']
+            citation.pop('date_paren_string', None)
+        assert len(expected) == 1 and actual == expected, (variant, actual, expected)
+
+    # Reporters that merely contain a number, as written or in a spacing variant, can't hide an anchor, so they aren't
+    # always anchors; the anchors must still find what trying every word finds
+    from caseciteparser import constant_data, token_dict
+    from caseciteparser.cite_parser import citation_fsm
+    assert not {'F.', 'P.', 'La.', 'La.App.'} & constant_data.REPORTER_DIGIT_PREFIXES
+    assert token_dict.contains_digit_token_before({'La.App.': {'1': {'F.': {'': 'x'}}}}, {'F.': {}})
+    assert not token_dict.contains_digit_token_before({'La.App.': {'1': {'Cir.': {'': 'x'}}}}, {'F.': {}})
+    rng = random.Random(19)
+    fragments = ['La.App. 1 Cir.', 'La. App. 2 Cir.', 'F. 4th', 'P. 2d', 'p. 2 d', '12', '3', 'F.3d', 'F. Supp.', 'at',
+                 'So. 2d', '(La. App. 1 Cir. 1990)', '5,', 'Id.']
+    for _ in range(300):
+        words = ' '.join(rng.choice(fragments) for _ in range(40)).split()
+        assert citation_fsm(words) == citation_fsm(words, anchors=list(range(1, len(words)))), words
+
+    # Citations as written must parse the same with exact tables, even where a variant runs on past what they match
+    # (e.g., the page number in '12 F. 4' against 'F. 4th')
+    from reporters_db import REPORTERS
+    texts = ['Smith, 12 F. 4 (C.C.D. Mass. 1882).', 'Smith, 12 F. 4, 7 (1882).', '3 So. 2 (1887)']
+    texts.extend('Smith, 5 La. App. {} (1925).'.format(page) for page in range(1, 7))
+    texts.extend('Smith, 12 {} 4 (1990).'.format(edition) for reporter_list in REPORTERS.values()
+                 for reporter in reporter_list for edition in reporter['editions'])
+    texts.extend('Smith, 12 F. 4 ({} 1990).'.format(court) for court in constant_data.COURT_ABBREVIATIONS)
+    texts.extend('Smith, 12 F. 4 (D. Mass. {} 1990).'.format(month) for month in constant_data.MONTH_ABBREVIATIONS)
+    assert all(len(caseciteparser.parse_string(text)) == 1 for text in texts[:9])
+    text = ' '.join(texts)
+    tolerant = {engine: caseciteparser.parse_string(text, engine=engine) for engine in ('fsm', 'table')}
+    original_tables = {name: getattr(constant_data, name) for name in constant_data.TABLE_NAMES + ('TABLE_KEY',)}
+    constant_data.set_tables(dict(constant_data.build_tables(tolerant=False), TABLE_KEY='exact'))
+    try:
+        for engine in ('fsm', 'table'):
+            exact = caseciteparser.parse_string(text, engine=engine)
+            assert tolerant[engine] == exact, engine
+    finally:
+        constant_data.set_tables(original_tables)
+    print("Tolerant matching test passed.")
+
+
+def do_span_test():
+    # parse_spans must find what parse_string finds, with offsets that point back at each citation in the text
+    separators = (' ', '  ', '\n', '\t', ' \u2003 ')
+    rng = random.Random(3)
+    for words in make_random_documents(500, 200, seed=3) + [['7', '²', '727', 'F.', 'Supp.', '1407']]:
+        text = ''.join(word + rng.choice(separators) for word in words)
+        expected = caseciteparser.parse_string(text)
+        for engine in ('fsm', 'table'):
+            citations = caseciteparser.parse_spans(text, engine=engine)
+            for citation in citations:
+                start, end = citation.pop('start_offset'), citation.pop('end_offset')
+                assert text[start:end].split() == citation['cite_string'].split(), (text, citation)
+            assert citations == expected, (text, engine)
+
+        # Byte offsets, for UTF-8 text (split on ASCII whitespace only)
+        data = text.encode('utf-8')
+        citations = caseciteparser.parse_spans(data)
+        for citation in citations:
+            start, end = citation.pop('start_offset'), citation.pop('end_offset')
+            assert data[start:end].decode('utf-8').split() == citation['cite_string'].split(), (text, citation)
+        assert citations == caseciteparser.parse_tokens([word.decode('utf-8') for word in data.split()]), text
+    print("Span test passed.")
+
+
+def do_columnar_test():
+    # Both exports must hold the rows parse_tokens returns, and adding documents after an export must work
+    from caseciteparser.columnar import parse_documents_columnar, parse_year
+    texts = ["Mydlach v. DaimlerChrysler Corp., 226 Ill. 2d 307, 311, 875 N.E.2d 1047 (2007).",
+             "Charlesworth v. Mack, 727 F. Supp. 1407, 1412 (D. Mass. 1990). See 727 F. Supp. at 1410."]
+    documents = [('doc{}'.format(i), words) for i, words in enumerate(make_random_documents(300, 200, seed=11) +
+                                                                      [text.split() for text in texts])]
+    citation_rows = []
+    stringcite_rows = []
+    for document_id, words in documents:
+        for citation in caseciteparser.parse_tokens(words):
+            for stringcite in citation.get('stringcites', ()):
+                stringcite_rows.append((len(citation_rows), stringcite['volume'], stringcite['reporter'],
+                                        stringcite['case_first_page']))
+            citation_rows.append((document_id, citation['start_index'], citation['end_index'], citation['volume'],
+                                  citation['reporter'], citation.get('case_first_page'), citation.get('pincite'),
+                                  citation['cite_type'], parse_year(citation.get('year')) or None,
+                                  citation.get('court_type'), citation.get('court_jursidiction')))
+    assert stringcite_rows and any(row[8] for row in citation_rows) and any(row[9] for row in citation_rows)
+
+    half = len(documents) // 2
+    columns = parse_documents_columnar(documents[:half])
+    num_citations = sum(row[0] in columns.document_ids for row in citation_rows)
+    arrow_tables = columns.to_arrow()
+    for document_id, words in documents[half:]:
+        columns.add_document(document_id, words)
+    assert len(columns) == len(citation_rows)
+
+    def arrow_rows(tables):
+        citations, stringcites = (table.to_pylist() for table in tables)
+        return ([tuple(row.values()) for row in citations], [tuple(row.values()) for row in stringcites])
+
+    # The tables exported before the second half was added are unchanged
+    first_stringcites = [row for row in stringcite_rows if row[0] < num_citations]
+    assert arrow_rows(arrow_tables) == (citation_rows[:num_citations], first_stringcites)
+    assert arrow_rows(columns.to_arrow()) == (citation_rows, stringcite_rows)
+
+    def decode(code, values):
+        return values[code] if code >= 0 else None
+
+    citations, stringcites = columns.to_numpy()
+    assert [(columns.document_ids[row['document_index']], int(row['start_index']), int(row['end_index']),
+             row['volume'] or None, decode(row['reporter'], columns.reporters), row['case_first_page'] or None,
+             row['pincite'] or None, ('full_cite', 'short_cite')[row['cite_type']], int(row['year']) or None,
+             decode(row['court_type'], columns.court_types),
+             decode(row['court_jurisdiction'], columns.court_jurisdictions)) for row in citations] == citation_rows
+    assert [(int(row['citation']), row['volume'], decode(row['reporter'], columns.reporters), row['case_first_page'])
+            for row in stringcites] == stringcite_rows
+    print("Columnar test passed.")
+
+
+def do_counts_test():
+    # Counting during the scan must give the counts of the citation dicts, and merged counts the counts of the whole
+    documents = make_random_documents(300, 200, seed=4)
+    expected = caseciteparser.CitationCounts()
+    halves = caseciteparser.CitationCounts(), caseciteparser.CitationCounts()
+    for i, words in enumerate(documents):
+        expected.add_citations(caseciteparser.parse_tokens(words), len(words))
+        halves[i % 2].add_tokens(words)
+    halves[0].merge(halves[1])
+    assert halves[0] == expected and expected.citations > 0 and expected.courts and expected.years
+    print("Counts test passed.")
+
+
+def do_parse_many_test():
+    # parse_many must return what parse_string returns for each string, with repeated strings getting their own copies
+    strings = [' '.join(words) for words in make_random_documents(2000, 20, seed=5)]
+    strings += strings[:500] + ['', ' ', '7', 'F.3d 5', '12 F.3d', '343 U.S. at 585', '343 U.S. at 585']
+    expected = [caseciteparser.parse_string(string) for string in strings]
+    results = caseciteparser.parse_many(strings)
+    assert results == expected
+    assert [[citation.to_dict() for citation in cite_list]
+            for cite_list in caseciteparser.parse_many(strings, as_objects=True)] == expected
+    assert caseciteparser.parse_many(strings, workers=2, chunk_size=1000) == expected
+    results[-1][0]['stringcites'] = []
+    assert results[-2] == expected[-2]
+    print("parse_many test passed.")
+
+
+def do_parallel_test():
+    # Chunks parsed separately and stitched together must give the sequential result, whether the chunks come back in
+    # step or the stitching has to fall back (small overlaps, long stringcite chains)
+    from caseciteparser.cite_parser import finish_citation
+    from caseciteparser.parallel import PARALLEL_MIN_CHUNK_SIZE, parallel_citation_data
+
+    rng = random.Random(6)
+    chain = " ".join("{} F.3d {},".format(i + 1, i + 2) for i in range(300)).split() + ["(1990)"]
+    documents = make_random_documents(100, 3000, seed=6) + [chain * 3 + list(CITATION_FRAGMENTS) * 10]
+    for words in documents:
+        expected = caseciteparser.parse_tokens(words)
+        for chunk_size, overlap in ((rng.randint(1, 40), rng.randint(0, 10)), (rng.randint(40, 1000), None)):
+            citations = [finish_citation(words, citation_data)
+                         for citation_data in parallel_citation_data(words, 1, chunk_size, overlap)]
+            assert citations == expected, (words, chunk_size, overlap)
+
+    # The same on a real pool, in step and falling back, through parse_tokens too
+    for words, chunk_size, overlap in ((documents[0] * 10, 5000, None), (documents[-1], 500, 20),
+                                       (sum(documents[1:20], []), 3000, 5)):
+        expected = caseciteparser.parse_tokens(words)
+        citations = [finish_citation(words, citation_data)
+                     for citation_data in parallel_citation_data(words, 2, chunk_size, overlap)]
+        assert citations == expected, (chunk_size, overlap)
+
+    words = sum(documents, []) * 2
+    assert len(words) > 2 * PARALLEL_MIN_CHUNK_SIZE
+    for kwargs in ({}, {'as_objects': True, 'engine': 'fsm'}, {'resolve_short_cites': True}):
+        assert caseciteparser.parse_tokens(words, workers=2, **kwargs) == caseciteparser.parse_tokens(words, **kwargs)
+    for kwargs in ({'engine': 'regex'}, {'stats': caseciteparser.CitationStats()},
+                   {'budget': caseciteparser.ParseBudget(max_steps=10)}):
+        try:
+            caseciteparser.parse_tokens(words, workers=2, **kwargs)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(kwargs)
+    print("Parallel test passed.")
+
+
 def do_interactive_tests():
     print("~~~~~INTERACTIVE MODE~~~~~")
 